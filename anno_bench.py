@@ -0,0 +1,87 @@
+from argparse import ArgumentParser
+from timeit import default_timer as timer
+from parsing import whole_program
+from type_check import TypeChecker
+from infer import InferSys
+
+
+# (name, [(param, type)], return type, body), {i} is the copy number
+DEFINES = [
+    ('sum-to{i}', [('n', 'Number'), ('acc', 'Number')], 'Number',
+     '(if (= n 0) acc (sum-to{i} (- n 1) (+ acc n)))'),
+    ('scale{i}', [('k', 'Number'), ('xs', '(List Number)')], '(List Number)',
+     '(match xs [(Cons h t) (cons (* k h) (scale{i} k t))] [(Nil) null])'),
+    ('pick{i}', [('f', '(-> Number Number Bool)'), ('a', 'Number'), ('b', 'Number')], 'Number',
+     '(cond ((f a b) a) ((f b a) b) (#t (+ a b)))'),
+    ('twice{i}', [('g', '(-> Number Number)'), ('x', 'Number')], 'Number',
+     '(g (g x))'),
+    ('poly{i}', [('x', 'Number')], '(List Number)',
+     '(let ((y (* x 2))) (begin (scale{i} y (list x y)) (list (twice{i} (lambda (z) (+ z y)) x) (pick{i} > x y))))'),
+]
+
+
+def program(copies: int, annotated: bool) -> str:
+    forms = []
+    for i in range(copies):
+        for name, params, ret, body in DEFINES:
+            if annotated:
+                args = ' '.join('[{} {}]'.format(p, t) for p, t in params)
+                form = '(define ({} {}) {} {})'.format(name, args, ret, body)
+            else:
+                args = ' '.join(p for p, _ in params)
+                form = '(define ({} {}) {})'.format(name, args, body)
+            forms.append(form.replace('{i}', str(i)))
+    return '\n'.join(forms)
+
+
+class CountingInferSys(InferSys):
+
+    def __init__(self, *args, **kwargs):
+        super(CountingInferSys, self).__init__(*args, **kwargs)
+        self.equation_count = 0
+        self.solve_time = 0
+
+    def add_equation(self, left, right):
+        self.equation_count += 1
+        super(CountingInferSys, self).add_equation(left, right)
+
+    def solve_ir_define(self, env, define):
+        start = timer()
+        ret = super(CountingInferSys, self).solve_ir_define(env, define)
+        self.solve_time += timer() - start
+        return ret
+
+
+def run(r_exprs, bidirectional: bool) -> (float, float, int, int):
+    checker = TypeChecker(bidirectional=bidirectional)
+    infer_sys = checker.infer_sys = CountingInferSys(bidirectional=bidirectional)
+    start = timer()
+    _, _, _, errors = checker.check_content(r_exprs)
+    elapsed = timer() - start
+    assert len(errors) == 0, errors
+    return elapsed, infer_sys.solve_time, infer_sys.count, infer_sys.equation_count
+
+
+def main():
+    parser = ArgumentParser(description='equations and time of annotated and unannotated programs per checking mode')
+    parser.add_argument('--copies', type=int, default=200, help='copies of the sample defines')
+    parser.add_argument('--repeat', type=int, default=5, help='runs, the best one is reported')
+    ARGS = parser.parse_args()
+
+    print('{:<12} {:<14} {:>10} {:>10} {:>9} {:>9}'.format(
+        'source', 'mode', 'variables', 'equations', 'solving', 'check'))
+    for annotated in (False, True):
+        r_exprs = whole_program.parse(program(ARGS.copies, annotated))
+        for bidirectional in (False, True):
+            runs = [run(r_exprs, bidirectional) for _ in range(ARGS.repeat)]
+            elapsed = min(r[0] for r in runs)
+            solving = min(r[1] for r in runs)
+            _, _, variables, equations = runs[0]
+            print('{:<12} {:<14} {:>10} {:>10} {:>8.3f}s {:>8.3f}s'.format(
+                'annotated' if annotated else 'unannotated',
+                'bidirectional' if bidirectional else 'inference',
+                variables, equations, solving, elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,9 @@
+from itertools import chain
 from typing import Set
+from infer import PRELUDE_PATH, set_prelude_path
 from type_check import TypeChecker
 from argparse import ArgumentParser
-from parsing import whole_program
+from parsing import Reader, map_forms, read_forms, whole_program
 from code_gen import gen_ctor_define
 
 
@@ -17,33 +19,38 @@ def main():
     parser.add_argument('script', help='path to script')
     parser.add_argument('--output', help='path to output file', default='out.rkt')
     parser.add_argument('--silent', action='store_true', help='slient success output')
+    parser.add_argument('--stream', action='store_true', help='read and lower the script form by form, dropping each form once it is checked; '
+                        'its IR is kept for the output, so peak memory still scales with the script size')
+    parser.add_argument('--mmap', action='store_true', help='like --stream, reading the script in place from a memory map')
+    parser.add_argument('--prelude', default=PRELUDE_PATH, help='trusted file to load the builtin environment from and save it to')
 
     ARGS = parser.parse_args()
     SCRIPT_PATH = ARGS.script
     SILENT = ARGS.silent
     OUTPUT_PATH = ARGS.output
 
-    with open(SCRIPT_PATH, 'r') as f:
-        SRC = f.read()
-
-    r_exprs = whole_program.parse(SRC)
-
+    set_prelude_path(ARGS.prelude)
+    Reader.PAUSE_GC = True
     checker = TypeChecker()
-    code_gens, record_names, ir_terms, errors = checker.check_content(r_exprs, verbose=not SILENT)
+    if ARGS.mmap:
+        code_gens, record_names, ir_terms, errors = checker.check_stream(map_forms(SCRIPT_PATH), verbose=not SILENT)
+    else:
+        with open(SCRIPT_PATH, 'r') as f:
+            if ARGS.stream:
+                code_gens, record_names, ir_terms, errors = checker.check_stream(read_forms(f), verbose=not SILENT)
+            else:
+                r_exprs = whole_program.parse(f.read())
+                code_gens, record_names, ir_terms, errors = checker.check_content(r_exprs, verbose=not SILENT)
 
     if len(errors) > 0:
         for error in errors:
             print(error)
 
-    compiled_forms = []
-    for code_gen in code_gens:
-        # ctor_gen = gen_ctor_define(ctor_name, ctor_type)
-        compiled_forms.append(code_gen.code_gen())
-
     context = CompileContext(record_names)
 
-    for ir_term in ir_terms:
-        compiled_forms.append(ir_term.to_racket(env=context))
+    # each form is written as soon as it is generated
+    compiled_forms = chain((code_gen.code_gen() for code_gen in code_gens),
+                           (ir_term.to_racket(env=context) for ir_term in ir_terms))
 
     with open(OUTPUT_PATH, 'w') as out_f:
         out_f.write('#lang racket\n\n')
@@ -0,0 +1,77 @@
+from argparse import ArgumentParser
+from timeit import default_timer as timer
+from infer import InferLimits
+from parsing import whole_program
+from type_check import TypeChecker
+
+
+def cons_chain(depth: int) -> str:
+    """
+    (cons 1 (cons 1 ... null))
+    """
+    return '(cons 1 ' * depth + 'null' + ')' * depth
+
+
+def if_chain(depth: int) -> str:
+    """
+    (if #t 0 (if #t 1 ... 0))
+    """
+    return ''.join('(if #t {} '.format(i) for i in range(depth)) + '0' + ')' * depth
+
+
+def begin_chain(depth: int) -> str:
+    """
+    (begin 0 (begin 1 ... 0))
+    """
+    return ''.join('(begin {} '.format(i) for i in range(depth)) + '0' + ')' * depth
+
+
+def let_chain(depth: int) -> str:
+    """
+    (let ((x1 0)) (let ((x2 x1)) ... xn))
+    """
+    lets = ''.join('(let ((x{} {})) '.format(i, 0 if i == 1 else 'x{}'.format(i - 1)) for i in range(1, depth + 1))
+    return lets + 'x{}'.format(depth) + ')' * depth
+
+
+def quote_chain(depth: int) -> str:
+    """
+    '((( ... 1 ...)))
+    """
+    return "'" + '(' * depth + '1' + ')' * depth
+
+
+PROGRAMS = [
+    ('cons', cons_chain),
+    ('if', if_chain),
+    ('begin', begin_chain),
+    ('let', let_chain),
+    ('quote', quote_chain),
+]
+
+
+def main():
+    parser = ArgumentParser(description='reading, lowering and checking deeply nested programs')
+    parser.add_argument('--depths', type=int, nargs='+', default=[10000, 100000], help='nesting depths')
+    ARGS = parser.parse_args()
+
+    print('{:>8} {:>8} {:>10} {:>10} {:>14}'.format('program', 'depth', 'read(s)', 'check(s)', 'us per level'))
+    for name, build in PROGRAMS:
+        for depth in ARGS.depths:
+            src = '(define xs {})'.format(build(depth))
+            start = timer()
+            r_exprs = whole_program.parse(src)
+            read = timer() - start
+            # a quoted list is typed as deep as it is nested
+            checker = TypeChecker(limits=InferLimits(max_depth=None))
+            start = timer()
+            _, _, _, errors = checker.check_content(r_exprs)
+            check = timer() - start
+            assert len(errors) == 0, errors
+            print('{:>8} {:>8} {:>10.4f} {:>10.4f} {:>14.2f}'.format(
+                name, depth, read, check, (read + check) / depth * 1e6))
+            del r_exprs
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+from argparse import ArgumentParser
+from timeit import default_timer as timer
+from parsing import whole_program
+from ir_parse import parse_ir_expr
+from infer import *
+
+
+# one of every expression kind, the late ones in the old isinstance chain included
+FORM = '''
+(let ((xs (list 1 2 3)))
+  (begin
+    (set! n (+ n 1))
+    (match xs
+      ((list a b c) (tuple a (if (> b c) "gt" "le") #\\\\x))
+      (_ (tuple 0 (cond ((= n 0) "zero") ((> n 0) "pos") (#t "neg")) #\\\\y)))
+    ((lambda (y) (cons y (list y 'sym 4.5))) 1)))
+'''
+
+
+def count_nodes(term) -> int:
+    if isinstance(term, (list, tuple)):
+        return sum(count_nodes(t) for t in term)
+    if not isinstance(term, (IRTerm, IRLit)):
+        return 0
+    return 1 + sum(count_nodes(v) for v in vars(term).values())
+
+
+def main():
+    parser = ArgumentParser(description='node throughput of constraint generation')
+    parser.add_argument('--forms', type=int, default=1000, help='copies of the sample form in one begin')
+    parser.add_argument('--repeat', type=int, default=5, help='runs, the best one is reported')
+    ARGS = parser.parse_args()
+
+    src = '(begin {})'.format(' '.join([FORM] * ARGS.forms))
+    expr, errors = parse_ir_expr(whole_program.parse(src)[0])
+    assert len(errors) == 0, errors
+    env = TypeEnv.default().add(IRVar('n'), Schema.none(TYPE_NUMBER))
+    nodes = count_nodes(expr)
+
+    best = None
+    for _ in range(ARGS.repeat):
+        infer_sys = InferSys()
+        start = timer()
+        infer_sys.infer_ir_expr(env, expr)
+        elapsed = timer() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print('{} nodes, {:.4f}s, {:.0f} nodes/s'.format(nodes, best, nodes / best))
+
+
+if __name__ == '__main__':
+    main()
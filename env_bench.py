@@ -0,0 +1,52 @@
+from argparse import ArgumentParser
+from timeit import default_timer as timer
+from infer import *
+
+
+def copy_add(mapping: dict, key: str, value) -> dict:
+    """
+    the add of the dict backed TypeEnv, kept for comparison
+    """
+    new_mapping = mapping.copy()
+    new_mapping[key] = value
+    return new_mapping
+
+
+def time_per_op(f, repeat: int) -> float:
+    start = timer()
+    for i in range(repeat):
+        f(i)
+    return (timer() - start) / repeat * 1e6
+
+
+def main():
+    parser = ArgumentParser(description='cost of extending a type environment as it grows')
+    parser.add_argument('--max', type=int, default=100000, help='largest environment size')
+    parser.add_argument('--repeat', type=int, default=200, help='operations measured per size')
+    ARGS = parser.parse_args()
+
+    schema = Schema.none(TYPE_NUMBER)
+    env = TypeEnv.default()
+    mapping = dict(env.internal.items())
+
+    print('{:>8} {:>14} {:>14} {:>14} {:>14}'.format(
+        'size', 'dict add(us)', 'trie add(us)', 'dict get(us)', 'trie get(us)'))
+    size = 10
+    while size <= ARGS.max:
+        fill = ['v{}'.format(i) for i in range(len(env.internal), size)]
+        env = env.extend((IRVar(name), schema) for name in fill)
+        mapping.update((name, schema) for name in fill)
+
+        probe = [IRVar('probe{}'.format(i)) for i in range(ARGS.repeat)]
+        lookup = [IRVar('v{}'.format(i % size)) for i in range(ARGS.repeat)]
+        dict_add = time_per_op(lambda i: copy_add(mapping, probe[i].v, schema), ARGS.repeat)
+        trie_add = time_per_op(lambda i: env.add(probe[i], schema), ARGS.repeat)
+        dict_get = time_per_op(lambda i: mapping.get(lookup[i].v), ARGS.repeat)
+        trie_get = time_per_op(lambda i: env.get(lookup[i]), ARGS.repeat)
+        print('{:>8} {:>14.2f} {:>14.2f} {:>14.2f} {:>14.2f}'.format(
+            size, dict_add, trie_add, dict_get, trie_get))
+        size *= 10
+
+
+if __name__ == '__main__':
+    main()
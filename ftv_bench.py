@@ -0,0 +1,42 @@
+from argparse import ArgumentParser
+from pathlib import Path
+from timeit import default_timer as timer
+from parsing import whole_program
+from type_check import TypeChecker
+from type_sys import FTV_STATS, reset_ftv_stats
+
+
+def check_file(path: Path) -> int:
+    with open(path, 'r') as f:
+        src = f.read()
+    checker = TypeChecker()
+    _, _, _, errors = checker.check_content(whole_program.parse(src))
+    return len(errors)
+
+
+def main():
+    parser = ArgumentParser(description='count the ftv computations cached types save on a corpus')
+    parser.add_argument('root', nargs='?', default='test_src', help='directory of scripts')
+    ARGS = parser.parse_args()
+
+    paths = sorted(Path(ARGS.root).rglob('*.rkt'))
+    reset_ftv_stats()
+    start = timer()
+    failed = 0
+    for path in paths:
+        if check_file(path) > 0:
+            failed += 1
+    elapsed = timer() - start
+
+    computed = FTV_STATS['computed']
+    cached = FTV_STATS['cached']
+    calls = computed + cached
+    print('{} scripts checked in {:.3f}s, {} with errors'.format(len(paths), elapsed, failed))
+    print('ftv calls:          {:>10}'.format(calls))
+    print('ftv sets built:     {:>10}'.format(computed))
+    print('ftv from cache:     {:>10} ({:.1f}%)'.format(cached, 100 * cached / max(calls, 1)))
+    print('ground type skips:  {:>10}'.format(FTV_STATS['ground']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,243 @@
+from typing import Any, Iterable, Iterator, Tuple as T
+
+BITS = 5
+MASK = (1 << BITS) - 1
+HASH_MASK = (1 << 64) - 1
+
+_MISSING = object()
+
+
+if hasattr(int, 'bit_count'):
+    popcount = int.bit_count
+else:
+    def popcount(x: int) -> int:
+        return bin(x).count('1')
+
+
+class _Node(object):
+    """
+    bitmap indexed node, entries hold (hash, key, value) leaves,
+    child nodes or collision buckets in bit order
+    """
+    __slots__ = ('bitmap', 'entries')
+
+    def __init__(self, bitmap: int, entries: list):
+        self.bitmap = bitmap
+        self.entries = entries
+
+
+class _Collision(object):
+    """
+    keys sharing the full 64 bit hash
+    """
+    __slots__ = ('hash', 'pairs')
+
+    def __init__(self, h: int, pairs: list):
+        self.hash = h
+        self.pairs = pairs
+
+
+EMPTY_NODE = _Node(0, [])
+
+
+def _hash(key) -> int:
+    return hash(key) & HASH_MASK
+
+
+def _merge(shift: int, h1: int, e1, h2: int, e2) -> _Node:
+    """
+    build the smallest node holding two entries with different hashes
+    """
+    i1 = (h1 >> shift) & MASK
+    i2 = (h2 >> shift) & MASK
+    if i1 == i2:
+        return _Node(1 << i1, [_merge(shift + BITS, h1, e1, h2, e2)])
+    if i1 < i2:
+        return _Node((1 << i1) | (1 << i2), [e1, e2])
+    return _Node((1 << i1) | (1 << i2), [e2, e1])
+
+
+def _set(node: _Node, shift: int, h: int, key, value) -> (_Node, bool):
+    bit = 1 << ((h >> shift) & MASK)
+    idx = popcount(node.bitmap & (bit - 1))
+    if not node.bitmap & bit:
+        entries = node.entries[:idx] + [(h, key, value)] + node.entries[idx:]
+        return _Node(node.bitmap | bit, entries), True
+
+    entry = node.entries[idx]
+    if type(entry) is _Node:
+        sub, added = _set(entry, shift + BITS, h, key, value)
+        if sub is entry:
+            return node, False
+        new_entry = sub
+    elif isinstance(entry, _Collision):
+        if entry.hash == h:
+            pairs = [(k, v) for (k, v) in entry.pairs if k != key]
+            added = len(pairs) == len(entry.pairs)
+            pairs.append((key, value))
+            new_entry = _Collision(h, pairs)
+        else:
+            added = True
+            new_entry = _merge(shift + BITS, entry.hash, entry, h, (h, key, value))
+    else:
+        e_hash, e_key, e_value = entry
+        if e_key is key or (e_hash == h and e_key == key):
+            if e_value is value:
+                return node, False
+            new_entry = (h, key, value)
+            added = False
+        elif e_hash == h:
+            new_entry = _Collision(h, [(e_key, e_value), (key, value)])
+            added = True
+        else:
+            new_entry = _merge(shift + BITS, e_hash, entry, h, (h, key, value))
+            added = True
+
+    entries = node.entries[:]
+    entries[idx] = new_entry
+    return _Node(node.bitmap, entries), added
+
+
+def _delete(node: _Node, shift: int, h: int, key) -> (Any, bool):
+    """
+    return the replacement of node (a node, a single entry or None) and
+    whether the key was found
+    """
+    bit = 1 << ((h >> shift) & MASK)
+    if not node.bitmap & bit:
+        return node, False
+    idx = popcount(node.bitmap & (bit - 1))
+    entry = node.entries[idx]
+
+    if isinstance(entry, _Node):
+        new_entry, found = _delete(entry, shift + BITS, h, key)
+    elif isinstance(entry, _Collision):
+        if entry.hash != h:
+            return node, False
+        pairs = [(k, v) for (k, v) in entry.pairs if k != key]
+        found = len(pairs) != len(entry.pairs)
+        if len(pairs) == 1:
+            new_entry = (h, pairs[0][0], pairs[0][1])
+        else:
+            new_entry = _Collision(h, pairs)
+    else:
+        if not (entry[1] is key or (entry[0] == h and entry[1] == key)):
+            return node, False
+        new_entry = None
+        found = True
+
+    if not found:
+        return node, False
+
+    if new_entry is None:
+        bitmap = node.bitmap & ~bit
+        entries = node.entries[:idx] + node.entries[idx + 1:]
+    else:
+        bitmap = node.bitmap
+        entries = node.entries[:]
+        entries[idx] = new_entry
+
+    if len(entries) == 0:
+        return None, True
+    if len(entries) == 1 and not isinstance(entries[0], _Node) and shift > 0:
+        # a lone leaf moves up to its parent
+        return entries[0], True
+    return _Node(bitmap, entries), True
+
+
+def _iter(node: _Node) -> Iterator[T[Any, Any]]:
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        for entry in reversed(node.entries):
+            if isinstance(entry, _Node):
+                stack.append(entry)
+            elif isinstance(entry, _Collision):
+                yield from entry.pairs
+            else:
+                yield entry[1], entry[2]
+
+
+class HashTrie(object):
+    """
+    persistent hash array mapped trie, every update returns a new trie
+    sharing the untouched nodes with the old one
+    """
+    __slots__ = ('root', 'size')
+
+    def __init__(self, root: _Node = EMPTY_NODE, size: int = 0):
+        self.root = root
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __iter__(self):
+        return (k for k, _ in _iter(self.root))
+
+    def __getitem__(self, key):
+        ret = self.get(key, _MISSING)
+        if ret is _MISSING:
+            raise KeyError(key)
+        return ret
+
+    def get(self, key, default=None):
+        h = hash(key) & HASH_MASK
+        node = self.root
+        shift = 0
+        while True:
+            bit = 1 << ((h >> shift) & MASK)
+            if not node.bitmap & bit:
+                return default
+            entry = node.entries[popcount(node.bitmap & (bit - 1))]
+            if isinstance(entry, _Node):
+                node = entry
+                shift += BITS
+                continue
+            if isinstance(entry, _Collision):
+                for k, v in entry.pairs:
+                    if k == key:
+                        return v
+                return default
+            if entry[1] is key or (entry[0] == h and entry[1] == key):
+                return entry[2]
+            return default
+
+    def set(self, key, value) -> 'HashTrie':
+        root, added = _set(self.root, 0, _hash(key), key, value)
+        if root is self.root:
+            return self
+        return HashTrie(root, self.size + 1 if added else self.size)
+
+    def update(self, items: Iterable[T[Any, Any]]) -> 'HashTrie':
+        root = self.root
+        size = self.size
+        for key, value in items:
+            root, added = _set(root, 0, _hash(key), key, value)
+            if added:
+                size += 1
+        return HashTrie(root, size)
+
+    def delete(self, key) -> 'HashTrie':
+        root, found = _delete(self.root, 0, _hash(key), key)
+        if not found:
+            raise KeyError(key)
+        if root is None:
+            root = EMPTY_NODE
+        return HashTrie(root, self.size - 1)
+
+    def items(self) -> Iterator[T[Any, Any]]:
+        return _iter(self.root)
+
+    def keys(self) -> Iterator[Any]:
+        return iter(self)
+
+    def values(self) -> Iterator[Any]:
+        return (v for _, v in _iter(self.root))
+
+    @staticmethod
+    def from_items(items: Iterable[T[Any, Any]]) -> 'HashTrie':
+        return HashTrie().update(items)
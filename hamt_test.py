@@ -0,0 +1,122 @@
+#%%
+from hamt import *
+from hamt import _Collision, _Node, _merge
+
+
+class Key(object):
+    """
+    key with a chosen hash, to force collisions and shared prefixes
+    """
+
+    def __init__(self, name: str, h: int):
+        self.name = name
+        self.h = h
+
+    def __hash__(self):
+        return self.h
+
+    def __eq__(self, other):
+        return isinstance(other, Key) and self.name == other.name
+
+    def __repr__(self):
+        return 'Key({}, {})'.format(self.name, self.h)
+
+
+#%%
+def test_set_get_delete():
+    trie = HashTrie.from_items((i, str(i)) for i in range(1000))
+    assert len(trie) == 1000 and trie[500] == '500' and 1000 not in trie
+    assert sorted(trie.keys()) == list(range(1000))
+    for i in range(0, 1000, 2):
+        trie = trie.delete(i)
+    assert len(trie) == 500 and sorted(trie) == list(range(1, 1000, 2))
+    # setting the value already held is a no-op
+    assert trie.set(1, trie[1]) is trie
+
+
+#%%
+def test_hash_collisions():
+    a, b, c = Key('a', 7), Key('b', 7), Key('c', 7)
+    trie = HashTrie().set(a, 1).set(b, 2).set(c, 3)
+    assert type(trie.root.entries[0]) is _Collision
+    assert len(trie) == 3 and (trie[a], trie[b], trie[c]) == (1, 2, 3)
+    assert Key('d', 7) not in trie
+
+    # replacing a colliding key keeps the size
+    trie = trie.set(b, 20)
+    assert len(trie) == 3 and trie[b] == 20
+
+    # a different hash under the same prefix splits the bucket off
+    d = Key('d', 7 + (1 << BITS))
+    trie = trie.set(d, 4)
+    assert type(trie.root.entries[0]) is _Node and trie[d] == 4 and trie[a] == 1
+
+    # a bucket of one is a plain leaf again
+    trie = trie.delete(a).delete(c)
+    assert len(trie) == 2 and (trie[b], trie[d]) == (20, 4)
+    assert not any(type(e) is _Collision for e in trie.root.entries[0].entries)
+    try:
+        trie.delete(Key('e', 7))
+        assert False
+    except KeyError:
+        pass
+
+
+#%%
+def test_delete_to_empty():
+    keys = [Key(str(i), i << BITS) for i in range(4)]
+    trie = HashTrie.from_items((k, k.name) for k in keys)
+    for k in keys:
+        trie = trie.delete(k)
+    assert len(trie) == 0 and list(trie.items()) == []
+    assert trie.root.bitmap == 0 and trie.root.entries == []
+    assert trie.set(keys[0], 'x')[keys[0]] == 'x'
+
+
+#%%
+def test_delete_to_single_leaf():
+    # both keys share the first 5 bits, so they sit in a child node
+    a, b = Key('a', 3), Key('b', 3 + (1 << BITS))
+    trie = HashTrie().set(a, 1).set(b, 2)
+    assert type(trie.root.entries[0]) is _Node
+    trie = trie.delete(b)
+    # the lone leaf left moves up into the root
+    assert trie.root.entries == [(3, a, 1)]
+    assert len(trie) == 1 and trie[a] == 1 and b not in trie
+
+
+#%%
+def test_merge_overlapping():
+    # hashes equal in their first two 5 bit chunks
+    h1 = 1 | (2 << BITS) | (3 << 2 * BITS)
+    h2 = 1 | (2 << BITS) | (4 << 2 * BITS)
+    e1, e2 = (h1, 'x', 1), (h2, 'y', 2)
+    node = _merge(0, h1, e1, h2, e2)
+    assert node.bitmap == 1 << 1
+    node = node.entries[0]
+    assert node.bitmap == 1 << 2
+    node = node.entries[0]
+    assert node.bitmap == (1 << 3) | (1 << 4)
+    assert node.entries == [e1, e2]
+    # entries come in bit order whatever order they are given in
+    assert _merge(2 * BITS, h2, e2, h1, e1).entries == [e1, e2]
+
+    a, b = Key('a', h1), Key('b', h2)
+    trie = HashTrie().set(b, 2).set(a, 1)
+    assert (trie[a], trie[b]) == (1, 2)
+
+
+#%%
+def test_old_versions_unchanged():
+    base = HashTrie.from_items((i, i) for i in range(100))
+    a, b = Key('a', 9), Key('b', 9)
+    with_bucket = base.set(a, 'a').set(b, 'b')
+    changed = with_bucket.set(50, 'fifty').set(a, 'A')
+    removed = changed.delete(3).delete(b)
+
+    assert len(base) == 100 and base[50] == 50 and a not in base
+    assert sorted(base.items()) == [(i, i) for i in range(100)]
+    assert len(with_bucket) == 102 and with_bucket[50] == 50 and with_bucket[a] == 'a'
+    assert len(changed) == 102 and changed[50] == 'fifty' and changed[a] == 'A' and changed[b] == 'b'
+    assert len(removed) == 100 and 3 not in removed and b not in removed and removed[a] == 'A'
+    assert 3 in changed and changed[b] == 'b'
@@ -1,13 +1,18 @@
+import os
+import pickle
+from timeit import default_timer as timer
+from types import GeneratorType
 from typing import Tuple as T
-from typing import Mapping, Set
+from typing import Mapping, Set, Optional
 from ir import *
 from typing import List
 from ir_lit import *
 from ir_pat import *
 from type_sys import *
 from collections import OrderedDict
+from hamt import HashTrie
 
-Subst = Mapping[str, Type]
+Subst = Mapping[VarId, Type]
 Constraint = T[Type, Type]
 Unifer = Subst
 
@@ -40,6 +45,283 @@ class RecursiveTypeException(UniException):
         super(RecursiveTypeException, self).__init__(error)
 
 
+class BudgetException(UniException):
+    """
+    inference gave up on a type or define that went over an InferLimits bound
+    """
+    pass
+
+
+class InferLimits(object):
+    """
+    bounds on the types inferred for one define and on the time spent on
+    it, None turns a bound off
+    """
+
+    def __init__(self, max_nodes=100000, max_depth=500, max_seconds=None):
+        super(InferLimits, self).__init__()
+        self.max_nodes = max_nodes
+        self.max_depth = max_depth
+        self.max_seconds = max_seconds
+
+    def check_type(self, t: Type, what: str):
+        too_large = self.max_nodes is not None and t.size > self.max_nodes
+        too_deep = self.max_depth is not None and t.depth > self.max_depth
+        if too_large or too_deep:
+            raise BudgetException(
+                'inference budget exceeded: type of {} has {} nodes and depth {}, '
+                'limits are {} nodes and depth {}'.format(
+                    what, t.size, t.depth, self.max_nodes, self.max_depth))
+
+    def check_time(self, start: float):
+        elapsed = timer() - start
+        if elapsed > self.max_seconds:
+            raise BudgetException(
+                'inference budget exceeded: {:.2f}s spent, limit is {}s'.format(elapsed, self.max_seconds))
+
+
+class TypeTable(object):
+    """
+    solved type of every inferred IR node, kept in two flat arrays indexed
+    by node id. ids are handed out in the order nodes finish inference,
+    nodes of a define that failed to check get no id
+    """
+    __slots__ = ('nodes', 'types', 'ids')
+
+    def __init__(self):
+        super(TypeTable, self).__init__()
+        self.nodes = []
+        self.types = []
+        self.ids = None
+
+    def __len__(self):
+        return len(self.types)
+
+    def add(self, node: IRExpr, t: Type):
+        if self.ids is not None:
+            self.ids[id(node)] = len(self.nodes)
+        self.nodes.append(node)
+        self.types.append(t)
+
+    def resolve(self, solver, start: int):
+        """
+        replace the types recorded from start on by their solutions
+        """
+        types = self.types
+        memo = dict()
+        # nodes share types a lot, types are interned so each is solved once
+        solved = dict()
+        for i in range(start, len(types)):
+            t = types[i]
+            if t.ground:
+                continue
+            ret = solved.get(t)
+            if ret is None:
+                ret = solved[t] = solver.resolve(t, memo)
+            types[i] = ret
+
+    def drop(self, start: int):
+        del self.nodes[start:]
+        del self.types[start:]
+        self.ids = None
+
+    def id_of(self, node: IRExpr) -> int:
+        # built on first use, then kept up to date by add and drop
+        if self.ids is None:
+            self.ids = {id(n): i for i, n in enumerate(self.nodes)}
+        return self.ids[id(node)]
+
+    def type_of(self, node: IRExpr) -> Type:
+        return self.types[self.id_of(node)]
+
+
+def sub_terms(node: IRExpr) -> Optional[list]:
+    """
+    the subterms of node in walking order, None for a node kind not
+    known here. the constructors of match patterns count as subterms
+    """
+    kind = type(node)
+    if kind is IRVar:
+        return []
+    elif kind is IRApply:
+        return [node.f] + node.args
+    elif kind is IRLambda:
+        return [node.body]
+    elif kind is IRLet:
+        return [d for _, d in node.envs] + [node.body]
+    elif kind is IRIf:
+        return [node.cond, node.then, node.el]
+    elif kind is IRCond:
+        return [sub for cond in node.conds for sub in cond]
+    elif kind is IRBegin or kind is IRListCtor or kind is IRTupleCtor:
+        return list(node.args)
+    elif kind is IRSet:
+        return [node.sym, node.var]
+    elif kind is IRMatch:
+        ret = [node.v]
+        for pat, arm in node.arms:
+            ctors = pattern_ctors(pat)
+            if ctors is None:
+                return None
+            ret.extend(ctors)
+            ret.append(arm)
+        return ret
+    elif isinstance(node, IRLit):
+        return []
+    return None
+
+
+def pattern_ctors(pat: IRPat) -> Optional[list]:
+    """
+    the constructors pat matches on, None for a pattern kind not known here
+    """
+    ctors = []
+    pats = [pat]
+    while pats:
+        pat = pats.pop()
+        if isinstance(pat, IRCtorPat):
+            ctors.append(pat.ctor)
+            pats.extend(pat.vs)
+        elif isinstance(pat, (IRListPat, IRTuplePat)):
+            pats.extend(pat.vs)
+        elif not isinstance(pat, (IRVarPat, IRLitPat)):
+            return None
+    return ctors
+
+
+def pattern_binds(pat: IRPat) -> Set[str]:
+    binds = set()
+    pats = [pat]
+    while pats:
+        pat = pats.pop()
+        if isinstance(pat, IRVarPat):
+            if pat.var.v != '_':
+                binds.add(pat.var.v)
+        elif isinstance(pat, (IRCtorPat, IRListPat, IRTuplePat)):
+            pats.extend(pat.vs)
+    return binds
+
+
+def closed_terms(term: IRExpr, shape) -> dict:
+    """
+    id of each subterm of term => its free variables, node count and
+    shape, in one walk that does every node after its subterms. shape
+    numbers the tuples it is given, so equal subterms get equal shapes.
+    subterms holding a node kind not known here get None
+    """
+    done = dict()
+    stack = [(term, False)]
+    while stack:
+        node, ready = stack.pop()
+        if not ready:
+            if id(node) in done:
+                continue
+            subs = sub_terms(node)
+            if subs is None:
+                done[id(node)] = None
+            else:
+                stack.append((node, True))
+                stack.extend((sub, False) for sub in subs)
+            continue
+        subs = [done[id(sub)] for sub in sub_terms(node)]
+        if None in subs:
+            done[id(node)] = None
+            continue
+        kind = type(node)
+        size = 1 + sum(sub[1] for sub in subs)
+        shapes = tuple(sub[2] for sub in subs)
+        free = frozenset().union(*(sub[0] for sub in subs))
+        if kind is IRVar:
+            free = frozenset([node.v])
+            parts = (kind, node.v)
+        elif kind is IRLambda:
+            names = tuple(arg.v for arg in node.args)
+            free = subs[0][0].difference(names)
+            parts = (kind, names) + shapes
+        elif kind is IRLet:
+            names = tuple(v.v for v, _ in node.envs)
+            free = frozenset().union(*(sub[0] for sub in subs[:-1]), subs[-1][0].difference(names))
+            parts = (kind, names) + shapes
+        elif kind is IRMatch:
+            free = subs[0][0]
+            parts = [kind, subs[0][2]]
+            i = 1
+            for pat, _ in node.arms:
+                n = len(pattern_ctors(pat))
+                for sub in subs[i:i + n]:
+                    free = free.union(sub[0])
+                arm = subs[i + n]
+                free = free.union(arm[0].difference(pattern_binds(pat)))
+                parts.extend((str(pat.to_raw()), arm[2]))
+                i += n + 1
+            parts = tuple(parts)
+        elif kind is IRString:
+            # the string is held in an RString, which is keyed by identity
+            parts = (kind, node.v.v)
+        elif kind in (IRInt, IRFloat, IRBool, IRChar, IRSymbol):
+            parts = (kind, node.v)
+        elif kind is IRPackedList:
+            # sized by its elements, keyed on them without unpacking
+            size += len(node)
+            values = node.v if type(node.v) is tuple else (node.v.typecode, node.v.tobytes())
+            parts = (kind, node.elem, values)
+        elif isinstance(node, IRLit):
+            parts = (kind, str(node.to_raw()))
+        else:
+            parts = (kind,) + shapes
+        done[id(node)] = (free, size, shape(parts))
+    return done
+
+
+class ClosedCache(object):
+    """
+    generalized types of closed subterms. a term whose free variables
+    all have closed schemas has the same principal type in every context,
+    so it is keyed by its shape and those schemas, least recently used
+    entries go first once max_entries are kept. shapes are numbered here,
+    and all of them are forgotten with the entries once max_shapes are kept
+    """
+    __slots__ = ('schemas', 'max_entries', 'shapes', 'max_shapes', 'hits', 'misses')
+
+    def __init__(self, max_entries=4096, max_shapes=1 << 20):
+        super(ClosedCache, self).__init__()
+        self.schemas = OrderedDict()
+        self.max_entries = max_entries
+        self.shapes = dict()
+        self.max_shapes = max_shapes
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key) -> Optional[Schema]:
+        schema = self.schemas.get(key)
+        if schema is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.schemas.move_to_end(key)
+        return schema
+
+    def put(self, key, schema: Schema):
+        self.schemas[key] = schema
+        if len(self.schemas) > self.max_entries:
+            self.schemas.popitem(last=False)
+
+    def shape(self, parts: tuple) -> int:
+        return self.shapes.setdefault(parts, len(self.shapes))
+
+    def trim(self):
+        """
+        forget every shape and entry once too many shapes are kept,
+        called between walks so no shape in use is renumbered
+        """
+        if len(self.shapes) > self.max_shapes:
+            self.shapes.clear()
+            self.schemas.clear()
+
+    def hit_rate(self) -> float:
+        return self.hits / max(self.hits + self.misses, 1)
+
+
 def compose(origin: Subst, new: Subst) -> Subst:
     ret = dict()
     for k1, v1 in origin.items():
@@ -70,6 +352,209 @@ def unifies(pairs: [(Type, Type)]) -> Subst:
     return ret
 
 
+class UnionFindSolver(object):
+    """
+    incremental unification on a union-find forest of type variables.
+    each variable links either to another variable or to a structural type,
+    so every equation is solved once and nothing is re-applied to the
+    remaining equations.
+    """
+
+    def __init__(self):
+        super(UnionFindSolver, self).__init__()
+        self.links = dict()
+        # let level of each variable created under a let binding,
+        # variables missing here sit at the top level 0
+        self.levels = dict()
+        # (limits, start) of the time budget, checked every 1024 steps
+        self.budget = None
+
+    def find(self, t: Type) -> Type:
+        """
+        return the representative of t, an unbound TVar or a structural type,
+        compressing the path walked on the way
+        """
+        if not isinstance(t, TVar) or t.v not in self.links:
+            return t
+        links = self.links
+        path = []
+        while isinstance(t, TVar) and t.v in links:
+            path.append(t.v)
+            t = links[t.v]
+        for v in path:
+            links[v] = t
+        return t
+
+    def settled(self, t: Type) -> bool:
+        """
+        t mentions no variable bound here, so resolving it changes nothing
+        """
+        if t.ground:
+            FTV_STATS['ground'] += 1
+            return True
+        return self.links.keys().isdisjoint(t.ftv())
+
+    def occurs(self, v: VarId, t: Type) -> bool:
+        seen = set()
+        stack = [t]
+        while stack:
+            t = self.find(stack.pop())
+            if isinstance(t, TVar):
+                if t.v == v:
+                    return True
+                continue
+            if self.settled(t):
+                if v in t.ftv():
+                    return True
+                continue
+            if id(t) in seen:
+                continue
+            seen.add(id(t))
+            if isinstance(t, TArr):
+                stack.append(t.in_type)
+                stack.append(t.out_type)
+            elif isinstance(t, (Tuple, Defined)):
+                stack.extend(t.types)
+        return False
+
+    def lower(self, t: Type, level: int):
+        """
+        pull the free variables of t down to level, they escape with t
+        into the binding of a shallower variable
+        """
+        levels = self.levels
+        for v in self.ftv(t):
+            if levels.get(v, 0) > level:
+                levels[v] = level
+
+    def bind(self, var: TVar, t: Type):
+        if not isinstance(t, TVar) and self.occurs(var.v, t):
+            raise RecursiveTypeException(var, self.resolve(t))
+        if self.levels:
+            self.lower(t, self.levels.get(var.v, 0))
+        self.links[var.v] = t
+
+    def unify(self, t1: Type, t2: Type):
+        stack = [(t1, t2)]
+        steps = 0
+        while stack:
+            steps += 1
+            if not steps & 1023 and self.budget is not None:
+                limits, start = self.budget
+                limits.check_time(start)
+            t1, t2 = stack.pop()
+            t1 = self.find(t1)
+            t2 = self.find(t2)
+            if t1 is t2:
+                continue
+
+            if isinstance(t1, TVar):
+                if not (isinstance(t2, TVar) and t1.v == t2.v):
+                    self.bind(t1, t2)
+                continue
+
+            if isinstance(t2, TVar):
+                self.bind(t2, t1)
+                continue
+
+            if isinstance(t1, TConst) and isinstance(t2, TConst):
+                if t1.name != t2.name:
+                    raise TypeMismatchException(t1, t2)
+                continue
+
+            # push children reversed, so pairs are solved left to right
+            if isinstance(t1, TArr) and isinstance(t2, TArr):
+                stack.append((t1.out_type, t2.out_type))
+                stack.append((t1.in_type, t2.in_type))
+                continue
+
+            if isinstance(t1, Tuple) and isinstance(t2, Tuple):
+                if len(t1.types) != len(t2.types):
+                    raise TypeMismatchException(self.resolve(t1), self.resolve(t2))
+                stack.extend(reversed(list(zip(t1.types, t2.types))))
+                continue
+
+            if isinstance(t1, Defined) and isinstance(t2, Defined):
+                if t1.name != t2.name:
+                    raise TypeMismatchException(self.resolve(t1), self.resolve(t2))
+                stack.extend(reversed(list(zip(t1.types, t2.types))))
+                continue
+
+            raise TypeMismatchException(self.resolve(t1), self.resolve(t2))
+
+    def resolve(self, t: Type, memo=None, nesting=0) -> Type:
+        """
+        substitute every bound variable in t with its solution. bindings
+        can nest without bound, so past RECURSION_MAX_DEPTH levels of
+        recursion the rest is resolved on an explicit stack
+        """
+        if memo is None:
+            memo = dict()
+        t = self.find(t)
+        if isinstance(t, TVar) or self.settled(t):
+            return t
+        key = id(t)
+        if key in memo:
+            return memo[key]
+        if nesting >= RECURSION_MAX_DEPTH:
+            return self.resolve_deep(t, memo)
+        ret = t.rebuild([self.resolve(sub, memo, nesting + 1) for sub in t.sub_types()])
+        memo[key] = ret
+        return ret
+
+    def resolve_deep(self, t: Type, memo) -> Type:
+        """
+        resolve of a t that is not settled, children before parents
+        """
+        stack = [(t, False)]
+        while stack:
+            node, ready = stack.pop()
+            if id(node) in memo:
+                continue
+            subs = [self.find(sub) for sub in node.sub_types()]
+            if not ready:
+                stack.append((node, True))
+                stack.extend((sub, False) for sub in subs
+                             if not (isinstance(sub, TVar) or self.settled(sub)))
+            else:
+                memo[id(node)] = node.rebuild([memo.get(id(sub), sub) for sub in subs])
+        return memo[id(t)]
+
+    def ftv(self, t: Type) -> Set[VarId]:
+        """
+        free type variables of t after substitution
+        """
+        ret = set()
+        seen = set()
+        stack = [t]
+        while stack:
+            t = self.find(stack.pop())
+            if isinstance(t, TVar):
+                ret.add(t.v)
+                continue
+            if self.settled(t):
+                ret.update(t.ftv())
+                continue
+            if id(t) in seen:
+                continue
+            seen.add(id(t))
+            if isinstance(t, TArr):
+                stack.append(t.in_type)
+                stack.append(t.out_type)
+            elif isinstance(t, (Tuple, Defined)):
+                stack.extend(t.types)
+        return ret
+
+    def subst(self) -> Subst:
+        memo = dict()
+        return {v: self.resolve(TVar(v), memo) for v in self.links}
+
+    def solve(self, pairs: [(Type, Type)]) -> Subst:
+        for left, right in pairs:
+            self.unify(left, right)
+        return self.subst()
+
+
 def unify(t1: Type, t2: Type) -> Subst:
     if t1 == t2:
         return dict()
@@ -102,37 +587,58 @@ def unify(t1: Type, t2: Type) -> Subst:
     raise TypeMismatchException(t1, t2)
 
 
+# the builtin environment, built or loaded once per process
+PRELUDE = None
+
+# file the prelude is saved to and loaded from across processes, None
+# keeps it in memory only. loading unpickles the file, so it is never
+# picked by default and has to be a path the user trusts
+PRELUDE_PATH = os.environ.get('TSCHEME_PRELUDE') or None
+
+
+def set_prelude_path(path: Optional[str]):
+    """
+    opt in to saving the prelude at path, before the first TypeEnv.default
+    """
+    global PRELUDE_PATH
+    PRELUDE_PATH = path
+
+
+def prelude_stamp() -> tuple:
+    """
+    the saved prelude is only good for the sources it was built from
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    return tuple(os.stat(os.path.join(here, name)).st_mtime_ns for name in ('infer.py', 'type_sys.py'))
+
+
 class TypeEnv(object):
+    """
+    persistent mapping from symbol to schema, add/extend/remove share
+    structure with the original environment instead of copying it
+    """
 
     def __init__(self, mapping: Mapping[str, Schema]):
         super(TypeEnv, self).__init__()
+        if not isinstance(mapping, HashTrie):
+            mapping = HashTrie.from_items(mapping.items())
         self.internal = mapping
 
     def get(self, sym: IRVar) -> Schema:
-        if sym.v in self.internal:
-            return self.internal[sym.v]
-        else:
-            return None
+        return self.internal.get(sym.v)
 
     def add(self, sym: IRVar, schema: Schema):
-        new_mapping = self.internal.copy()
-        new_mapping[sym.v] = schema
-        return TypeEnv(new_mapping)
+        return TypeEnv(self.internal.set(sym.v, schema))
 
     def extend(self, schemas: [(IRVar, Schema)]):
-        new_mapping = self.internal.copy()
-
-        new_mapping.update(((sym.v, schema) for (sym, schema) in schemas))
-        return TypeEnv(new_mapping)
+        return TypeEnv(self.internal.update((sym.v, schema) for (sym, schema) in schemas))
 
     def remove(self, sym: IRVar):
-        new_mapping = self.internal.copy()
-        del new_mapping[sym.v]
-        return TypeEnv(new_mapping)
+        return TypeEnv(self.internal.delete(sym.v))
 
     @staticmethod
     def empty():
-        return TypeEnv(dict())
+        return TypeEnv(HashTrie())
 
     @staticmethod
     def ops_to_env(ops: Mapping[str, Type]):
@@ -146,6 +652,50 @@ class TypeEnv(object):
 
     @staticmethod
     def default():
+        """
+        the shared builtin environment. it is immutable, so every check
+        starts from the same one instead of building its own. it is read
+        from and saved to PRELUDE_PATH only when one was given
+        """
+        global PRELUDE
+        if PRELUDE is None:
+            if PRELUDE_PATH is not None:
+                PRELUDE = TypeEnv.load(PRELUDE_PATH)
+            if PRELUDE is None:
+                PRELUDE = TypeEnv.build_default()
+                if PRELUDE_PATH is not None:
+                    PRELUDE.dump(PRELUDE_PATH)
+        return PRELUDE
+
+    def dump(self, path: str):
+        """
+        save the environment for later processes, best effort like a .pyc
+        """
+        try:
+            folder = os.path.dirname(path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            with open(path, 'wb') as f:
+                pickle.dump((prelude_stamp(), list(self.internal.items())), f, pickle.HIGHEST_PROTOCOL)
+        except OSError:
+            pass
+
+    @staticmethod
+    def load(path: str) -> Optional['TypeEnv']:
+        """
+        read an environment saved by dump, None when missing or stale
+        """
+        try:
+            with open(path, 'rb') as f:
+                stamp, items = pickle.load(f)
+        except (OSError, EOFError, AttributeError, ValueError, pickle.UnpicklingError):
+            return None
+        if stamp != prelude_stamp():
+            return None
+        return TypeEnv(HashTrie.from_items(items))
+
+    @staticmethod
+    def build_default():
         number = TYPE_NUMBER
         bool = TYPE_BOOL
 
@@ -220,35 +770,118 @@ class TypeEnv(object):
         return TypeEnv(ops)
 
     def apply(self, subst):
-        new_mapping = {k: v.apply(subst) for k, v in self.internal}
-        return TypeEnv(new_mapping)
+        new_mapping = ((k, v.apply(subst)) for k, v in self.internal.items())
+        return TypeEnv(HashTrie.from_items(new_mapping))
 
-    def ftv(self) -> Set[str]:
+    def ftv(self) -> Set[VarId]:
         ret = set()
-        for _, v in self.internal.items():
-            ret = ret.union(v.ftv())
+        for v in self.internal.values():
+            ret.update(v.ftv())
         return ret
 
 
-class InferSys(object):
+class RuleTable(dict):
+    """
+    node type => rule. derived holds the node types whose rule was found
+    on a base class and remembered, they are forgotten whenever a rule is
+    registered since it may be the nearer base now
+    """
+    __slots__ = ('derived',)
+
+    def __init__(self, *args):
+        super(RuleTable, self).__init__(*args)
+        self.derived = set()
+
+    def registered(self) -> 'RuleTable':
+        """
+        the rules registered by rule, without the remembered ones
+        """
+        return RuleTable((t, f) for t, f in self.items() if t not in self.derived)
+
+
+def rule(rules: RuleTable, *node_types):
+    """
+    register the decorated function as the rule of node_types in rules
+    """
+    def register(f):
+        for node_type in rules.derived:
+            del rules[node_type]
+        rules.derived.clear()
+        for node_type in node_types:
+            rules[node_type] = f
+        return f
+    return register
+
+
+def lookup_rule(rules: RuleTable, node_type: type):
+    """
+    the rule of the nearest registered base class of node_type,
+    remembered for node_type so the next lookup is a single get
+    """
+    for base in node_type.__mro__:
+        if base in rules:
+            rules[node_type] = rules[base]
+            rules.derived.add(node_type)
+            return rules[base]
+    return None
 
-    def __init__(self, verbose=False):
+
+class InferSys(object):
+    # node type => rule, rules of new node kinds are added with
+    # rule(InferSys.EXPR_RULES, NodeType) on a function of (self, env, node)
+    EXPR_RULES = RuleTable()
+    LIT_RULES = RuleTable()
+    PAT_RULES = RuleTable()
+    # rules of checking mode, functions of (self, env, node, expected).
+    # node types without one are inferred and equated with expected
+    CHECK_RULES = RuleTable()
+    # closed subterms of these kinds and at least MEMO_MIN_NODES nodes
+    # have their schemas cached when memo_size is set
+    MEMO_KINDS = {IRLambda, IRListCtor, IRTupleCtor, IRList, IRPackedList}
+    MEMO_MIN_NODES = 8
+
+    def __init__(self, verbose=False, limits=None, bidirectional=False, memo_size=0):
         super(InferSys, self).__init__()
         self.count = 0
         self.equations = []
+        self.solver = UnionFindSolver()
+        self.scopes = []
+        self.max_solved = 0
+        self.level = 0
         self.env = TypeEnv.empty()
         self.verbose = verbose
+        self.limits = InferLimits() if limits is None else limits
+        self.budget = None
+        self.error = None
+        self.type_table = None
+        self.table_start = 0
+        # check bodies against their known type instead of inferring them
+        self.bidirectional = bidirectional
+        self.closed_cache = ClosedCache(memo_size) if memo_size > 0 else None
+
+    def open_scope(self):
+        """
+        start a new constraint scope, equations added from now on are solved
+        apart from the enclosing ones
+        """
+        self.scopes.append((self.equations, self.solver))
+        self.equations = []
+        self.solver = UnionFindSolver()
+        self.solver.budget = self.budget
+
+    def close_scope(self):
+        """
+        drop every equation of the innermost scope, results that must
+        outlive it have to be solved and generalized before closing
+        """
+        self.equations, self.solver = self.scopes.pop()
 
     def new_type_var(self):
-        count = self.count
+        v = self.count
         self.count += 1
-        ret = [ord('a') + count % 26]
-        count //= 26
-        while count > 0:
-            ret.append(ord('a') + count % 26)
-            count //= 26
-        ret.reverse()
-        return TVar(''.join(chr(c) for c in ret))
+        if self.level > 0:
+            self.solver.levels[v] = self.level
+        return TVar(v)
 
     def new_type_vars(self, num):
         return [self.new_type_var() for _ in range(num)]
@@ -256,7 +889,7 @@ class InferSys(object):
     def generalize(self, t: Type):
         subst = dict()
         ftv = list(t.ftv())
-        ftv.sort()
+        ftv.sort(key=var_name)
         ps = set()
         for f_var in ftv:
             p = self.new_type_var()
@@ -265,6 +898,15 @@ class InferSys(object):
         t = t.apply(subst)
         return t.gen(ps)
 
+    def generalize_let(self, t: Type) -> Schema:
+        """
+        quantify the variables of a solved let binding that were created
+        under the binding and did not escape to the current level
+        """
+        level = self.level
+        levels = self.solver.levels
+        return t.gen(set(v for v in self.solver.ftv(t) if levels.get(v, 0) > level))
+
     def add_equation(self, left: Type, right: Type):
         if self.verbose:
             print('add equation {} = {}'.format(left, right))
@@ -280,201 +922,516 @@ class InferSys(object):
     def inst(self, schema: Schema):
         if schema.is_dummy():
             return schema.type
-        new_type_vars = {v.v: self.new_type_var() for v in schema.vars}
-        return schema.type.apply(new_type_vars)
+        return schema.instantiate(self.new_type_vars(len(schema.vars)))
 
     def infer_ir_lit(self, ir_lit: IRLit) -> Type:
-        if isinstance(ir_lit, IRInt):
-            return TYPE_NUMBER
-        elif isinstance(ir_lit, IRFloat):
-            return TYPE_NUMBER
-        elif isinstance(ir_lit, IRBool):
-            return TYPE_BOOL
-        elif isinstance(ir_lit, IRSymbol):
-            return TYPE_SYMBOL
-        elif isinstance(ir_lit, IRString):
-            return TYPE_STRING
-        elif isinstance(ir_lit, IRChar):
-            return TYPE_CHAR
-        elif isinstance(ir_lit, IRList):
-            if len(ir_lit.v) == 0:
-                return Defined("List", [self.new_type_var()])
-            else:
-                subs = [self.infer_ir_lit(t) for t in ir_lit.v]
-                for i in range(1, len(ir_lit.v)):
-                    self.add_equation(subs[0], subs[i])
-                return Defined("List", [subs[0]])
+        """
+        run the literal rules on an explicit stack, see infer_ir_expr.
+        a rule of a nested literal yields each item and gets its type back
+        """
+        rules = self.LIT_RULES
+        stack = []
+        while True:
+            infer = rules.get(type(ir_lit)) or lookup_rule(rules, type(ir_lit))
+            if infer is None:
+                raise ValueError("unknown literal type for {}".format(ir_lit))
+            result = infer(self, ir_lit)
+            if type(result) is GeneratorType:
+                stack.append(result)
+                result = None
+            elif not stack:
+                return result
+            while True:
+                try:
+                    ir_lit = stack[-1].send(result)
+                    break
+                except StopIteration as stop:
+                    stack.pop()
+                    if not stack:
+                        return stop.value
+                    result = stop.value
+
+    @rule(LIT_RULES, IRInt, IRFloat)
+    def infer_number_lit(self, ir_lit: IRLit) -> Type:
+        return TYPE_NUMBER
+
+    @rule(LIT_RULES, IRBool)
+    def infer_bool_lit(self, ir_lit: IRBool) -> Type:
+        return TYPE_BOOL
+
+    @rule(LIT_RULES, IRSymbol)
+    def infer_symbol_lit(self, ir_lit: IRSymbol) -> Type:
+        return TYPE_SYMBOL
+
+    @rule(LIT_RULES, IRString)
+    def infer_string_lit(self, ir_lit: IRString) -> Type:
+        return TYPE_STRING
+
+    @rule(LIT_RULES, IRChar)
+    def infer_char_lit(self, ir_lit: IRChar) -> Type:
+        return TYPE_CHAR
+
+    @rule(LIT_RULES, IRList)
+    def infer_list_lit(self, ir_lit: IRList) -> Type:
+        if len(ir_lit.v) == 0:
+            return Defined("List", [self.new_type_var()])
         else:
-            raise ValueError("unknown literal type for {}".format(ir_lit))
-
-    def infer_ir_expr(self, env: TypeEnv, ir_expr: IRExpr) -> Type:
-        if isinstance(ir_expr, IRLit):
-            return self.infer_ir_lit(ir_expr)
-
-        if isinstance(ir_expr, IRVar):
-            out = env.get(ir_expr)
-            if out is None:
-                raise UnboundedVarException(ir_expr.v)
-            return self.inst(out)
+            subs = []
+            for item in ir_lit.v:
+                subs.append((yield item))
+            first = subs[0]
+            # types are interned, elements of one type need no equation
+            for sub in subs[1:]:
+                if sub is not first:
+                    self.add_equation(first, sub)
+            return Defined("List", [first])
+
+    @rule(LIT_RULES, IRPackedList)
+    def infer_packed_list_lit(self, ir_lit: IRPackedList) -> Type:
+        return Defined("List", [self.infer_ir_lit(ir_lit.item(0))])
+
+    def infer_ir_expr(self, env: TypeEnv, ir_expr: IRExpr, expected: Type = None) -> Type:
+        """
+        run the rules on an explicit stack, so nesting depth is bounded
+        by memory instead of the recursion limit. a rule returns the type
+        of a leaf, or is a generator that yields (env, child) for each
+        child it needs, gets the child type back and returns its own type.
+        yielding (env, child, expected) checks the child against expected
+        with the CHECK_RULES instead, as passing expected here does
+        """
+        rules = self.EXPR_RULES
+        checks = self.CHECK_RULES
+        table = self.type_table
+        # the type table wants every node, so cached subterms are not used
+        memo = self.closed_cache if table is None else None
+        if memo is not None:
+            memo.trim()
+            # filled by walking the outermost subterms tried, so each node
+            # is walked once for the nested subterms tried after it
+            closed = dict()
+        stack = []
+        nodes = []
+        steps = 0
+        try:
+            while True:
+                steps += 1
+                if not steps & 1023 and self.budget is not None:
+                    limits, start = self.budget
+                    limits.check_time(start)
+                if expected is None:
+                    result = None
+                    # the root is left out, it is what a cache miss infers
+                    if memo is not None and stack and type(ir_expr) in self.MEMO_KINDS:
+                        if id(ir_expr) not in closed:
+                            closed.update(closed_terms(ir_expr, memo.shape))
+                        key = self.closed_key(env, closed[id(ir_expr)])
+                        if key is not None:
+                            schema = memo.get(key)
+                            if schema is None:
+                                result = self.infer_closed(env, ir_expr, key)
+                            else:
+                                result = self.inst(schema)
+                    if result is None:
+                        infer = rules.get(type(ir_expr)) or lookup_rule(rules, type(ir_expr))
+                        if infer is None:
+                            raise ValueError("unknown ir_expr", ir_expr)
+                        result = infer(self, env, ir_expr)
+                else:
+                    check = checks.get(type(ir_expr)) or lookup_rule(checks, type(ir_expr))
+                    if check is None:
+                        result = self.subsume(env, ir_expr, expected)
+                    else:
+                        result = check(self, env, ir_expr, expected)
+                if type(result) is GeneratorType:
+                    stack.append(result)
+                    if table is not None:
+                        nodes.append(ir_expr)
+                    result = None
+                else:
+                    if table is not None:
+                        table.add(ir_expr, result)
+                    if not stack:
+                        return result
+                while True:
+                    try:
+                        request = stack[-1].send(result)
+                        break
+                    except StopIteration as stop:
+                        stack.pop()
+                        if table is not None:
+                            table.add(nodes.pop(), stop.value)
+                        if not stack:
+                            return stop.value
+                        result = stop.value
+                if len(request) == 2:
+                    env, ir_expr = request
+                    expected = None
+                else:
+                    env, ir_expr, expected = request
+        except BaseException:
+            # unwind the pending rules so their finally blocks run now
+            for pending in reversed(stack):
+                pending.close()
+            raise
+
+    @rule(EXPR_RULES, IRLit)
+    def infer_lit(self, env: TypeEnv, ir_expr: IRLit) -> Type:
+        return self.infer_ir_lit(ir_expr)
+
+    @rule(EXPR_RULES, IRVar)
+    def infer_var(self, env: TypeEnv, ir_expr: IRVar) -> Type:
+        out = env.get(ir_expr)
+        if out is None:
+            raise UnboundedVarException(ir_expr.v)
+        return self.inst(out)
+
+    @rule(EXPR_RULES, IRApply)
+    def infer_apply(self, env: TypeEnv, ir_expr: IRApply) -> Type:
+        ret_type = self.new_type_var()
+        out_type = ret_type
+        f_type = yield env, ir_expr.f
+        for arg in reversed(ir_expr.args):
+            arg_type = yield env, arg
+            out_type = TArr(arg_type, out_type)
+        if len(ir_expr.args) == 0:
+            out_type = TArr(TYPE_UNIT, out_type)
+        self.add_equation(out_type, f_type)
+        return ret_type
+
+    @rule(EXPR_RULES, IRLet)
+    def infer_let(self, env: TypeEnv, ir_expr: IRLet) -> Type:
+        new_env = yield from self.let_env(env, ir_expr)
+        return (yield new_env, ir_expr.body)
+
+    def let_env(self, env: TypeEnv, ir_expr: IRLet) -> TypeEnv:
+        """
+        infer and generalize the bindings of a let, giving the env of its body
+        """
+        new_vars = []
+        for (v, d) in ir_expr.envs:
+            # only the equations of the binding are solved here,
+            # the pending ones of the enclosing expression stay
+            mark = len(self.equations)
+            self.level += 1
+            try:
+                d_type = yield env, d
+                self.solve_equations(mark)
+            finally:
+                self.level -= 1
+            self.limits.check_type(d_type, v.v)
+            d_type = self.solver.resolve(d_type)
+            self.limits.check_type(d_type, v.v)
+            new_vars.append((v, self.generalize_let(d_type)))
+        return env.extend(new_vars)
+
+    @rule(EXPR_RULES, IRLambda)
+    def infer_lambda(self, env: TypeEnv, ir_expr: IRLambda) -> Type:
+        args = []
+        for arg in ir_expr.args:
+            args.append((arg, Schema.none(self.new_type_var())))
+        new_env = env.extend(args)
+        if len(ir_expr.args) == 0:
+            args.append((None, Schema.none(TYPE_UNIT)))
+        body_type = yield new_env, ir_expr.body
+        ret = body_type
+        for _, schema in reversed(args):
+            ret = TArr(schema.type, ret)
+        return ret
 
-        if isinstance(ir_expr, IRApply):
-            ret_type = self.new_type_var()
-            out_type = ret_type
-            f_type = self.infer_ir_expr(env, ir_expr.f)
-            for arg in reversed(ir_expr.args):
-                arg_type = self.infer_ir_expr(env, arg)
-                out_type = TArr(arg_type, out_type)
-            if len(ir_expr.args) == 0:
-                out_type = TArr(TYPE_UNIT, out_type)
-            self.add_equation(out_type, f_type)
-            return ret_type
-
-        if isinstance(ir_expr, IRLet):
-            new_vars = []
-            for (v, d) in ir_expr.envs:
-                d_type = self.infer_ir_expr(env, d)
-                subst = unifies(self.equations)
-                d_type = d_type.apply(subst)
-                # new_env = env.add(v, d_type.gen(env.ftv()))
-                new_vars.append((v, d_type.gen(env.ftv())))
-            new_env = env.extend(new_vars)
-            body = ir_expr.body
-            return self.infer_ir_expr(new_env, body)
-
-        if isinstance(ir_expr, IRLambda):
-            args = []
-            for arg in ir_expr.args:
-                args.append((arg, Schema.none(self.new_type_var())))
-            new_env = env.extend(args)
-            if len(ir_expr.args) == 0:
-                args.append((None, Schema.none(TYPE_UNIT)))
-            body_type = self.infer_ir_expr(new_env, ir_expr.body)
-            ret = body_type
-            for _, schema in reversed(args):
-                ret = TArr(schema.type, ret)
-            return ret
-
-        if isinstance(ir_expr, IRIf):
-            cond = ir_expr.cond
-            then = ir_expr.then
-            el = ir_expr.el
-            cond_type = self.infer_ir_expr(env, cond)
-            then_type = self.infer_ir_expr(env, then)
-            el_type = self.infer_ir_expr(env, el)
-            self.add_equation(then_type, el_type)
+    @rule(EXPR_RULES, IRIf)
+    def infer_if(self, env: TypeEnv, ir_expr: IRIf) -> Type:
+        cond = ir_expr.cond
+        then = ir_expr.then
+        el = ir_expr.el
+        cond_type = yield env, cond
+        then_type = yield env, then
+        el_type = yield env, el
+        self.add_equation(then_type, el_type)
+        self.add_equation(cond_type, TYPE_BOOL)
+        return el_type
+
+    @rule(EXPR_RULES, IRCond)
+    def infer_cond(self, env: TypeEnv, ir_expr: IRCond) -> Type:
+        conds = ir_expr.conds
+        types = []
+        for cond, arm in conds:
+            cond_type = yield env, cond
+            arm_type = yield env, arm
+            types.append((cond_type, arm_type))
+        first_cond_type, first_arm_type = types[0]
+        self.add_equation(first_cond_type, TYPE_BOOL)
+        for (cond_type, arm_type) in types[1:]:
             self.add_equation(cond_type, TYPE_BOOL)
-            return el_type
-
-        if isinstance(ir_expr, IRCond):
-            conds = ir_expr.conds
-            types = [
-                (self.infer_ir_expr(env, cond), self.infer_ir_expr(env, arm))
-                for cond, arm in conds
-            ]
-            first_cond_type, first_arm_type = types[0]
-            self.add_equation(first_cond_type, TYPE_BOOL)
-            for (cond_type, arm_type) in types[1:]:
-                self.add_equation(cond_type, TYPE_BOOL)
-                self.add_equation(arm_type, first_arm_type)
-            return first_arm_type
-
-        if isinstance(ir_expr, IRBegin):
-            for arg in ir_expr.args:
-                arg_type = self.infer_ir_expr(env, arg)
-
-            return arg_type
-
-        if isinstance(ir_expr, IRSet):
-            sym_type = self.infer_ir_expr(env, ir_expr.sym)
-            var_type = self.infer_ir_expr(env, ir_expr.var)
-            self.add_equation(sym_type, var_type)
+            self.add_equation(arm_type, first_arm_type)
+        return first_arm_type
+
+    @rule(EXPR_RULES, IRBegin)
+    def infer_begin(self, env: TypeEnv, ir_expr: IRBegin) -> Type:
+        for arg in ir_expr.args:
+            arg_type = yield env, arg
+
+        return arg_type
+
+    @rule(EXPR_RULES, IRSet)
+    def infer_set(self, env: TypeEnv, ir_expr: IRSet) -> Type:
+        sym_type = yield env, ir_expr.sym
+        var_type = yield env, ir_expr.var
+        self.add_equation(sym_type, var_type)
+        return TYPE_UNIT
+
+    @rule(EXPR_RULES, IRMatch)
+    def infer_match(self, env: TypeEnv, ir_expr: IRMatch) -> Type:
+        v_type = yield env, ir_expr.v
+        arm_types = []
+        for (pat, arm) in ir_expr.arms:
+            new_env = self.pat_env(env, pat, v_type)
+            arm_types.append((yield new_env, arm))
+
+        self.add_equations(arm_types)
+        return arm_types[0]
+
+    def pat_env(self, env: TypeEnv, pat: IRPat, v_type: Type) -> TypeEnv:
+        """
+        match pat against a value of v_type, giving the env of its arm
+        """
+        pat_type, binds = self.infer_ir_pat(env, pat)
+        self.add_equation(v_type, pat_type)
+        binds = [(var, Schema.none(t)) for var, t in binds]
+        return env.extend(binds)
+
+    @rule(EXPR_RULES, IRListCtor)
+    def infer_list_ctor(self, env: TypeEnv, ir_expr: IRListCtor) -> Type:
+        elem_type = None
+        elem_types = []
+        for elem in ir_expr.args:
+            elem_type = yield env, elem
+            elem_types.append(elem_type)
+
+        self.add_equations(elem_types)
+        if elem_type is None:
+            elem_type = self.new_type_var()
+
+        return Defined("List", [elem_type])
+
+    @rule(EXPR_RULES, IRTupleCtor)
+    def infer_tuple_ctor(self, env: TypeEnv, ir_expr: IRTupleCtor) -> Type:
+        if len(ir_expr.args) == 0:
             return TYPE_UNIT
-
-        if isinstance(ir_expr, IRMatch):
-            v_type = self.infer_ir_expr(env, ir_expr.v)
-            arm_types = []
-            for (pat, arm) in ir_expr.arms:
-                pat_type, binds = self.infer_ir_pat(env, pat)
-                self.add_equation(v_type, pat_type)
-                if len(binds) > 0:
-                    pass
-                    # print('get bindings from pat:', pat)
-                # for t_var, t in binds:
-                    # print(t_var, '=>', t)
-                binds = [(var, Schema.none(t)) for var, t in binds]
-                new_env = env.extend(binds)
-                arm_types.append(self.infer_ir_expr(new_env, arm))
-
-            self.add_equations(arm_types)
-            return arm_types[0]
-
-        if isinstance(ir_expr, IRListCtor):
-            elem_type = None
-            elem_types = []
-            for elem in ir_expr.args:
-                elem_type = self.infer_ir_expr(env, elem)
-                elem_types.append(elem_type)
-
-            self.add_equations(elem_types)
-            if elem_type is None:
-                elem_type = self.new_type_var()
-
-            return Defined("List", [elem_type])
-
-        if isinstance(ir_expr, IRTupleCtor):
-            if len(ir_expr.args) == 0:
-                return TYPE_UNIT
+        else:
+            arg_types = []
+            for arg in ir_expr.args:
+                arg_types.append((yield env, arg))
+            return Tuple(arg_types)
+
+    def closed_key(self, env: TypeEnv, closed) -> Optional[tuple]:
+        """
+        the closed cache key of a subterm from its closed_terms entry,
+        None when it is too small or not closed in env
+        """
+        if closed is None or closed[1] < self.MEMO_MIN_NODES:
+            return None
+        free, _, shape = closed
+        schemas = []
+        for name in sorted(free):
+            schema = env.get(IRVar(name))
+            if schema is None or schema.ftv():
+                return None
+            schemas.append(schema)
+        return shape, tuple(schemas)
+
+    def infer_closed(self, env: TypeEnv, ir_expr: IRExpr, key) -> Type:
+        """
+        infer and generalize a closed subterm apart on a closed cache miss,
+        its children go on the stack of infer_ir_expr like any others
+        """
+        rules = self.EXPR_RULES
+        infer = rules.get(type(ir_expr)) or lookup_rule(rules, type(ir_expr))
+        if infer is None:
+            raise ValueError("unknown ir_expr", ir_expr)
+        self.open_scope()
+        try:
+            t = infer(self, env, ir_expr)
+            if type(t) is GeneratorType:
+                t = yield from t
+            self.solve_equations()
+            t = self.solver.resolve(t)
+        finally:
+            self.close_scope()
+        schema = t.gen(t.ftv())
+        self.closed_cache.put(key, schema)
+        return self.inst(schema)
+
+    def subsume(self, env: TypeEnv, ir_expr: IRExpr, expected: Type) -> Type:
+        """
+        check ir_expr by inferring its type and equating it with expected
+        """
+        rules = self.EXPR_RULES
+        infer = rules.get(type(ir_expr)) or lookup_rule(rules, type(ir_expr))
+        if infer is None:
+            raise ValueError("unknown ir_expr", ir_expr)
+        t = infer(self, env, ir_expr)
+        if type(t) is GeneratorType:
+            t = yield from t
+        if t is not expected:
+            self.add_equation(expected, t)
+        return t
+
+    @rule(CHECK_RULES, IRLit)
+    def check_lit(self, env: TypeEnv, ir_expr: IRLit, expected: Type) -> Type:
+        t = self.infer_ir_lit(ir_expr)
+        if t is not expected:
+            self.add_equation(expected, t)
+        return t
+
+    @rule(CHECK_RULES, IRVar)
+    def check_var(self, env: TypeEnv, ir_expr: IRVar, expected: Type) -> Type:
+        t = self.infer_var(env, ir_expr)
+        if t is not expected:
+            self.add_equation(expected, t)
+        return t
+
+    @rule(CHECK_RULES, IRApply)
+    def check_apply(self, env: TypeEnv, ir_expr: IRApply, expected: Type) -> Type:
+        f_type = self.solver.find((yield env, ir_expr.f))
+        # arguments go down checked against the parameters known to be
+        # ground, the others are inferred and meet f_type in one equation
+        arrow = f_type
+        arg_types = []
+        for arg in ir_expr.args:
+            if isinstance(arrow, TArr):
+                param = arrow.in_type
+                arrow = self.solver.find(arrow.out_type)
             else:
-                arg_types = [self.infer_ir_expr(env, arg) for arg in ir_expr.args]
-                return Tuple(arg_types)
-
-        raise ValueError("unknown ir_expr", ir_expr)
+                param = arrow = None
+            if param is not None and param.ground:
+                arg_types.append((yield env, arg, param))
+            else:
+                arg_types.append((yield env, arg))
+        if len(ir_expr.args) == 0:
+            arg_types.append(TYPE_UNIT)
+        out_type = TArr.func(*arg_types, expected)
+        if out_type is not f_type:
+            self.add_equation(out_type, f_type)
+        return expected
+
+    @rule(CHECK_RULES, IRLet)
+    def check_let(self, env: TypeEnv, ir_expr: IRLet, expected: Type) -> Type:
+        new_env = yield from self.let_env(env, ir_expr)
+        return (yield new_env, ir_expr.body, expected)
+
+    @rule(CHECK_RULES, IRLambda)
+    def check_lambda(self, env: TypeEnv, ir_expr: IRLambda, expected: Type) -> Type:
+        arrow = self.solver.find(expected)
+        arg_types = []
+        for _ in ir_expr.args or [None]:
+            if not isinstance(arrow, TArr):
+                return (yield from self.subsume(env, ir_expr, expected))
+            arg_types.append(arrow.in_type)
+            arrow = self.solver.find(arrow.out_type)
+        if len(ir_expr.args) == 0 and arg_types[0] is not TYPE_UNIT:
+            return (yield from self.subsume(env, ir_expr, expected))
+        new_env = env.extend([(arg, Schema.none(t)) for arg, t in zip(ir_expr.args, arg_types)])
+        yield new_env, ir_expr.body, arrow
+        return expected
+
+    @rule(CHECK_RULES, IRIf)
+    def check_if(self, env: TypeEnv, ir_expr: IRIf, expected: Type) -> Type:
+        yield env, ir_expr.cond, TYPE_BOOL
+        yield env, ir_expr.then, expected
+        yield env, ir_expr.el, expected
+        return expected
+
+    @rule(CHECK_RULES, IRCond)
+    def check_cond(self, env: TypeEnv, ir_expr: IRCond, expected: Type) -> Type:
+        for cond, arm in ir_expr.conds:
+            yield env, cond, TYPE_BOOL
+            yield env, arm, expected
+        return expected
+
+    @rule(CHECK_RULES, IRBegin)
+    def check_begin(self, env: TypeEnv, ir_expr: IRBegin, expected: Type) -> Type:
+        for arg in ir_expr.args[:-1]:
+            yield env, arg
+        return (yield env, ir_expr.args[-1], expected)
+
+    @rule(CHECK_RULES, IRMatch)
+    def check_match(self, env: TypeEnv, ir_expr: IRMatch, expected: Type) -> Type:
+        v_type = yield env, ir_expr.v
+        for (pat, arm) in ir_expr.arms:
+            yield self.pat_env(env, pat, v_type), arm, expected
+        return expected
+
+    @rule(CHECK_RULES, IRListCtor)
+    def check_list_ctor(self, env: TypeEnv, ir_expr: IRListCtor, expected: Type) -> Type:
+        list_type = self.solver.find(expected)
+        if not isinstance(list_type, Defined) or list_type.name != 'List' or len(list_type.types) != 1:
+            return (yield from self.subsume(env, ir_expr, expected))
+        elem_type = list_type.types[0]
+        for elem in ir_expr.args:
+            yield env, elem, elem_type
+        return expected
+
+    @rule(CHECK_RULES, IRTupleCtor)
+    def check_tuple_ctor(self, env: TypeEnv, ir_expr: IRTupleCtor, expected: Type) -> Type:
+        tuple_type = self.solver.find(expected)
+        if not isinstance(tuple_type, Tuple) or len(tuple_type.types) != len(ir_expr.args):
+            return (yield from self.subsume(env, ir_expr, expected))
+        for arg, arg_type in zip(ir_expr.args, tuple_type.types):
+            yield env, arg, arg_type
+        return expected
 
     def infer_ir_pat(self, env: TypeEnv, pat: IRPat) -> (Type, [(TVar, Type)]):
-
-        if isinstance(pat, IRVarPat):
-            if pat.var.v == '_':
-                return self.new_type_var(), []
-
-            # t = self.infer_ir_expr(env, pat.var)
-            t = self.new_type_var()
-            return t, [(pat.var, t)]
-
-        if isinstance(pat, IRListPat):
-            elem_type = None
-            binds = []
-            v_types = []
-            for v in pat.vs:
-                t, v_binds = self.infer_ir_pat(env, v)
-                binds.extend(v_binds)
-                v_types.append(t)
-                elem_type = t
-            self.add_equations(v_types)
-            if elem_type is None:
-                elem_type = self.new_type_var()
-            return Defined("List", [elem_type]), binds
-
-        if isinstance(pat, IRTuplePat):
-            binds = []
-            v_types = []
-            for v in pat.vs:
-                t, v_binds = self.infer_ir_pat(env, v)
-                binds.extend(v_binds)
-                v_types.append(t)
-            ret_type = Tuple(v_types) if len(v_types) > 0 else TYPE_UNIT
-            return ret_type, binds
-
-        if isinstance(pat, IRCtorPat):
-            ctor_t = self.infer_ir_expr(env, pat.ctor)
-            binds = []
-            ret_t = self.new_type_var()
-            actual_t = ret_t
-            for v in reversed(pat.vs):
-                v_t, v_binds = self.infer_ir_pat(env, v)
-                actual_t = TArr(v_t, actual_t)
-                binds.extend(v_binds)
-            self.add_equation(actual_t, ctor_t)
-            return ret_t, binds
+        infer = self.PAT_RULES.get(type(pat)) or lookup_rule(self.PAT_RULES, type(pat))
+        if infer is None:
+            raise ValueError("unknown pattern", pat)
+        return infer(self, env, pat)
+
+    @rule(PAT_RULES, IRVarPat)
+    def infer_var_pat(self, env: TypeEnv, pat: IRVarPat) -> (Type, [(TVar, Type)]):
+        if pat.var.v == '_':
+            return self.new_type_var(), []
+
+        t = self.new_type_var()
+        return t, [(pat.var, t)]
+
+    @rule(PAT_RULES, IRListPat)
+    def infer_list_pat(self, env: TypeEnv, pat: IRListPat) -> (Type, [(TVar, Type)]):
+        elem_type = None
+        binds = []
+        v_types = []
+        for v in pat.vs:
+            t, v_binds = self.infer_ir_pat(env, v)
+            binds.extend(v_binds)
+            v_types.append(t)
+            elem_type = t
+        self.add_equations(v_types)
+        if elem_type is None:
+            elem_type = self.new_type_var()
+        return Defined("List", [elem_type]), binds
+
+    @rule(PAT_RULES, IRTuplePat)
+    def infer_tuple_pat(self, env: TypeEnv, pat: IRTuplePat) -> (Type, [(TVar, Type)]):
+        binds = []
+        v_types = []
+        for v in pat.vs:
+            t, v_binds = self.infer_ir_pat(env, v)
+            binds.extend(v_binds)
+            v_types.append(t)
+        ret_type = Tuple(v_types) if len(v_types) > 0 else TYPE_UNIT
+        return ret_type, binds
+
+    @rule(PAT_RULES, IRCtorPat)
+    def infer_ctor_pat(self, env: TypeEnv, pat: IRCtorPat) -> (Type, [(TVar, Type)]):
+        ctor_t = self.infer_ir_expr(env, pat.ctor)
+        binds = []
+        ret_t = self.new_type_var()
+        actual_t = ret_t
+        for v in reversed(pat.vs):
+            v_t, v_binds = self.infer_ir_pat(env, v)
+            actual_t = TArr(v_t, actual_t)
+            binds.extend(v_binds)
+        self.add_equation(actual_t, ctor_t)
+        return ret_t, binds
 
     def infer_var_define(self, env: TypeEnv, define: IRVarDefine) -> Type:
         sym = define.sym
@@ -528,12 +1485,7 @@ class InferSys(object):
             to_env = [(arg, Schema.none(arg_type)) for arg, arg_type in zip(define.args, args_type)]
             to_env.append((define.sym, schema))
 
-            body_type = self.infer_ir_expr(
-                env.extend(to_env),
-                define.body
-            )
-
-            self.add_equation(ret_type, body_type)
+            self.infer_body(env.extend(to_env), define.body, ret_type)
 
             return unknown_type
 
@@ -563,15 +1515,21 @@ class InferSys(object):
         to_env = [(arg, Schema.none(arg_type)) for arg, arg_type in zip(args, args_type)]
         to_env.append((sym, schema))
 
-        body_type = self.infer_ir_expr(
-            env.extend(to_env),
-            body
-        )
-
-        self.add_equation(ret_type, body_type)
+        self.infer_body(env.extend(to_env), body, ret_type)
 
         return unknown_type
 
+    def infer_body(self, env: TypeEnv, body: IRExpr, ret_type: Type):
+        """
+        make body of type ret_type, checking it in bidirectional mode so
+        the types an annotation gives are pushed down into it
+        """
+        if self.bidirectional:
+            self.infer_ir_expr(env, body, ret_type)
+        else:
+            body_type = self.infer_ir_expr(env, body)
+            self.add_equation(ret_type, body_type)
+
     def infer_ir_many_def(self, env: TypeEnv, defs: [IRDef]) -> [Type]:
         schemas = [self.infer_ir_schema(_def) for _def in defs]
         syms = [_def.sym for _def in defs]
@@ -580,13 +1538,49 @@ class InferSys(object):
         types = [self.infer_ir_def_with_schema(common_env, _def, schema) for _def, schema in zip(defs, schemas)]
         return types
 
+    def start_budget(self):
+        """
+        start the time budget of one define, solve_* call it on entry
+        """
+        self.error = None
+        if self.type_table is not None:
+            self.table_start = len(self.type_table)
+        if self.limits.max_seconds is None:
+            self.budget = None
+        else:
+            self.budget = (self.limits, timer())
+        self.solver.budget = self.budget
+
+    def fail(self, e: UniException) -> str:
+        self.error = e
+        if self.type_table is not None:
+            self.type_table.drop(self.table_start)
+        return e.why
+
+    def solved(self, t: Type, what: str) -> Type:
+        # a solution is at least as large as t, so a t over the limits
+        # fails before resolving walks all of it
+        self.limits.check_type(t, what)
+        t = self.solver.resolve(t)
+        self.limits.check_type(t, what)
+        return t
+
+    def solve_table(self):
+        """
+        resolve the node types the current define added to the type table
+        """
+        if self.type_table is not None:
+            self.type_table.resolve(self.solver, self.table_start)
+
     def solve_ir_many_def(self, env: TypeEnv, defs: [IRDef]) -> [Type]:
+        self.start_budget()
         try:
             types = self.infer_ir_many_def(env, defs)
-            subst = self.solve_curr_equation()
-            types = [t.apply(subst) for t in types]
+            self.solve_equations()
+            types = [self.solved(t, _def.sym.v) for t, _def in zip(types, defs)]
+            self.solve_table()
         except UniException as e:
-            return None, e.why
+            return None, self.fail(e)
 
         return types, None
 
@@ -595,37 +1589,174 @@ class InferSys(object):
             subst = self.solve_curr_equation()
             return subst, None
         except UniException as e:
-            return None, e.why
+            return None, self.fail(e)
 
     def solve_ir_expr(self, env: TypeEnv, expr: IRExpr) -> (Type, str):
+        self.start_budget()
         try:
             t = self.infer_ir_expr(env, expr)
-            subst = self.solve_curr_equation()
+            self.solve_equations()
+            t = self.solved(t, 'expression')
+            self.solve_table()
         except UniException as e:
-            return None, e.why
+            return None, self.fail(e)
 
-        return t.apply(subst), None
+        return t, None
 
     def solve_ir_define(self, env: TypeEnv, define: IRDefine) -> (Type, str):
+        self.start_budget()
         try:
             t = self.infer_ir_define(env, define)
-            subst = self.solve_curr_equation()
+            self.solve_equations()
+            t = self.solved(t, define.sym.v)
+            self.solve_table()
         except UniException as e:
-            return None, e.why
+            return None, self.fail(e)
 
-        return t.apply(subst), None
+        return t, None
 
     def solve_var_define(self, env: TypeEnv, define: IRVarDefine):
+        self.start_budget()
         try:
             t = self.infer_var_define(env, define)
-            subst = self.solve_curr_equation()
+            self.solve_equations()
+            t = self.solved(t, define.sym.v)
+            self.solve_table()
         except UniException as e:
-            return None, e.why
+            return None, self.fail(e)
+
+        return t, None
 
-        return t.apply(subst), None
+    def solve_equations(self, start=0):
+        """
+        feed the pending equations from start on into the scope's solver
+        """
+        pending = self.equations[start:]
+        self.max_solved = max(self.max_solved, len(pending))
+        for left, right in pending:
+            self.solver.unify(left, right)
+        del self.equations[start:]
 
     def solve_curr_equation(self) -> Subst:
-        return unifies(self.equations)
+        self.solve_equations()
+        return self.solver.subst()
+
+
+class BlameSolver(UnionFindSolver):
+    """
+    solver of the blame run. it remembers the equation that bound each
+    variable and the variables walked while solving the current one,
+    and does no path compression so no binding is skipped
+    """
+
+    def __init__(self):
+        super(BlameSolver, self).__init__()
+        self.origins = dict()
+        self.current = None
+        self.touched = set()
+
+    def find(self, t: Type) -> Type:
+        links = self.links
+        while isinstance(t, TVar) and t.v in links:
+            self.touched.add(t.v)
+            t = links[t.v]
+        return t
+
+    def bind(self, var: TVar, t: Type):
+        super(BlameSolver, self).bind(var, t)
+        self.origins[var.v] = self.current
+
+
+def blame_rule(infer):
+    """
+    wrap a rule so every equation it adds is charged to its node
+    """
+    def run(self, env: TypeEnv, node: IRExpr):
+        parent = self.blame_node
+        self.blame_node = node
+        result = infer(self, env, node)
+        if type(result) is not GeneratorType:
+            self.blame_node = parent
+            return result
+        return self.resume_blamed(node, parent, result)
+    return run
+
+
+class BlameInferSys(InferSys):
+    """
+    slow inference run again on a define that failed, it records the IR
+    node behind each equation and reports the nodes of the conflicting
+    ones with their place in the source
+    """
+
+    def __init__(self, sources: Mapping[IRExpr, RExpr], form: RExpr, limits=None):
+        super(BlameInferSys, self).__init__(limits=limits)
+        self.EXPR_RULES = RuleTable((t, blame_rule(f)) for t, f in InferSys.EXPR_RULES.registered().items())
+        self.solver = BlameSolver()
+        self.sources = sources
+        self.form = form
+        self.blame_node = None
+        self.equation_nodes = []
+
+    def open_scope(self):
+        super(BlameInferSys, self).open_scope()
+        self.solver = BlameSolver()
+        self.solver.budget = self.budget
+
+    def resume_blamed(self, node: IRExpr, parent: IRExpr, rule):
+        result = None
+        try:
+            while True:
+                self.blame_node = node
+                try:
+                    request = rule.send(result)
+                except StopIteration as stop:
+                    self.blame_node = parent
+                    return stop.value
+                result = yield request
+        finally:
+            rule.close()
+
+    def infer_ir_def_with_schema(self, env: TypeEnv, define: IRDef, schema: Schema) -> Type:
+        # equations added outside any rule, such as the return type of a
+        # define in a group, are charged to the define, described by its
+        # form in sources
+        self.blame_node = define
+        try:
+            return super(BlameInferSys, self).infer_ir_def_with_schema(env, define, schema)
+        finally:
+            self.blame_node = None
+
+    def add_equation(self, left: Type, right: Type):
+        super(BlameInferSys, self).add_equation(left, right)
+        self.equation_nodes.append(self.blame_node)
+
+    def solve_equations(self, start=0):
+        solver = self.solver
+        pending = list(zip(self.equations[start:], self.equation_nodes[start:]))
+        del self.equations[start:]
+        del self.equation_nodes[start:]
+        for (left, right), node in pending:
+            solver.current = node
+            solver.touched = set()
+            try:
+                solver.unify(left, right)
+            except UniException as e:
+                nodes = [node]
+                for v in sorted(solver.touched, key=var_name):
+                    origin = solver.origins.get(v)
+                    if origin not in nodes:
+                        nodes.append(origin)
+                raise UniException('\n'.join([e.why] + [self.describe(n) for n in nodes]))
+
+    def describe(self, node: IRExpr) -> str:
+        source = self.form if node is None else self.sources.get(node, node.to_raw())
+        text = str(source)
+        if len(text) > 60:
+            text = text[:57] + '...'
+        if source.span is None:
+            return '  constraint from {}'.format(text)
+        return '  constraint from {} in {}'.format(text, source.span)
 
 
 def anno_to_schema(anno: Type, sys: InferSys):
@@ -644,7 +1775,7 @@ def anno_to_schema(anno: Type, sys: InferSys):
     return Schema(anno.apply(subst), free_vars)
 
 
-def confirm(infered: Type, anno: Type, subst=None) -> (bool, Mapping[str, TVar]):
+def confirm(infered: Type, anno: Type, subst=None) -> (bool, Mapping[VarId, TVar]):
 
     if subst is None:
         subst = dict()
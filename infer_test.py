@@ -0,0 +1,512 @@
+#%%
+import sys
+import infer
+from infer import *
+from parsing import whole_program
+from ir_parse import parse_define, parse_ir_expr
+from type_check import TypeChecker
+
+
+def check_src(src: str) -> TypeChecker:
+    checker = TypeChecker()
+    _, _, _, errors = checker.check_content(whole_program.parse(src))
+    assert len(errors) == 0, errors
+    return checker
+
+
+def chained_defines(n: int) -> str:
+    lines = ['(define (f0 x) (cons x null))']
+    for i in range(1, n):
+        lines.append('(define (f{} x) (cons (car (f{} x)) null))'.format(i, i - 1))
+    return '\n'.join(lines)
+
+
+#%%
+def test_scope_discards_equations():
+    infer_sys = InferSys()
+    infer_sys.add_equation(TVar('a'), TYPE_NUMBER)
+    infer_sys.open_scope()
+    infer_sys.add_equation(TVar('b'), TYPE_BOOL)
+    assert len(infer_sys.equations) == 1
+    infer_sys.close_scope()
+    assert infer_sys.equations == [(TVar('a'), TYPE_NUMBER)]
+
+
+#%%
+def test_equations_per_define_bounded():
+    small = check_src(chained_defines(5)).infer_sys
+    large = check_src(chained_defines(100)).infer_sys
+    assert large.max_solved == small.max_solved
+    assert large.equations == []
+
+
+#%%
+def test_let_generalization():
+    src = '''
+    (define (f x) (let ((id (lambda (y) y))) (tuple (id 1) (id #t) x)))
+    (define (g x) (let ((y x)) (+ y 1)))
+    '''
+    infer_sys = InferSys()
+    env = TypeEnv.default()
+    for form in whole_program.parse(src):
+        define, errors = parse_define(form)
+        t, msg = infer_sys.solve_ir_define(env, define)
+        assert msg is None, msg
+        env = env.add(define.sym, infer_sys.generalize(t))
+    f_type = env.get(IRVar('f')).type
+    g_type = env.get(IRVar('g')).type
+    assert f_type.out_type.types[:2] == (TYPE_NUMBER, TYPE_BOOL)
+    assert g_type == TArr(TYPE_NUMBER, TYPE_NUMBER)
+
+
+#%%
+def test_types_are_interned():
+    a = TVar('a')
+    t = TArr(Defined("List", [a]), Tuple([a, TYPE_NUMBER]))
+    assert t is TArr(Defined("List", [TVar('a')]), Tuple((a, TYPE_NUMBER)))
+    assert t.apply({'b': TYPE_BOOL}) is t
+    assert t.apply({'a': TYPE_BOOL}) is TArr(Defined("List", [TYPE_BOOL]), Tuple([TYPE_BOOL, TYPE_NUMBER]))
+
+
+#%%
+def test_ftv_cached_and_ground():
+    t = TArr(Defined("List", [TVar('a')]), TVar('b'))
+    assert t.ftv() == {'a', 'b'}
+    assert t.ftv() is t.ftv()
+    assert not t.ground
+    ground = TArr(Defined("List", [TYPE_NUMBER]), TYPE_BOOL)
+    assert ground.ground and ground.ftv() == set()
+    assert Schema(t, [TVar('a')]).ftv() == {'b'}
+
+
+#%%
+def test_let_levels():
+    src = '''
+    (define (h x) (let ((k (lambda (y) (let ((z y)) (tuple z x))))) (tuple (k 1) (k #t))))
+    '''
+    infer_sys = InferSys()
+    define, _ = parse_define(whole_program.parse(src)[0])
+    t, msg = infer_sys.solve_ir_define(TypeEnv.default(), define)
+    assert msg is None, msg
+    assert str(t.out_type) == '((Number, {0}), (Bool, {0}))'.format(t.in_type)
+    assert infer_sys.level == 0
+
+
+#%%
+def test_numbered_type_vars():
+    infer_sys = InferSys()
+    vs = infer_sys.new_type_vars(28)
+    assert vs[0].v == 0 and vs[27].v == 27
+    assert [str(v) for v in (vs[0], vs[25], vs[26], vs[27])] == ['a', 'z', 'ba', 'bb']
+    assert str(infer_sys.generalize(TArr(vs[25], vs[26]))) == 'forall bc.bd => bd -> bc'
+
+
+#%%
+def test_union_find_matches_unifies():
+    a, b, c, d = TVar('a'), TVar('b'), TVar('c'), TVar('d')
+    cases = [
+        [(a, b), (b, TYPE_NUMBER)],
+        [(TArr(a, b), TArr(b, a))],
+        [(TArr(b, c), a), (b, c)],
+        [(Tuple([a, b]), Tuple([b, TYPE_NUMBER])), (c, Defined('List', [a]))],
+        [(Defined('List', [a]), Defined('List', [TArr(b, c)])), (b, d), (d, TYPE_BOOL)],
+        [(a, TArr(b, c)), (c, Tuple([b, d])), (d, TYPE_NUMBER)],
+        # occurs checks, directly and through a chain of variables
+        [(a, TArr(a, TYPE_NUMBER))],
+        [(Defined('List', [a]), Defined('List', [TArr(b, c)])), (c, a)],
+        # constructor mismatches
+        [(Defined('List', [a]), Defined('Tree', [a]))],
+        [(Tuple([a]), Tuple([a, b]))],
+        [(TArr(a, b), Tuple([a, b]))],
+        [(a, TYPE_NUMBER), (a, TYPE_BOOL)],
+    ]
+
+    def canonical(t: Type) -> str:
+        # both solvers may pick another variable of a class as its root,
+        # so variables are renamed in the order they first appear
+        root = t
+        names = dict()
+        stack = [t]
+        while stack:
+            t = stack.pop()
+            if isinstance(t, TVar):
+                names.setdefault(t.v, TVar('v{}'.format(len(names))))
+            elif isinstance(t, TArr):
+                stack.extend((t.out_type, t.in_type))
+            elif isinstance(t, (Tuple, Defined)):
+                stack.extend(reversed(t.types))
+        return str(root.apply(names))
+
+    failures = []
+    for pairs in cases:
+        vs = Tuple([a, b, c, d])
+        try:
+            expected = vs.apply(unifies(pairs))
+        except UniException as e:
+            expected = type(e)
+        solver = UnionFindSolver()
+        try:
+            for left, right in pairs:
+                solver.unify(left, right)
+            got = solver.resolve(vs)
+        except UniException as e:
+            got = type(e)
+        if isinstance(expected, Type):
+            assert isinstance(got, Type), pairs
+            assert canonical(got) == canonical(expected), pairs
+        else:
+            assert got is expected, pairs
+            failures.append(got)
+    assert failures == [RecursiveTypeException] * 2 + [TypeMismatchException] * 4
+
+
+#%%
+def test_prelude_shared_and_saved(tmp_path):
+    assert TypeEnv.default() is TypeEnv.default()
+    path = str(tmp_path / 'prelude.pickle')
+    TypeEnv.build_default().dump(path)
+    loaded = TypeEnv.load(path)
+    built = TypeEnv.build_default()
+    assert loaded.get(IRVar('cons')).type is built.get(IRVar('cons')).type
+    assert len(loaded.internal) == len(built.internal)
+    assert TypeEnv.load(str(tmp_path / 'missing.pickle')) is None
+
+    # the prelude is only saved where asked to
+    shared, shared_path = infer.PRELUDE, infer.PRELUDE_PATH
+    saved = str(tmp_path / 'saved' / 'prelude.pickle')
+    infer.PRELUDE = None
+    set_prelude_path(saved)
+    try:
+        TypeEnv.default()
+        assert TypeEnv.load(saved) is not None
+    finally:
+        infer.PRELUDE = shared
+        set_prelude_path(shared_path)
+
+
+#%%
+def test_prelude_relative_path(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    TypeEnv.build_default().dump('pre.pickle')
+    assert (tmp_path / 'pre.pickle').exists()
+    loaded = TypeEnv.load('pre.pickle')
+    assert loaded is not None
+    assert loaded.get(IRVar('cons')).type is TypeEnv.build_default().get(IRVar('cons')).type
+
+
+#%%
+def test_schema_template():
+    a, b = TVar('a'), TVar('b')
+    schema = Schema(TArr.func(TArr.func(a, b, b), b, Defined("List", [a]), Tuple([b, TYPE_NUMBER])), [a, b])
+    fresh = InferSys().new_type_vars(2)
+    assert schema.instantiate(fresh) is schema.type.apply({'a': fresh[0], 'b': fresh[1]})
+    assert schema.instantiate([TYPE_BOOL, TYPE_NUMBER]).ground
+
+
+#%%
+def test_register_expr_rule():
+    class IRHole(IRVar):
+        pass
+
+    class IRNamedHole(IRHole):
+        pass
+
+    # rules go in a copy of the table, so the shared one is left alone
+    class HoleInferSys(InferSys):
+        EXPR_RULES = InferSys.EXPR_RULES.registered()
+
+    # subclasses fall back to the rule of their base class
+    env = TypeEnv.default()
+    assert str(HoleInferSys().infer_ir_expr(env, IRNamedHole('car'))) == 'List a -> a'
+
+    @rule(HoleInferSys.EXPR_RULES, IRHole)
+    def infer_hole(infer_sys, env, ir_expr):
+        return TYPE_UNIT
+
+    assert HoleInferSys().infer_ir_expr(env, IRNamedHole('car')) is TYPE_UNIT
+    assert IRHole not in InferSys.EXPR_RULES and IRNamedHole not in InferSys.EXPR_RULES
+
+
+#%%
+def test_deep_nesting():
+    expr = IRVar('null')
+    for _ in range(5 * sys.getrecursionlimit()):
+        expr = IRApply(IRVar('cons'), [IRInt(1), expr])
+    infer_sys = InferSys()
+    t, msg = infer_sys.solve_ir_expr(TypeEnv.default(), expr)
+    assert msg is None, msg
+    assert str(t) == 'List Number'
+
+    bad = IRLet([(IRVar('x'), IRLet([(IRVar('y'), IRVar('missing'))], IRVar('y')))], IRVar('x'))
+    t, msg = infer_sys.solve_ir_expr(TypeEnv.default(), bad)
+    assert t is None and 'missing' in msg
+    assert infer_sys.level == 0
+
+    # read, lowered and checked from source, quoted lists included
+    depth = 5 * sys.getrecursionlimit()
+    cons = '(define xs {})'.format('(cons 1 ' * depth + 'null' + ')' * depth)
+    quoted = "(define ys '{})".format('(' * depth + '1' + ')' * depth)
+    checker = TypeChecker(limits=InferLimits(max_depth=None))
+    _, _, ir_terms, errors = checker.check_content(whole_program.parse(cons + quoted))
+    assert len(errors) == 0, errors
+    assert str(ir_terms[0].to_raw()) == cons
+    assert str(ir_terms[1].to_raw()) == quoted.replace("'", '(quote ') + ')'
+
+
+#%%
+def test_deep_program_fails_cleanly():
+    from compiler import CompileContext
+    depth = 5 * sys.getrecursionlimit()
+    src = '''(define xs {})
+(define ys '{})
+(define zs {})'''.format('(cons 1 ' * depth + 'null' + ')' * depth,
+                         '(a ' * depth + '()' + ')' * depth,
+                         '[' * depth + 'x' + ']' * depth)
+    checker = TypeChecker(limits=InferLimits(max_depth=None))
+    _, record_names, ir_terms, errors = checker.check_content(whole_program.parse(src))
+    # the two ill-typed defines are reported and every define still compiles
+    assert len(errors) == 2
+    assert 'type mismatch' in errors[0].msg
+    assert 'Unbounded variable x' in errors[1].msg
+    context = CompileContext(record_names)
+    outs = [ir_term.to_racket(env=context).pretty_print() for ir_term in ir_terms]
+    assert [out[:14] for out in outs] == ['(define xs (co', "(define ys '(a", '(define zs (((']
+
+
+#%%
+def test_blame_failed_define():
+    src = '''(define (f x)
+  (if x
+      (+ x 1)
+      0))
+(define (g y) (+ y 1))'''
+    checker = TypeChecker()
+    _, _, _, errors = checker.check_content(whole_program.parse(src))
+    assert len(errors) == 1
+    lines = errors[0].msg.split('\n')
+    assert lines[0] == 'type error, unification error: type mismatch Number, Bool'
+    assert lines[1].startswith('  constraint from (if x (+ x 1) 0) in (ln:2 col:3')
+    assert lines[2].startswith('  constraint from (+ x 1) in (ln:3 col:7')
+
+
+#%%
+def test_blame_mutual_define():
+    # g returns Bool where f needs a Number, the group is blamed in order
+    forms = whole_program.parse('''(define (f n) (+ (g n) 1))
+(define (g n) (begin (f n) #t))''')
+    msg = TypeChecker().define_failure(TypeEnv.default(), forms, 'unblamed')
+    lines = msg.split('\n')
+    assert lines[0] == 'type error, unification error: type mismatch Number, Bool'
+    assert lines[1].startswith('  constraint from (define (g n) (begin (f n) #t)) in (ln:2 col:1')
+    assert lines[2].startswith('  constraint from (+ (g n) 1) in (ln:1 col:15')
+
+    _, _, _, errors = TypeChecker().check_content(forms)
+    assert len(errors) == 1 and '(define (f n) (+ (g n) 1)) in' not in errors[0].msg
+
+
+#%%
+def test_type_budget():
+    src = '''
+    (define (pair x) (tuple x x))
+    (define blow
+      (let ((f1 (lambda (x) (pair (pair x)))))
+      (let ((f2 (lambda (x) (f1 (f1 x)))))
+      (let ((f3 (lambda (x) (f2 (f2 x)))))
+        (f3 1)))))
+    (define ok (+ 1 2))
+    '''
+    checker = TypeChecker(limits=InferLimits(max_nodes=100))
+    _, _, _, errors = checker.check_content(whole_program.parse(src))
+    assert len(errors) == 1
+    assert errors[0].msg.startswith('inference budget exceeded: type of f3 has 513 nodes and depth 10')
+
+    expr = IRVar('null')
+    for _ in range(2000):
+        expr = IRApply(IRVar('cons'), [IRInt(1), expr])
+    infer_sys = InferSys(limits=InferLimits(max_seconds=0))
+    t, msg = infer_sys.solve_ir_expr(TypeEnv.default(), expr)
+    assert t is None and isinstance(infer_sys.error, BudgetException)
+
+
+#%%
+def test_deep_types():
+    # types deeper than the recursion limit are solved, shown and
+    # instantiated, and going over max_depth is a budget error
+    depth = 2 * sys.getrecursionlimit()
+    expr = IRVar('x0')
+    for i in reversed(range(depth)):
+        expr = IRLambda([IRVar('x{}'.format(i))], expr)
+    infer_sys = InferSys(limits=InferLimits(max_depth=None))
+    t, msg = infer_sys.solve_ir_expr(TypeEnv.default(), expr)
+    assert msg is None, msg
+    assert t.depth == depth + 1 and len(t.ftv()) == depth
+    assert show_type(t).count(' -> ') == depth
+    schema = infer_sys.generalize(t)
+    assert infer_sys.inst(schema).depth == depth + 1
+
+    t, msg = InferSys(limits=InferLimits(max_depth=depth)).solve_ir_expr(TypeEnv.default(), expr)
+    assert t is None and msg.startswith('inference budget exceeded')
+
+    src = '(define (f0 x) (cons x null))\n(define blow\n{}(f13 1){})'.format(
+        ''.join('(let ((f{} (lambda (x) (f{} (f{} x)))))\n'.format(i, i - 1, i - 1) for i in range(1, 14)), ')' * 13)
+    limits = InferLimits(max_nodes=1000, max_depth=10 * sys.getrecursionlimit())
+    _, _, _, errors = TypeChecker(limits=limits).check_content(whole_program.parse(src))
+    assert len(errors) == 1 and 'type of f10 has 1027 nodes' in errors[0].msg
+
+
+#%%
+def test_type_table():
+    src = '''
+    (define (twice f x) (f (f x)))
+    (twice (lambda (n) (+ n 1)) 2)
+    '''
+    checker = TypeChecker()
+    _, _, ir_terms, table, errors = checker.check_typed_content(whole_program.parse(src))
+    assert len(errors) == 0
+    twice, expr = ir_terms
+    assert len(table) == 13
+    assert str(table.type_of(twice.body.args[0])) == 'c'
+    assert str(table.type_of(twice.body.args[0].f)) == 'c -> c'
+    assert str(table.type_of(expr)) == 'Number'
+    assert str(table.type_of(expr.args[0])) == 'Number -> Number'
+    assert table.nodes[-1] is expr
+    assert checker.infer_sys.type_table is None
+
+    _, _, ir_terms, table, errors = checker.check_typed_content(whole_program.parse('(define bad (+ 1 #t))'))
+    assert len(errors) == 1 and len(table) == 0
+
+    # ids follow nodes dropped and added after a lookup
+    table = TypeTable()
+    old, new = IRVar('old'), IRVar('new')
+    table.add(IRVar('kept'), TYPE_BOOL)
+    table.add(old, TYPE_BOOL)
+    assert table.id_of(old) == 1
+    table.drop(1)
+    table.add(new, TYPE_NUMBER)
+    assert table.type_of(new) is TYPE_NUMBER
+    try:
+        table.id_of(old)
+        assert False
+    except KeyError:
+        pass
+
+
+#%%
+def test_bidirectional_check():
+    src = '''
+    (define (twice [g (-> Number Number)] [x Number]) Number (g (g x)))
+    (define (scale [k Number] [xs (List Number)]) (List Number)
+      (match xs
+        [(Cons h t) (cons (* k h) (scale k t))]
+        [(Nil) null]))
+    (define (use [x Number]) (List Number)
+      (let ((y (* x 2))) (scale y (list (twice (lambda (z) (+ z y)) x) y))))
+    '''
+    plain = TypeChecker()
+    bidirectional = TypeChecker(bidirectional=True)
+    for checker in (plain, bidirectional):
+        _, _, _, errors = checker.check_content(whole_program.parse(src))
+        assert len(errors) == 0, errors
+    assert bidirectional.infer_sys.count < plain.infer_sys.count
+
+    wrong = '(define (f [x Number]) Bool (if x 1 2))'
+    _, _, _, errors = TypeChecker(bidirectional=True).check_content(whole_program.parse(wrong))
+    assert len(errors) == 1 and 'type mismatch' in errors[0].msg
+
+
+#%%
+def test_packed_list_lit():
+    numbers = ' '.join(str(i) for i in range(100))
+    expr, _ = parse_ir_expr(whole_program.parse("'({})".format(numbers))[0])
+    assert isinstance(expr, IRPackedList) and expr.v.typecode == 'q'
+    assert str(expr.to_raw()) == '(quote ({}))'.format(numbers)
+    infer_sys = InferSys()
+    assert infer_sys.infer_ir_expr(TypeEnv.default(), expr) == Defined('List', [TYPE_NUMBER])
+    assert infer_sys.equations == []
+
+    bools, _ = parse_ir_expr(whole_program.parse("'({})".format(' '.join(['#t', '#f'] * 40)))[0])
+    assert isinstance(bools, IRPackedList) and str(bools.to_lit()).startswith('(#t #f #t')
+
+    # strings are kept as their text and wrapped again when unpacked
+    words = ' '.join('"w{}"'.format(i) for i in range(100))
+    r_strings = whole_program.parse("'({})".format(words))[0]
+    strings, _ = parse_ir_expr(r_strings)
+    assert isinstance(strings, IRPackedList) and all(type(s) is str for s in strings.v)
+    unpacked = IRList([parse_ir_expr(r)[0] for r in r_strings.v[1].v])
+    assert strings.to_raw().pretty_print() == unpacked.to_raw().pretty_print()
+    assert str(infer_sys.infer_ir_expr(TypeEnv.default(), strings)) == 'List String'
+
+    # equal packed lists share a closed cache entry
+    memo_sys = InferSys(memo_size=2)
+    table, _ = parse_ir_expr(whole_program.parse("(tuple '({0}) '({0}))".format(numbers))[0])
+    t, msg = memo_sys.solve_ir_expr(TypeEnv.default(), table)
+    assert msg is None and str(t) == '(List Number, List Number)'
+    assert (memo_sys.closed_cache.hits, memo_sys.closed_cache.misses) == (1, 1)
+
+    mixed, _ = parse_ir_expr(whole_program.parse("'({} #t)".format(numbers))[0])
+    assert isinstance(mixed, IRList)
+    infer_sys.infer_ir_expr(TypeEnv.default(), mixed)
+    assert infer_sys.equations == [(TYPE_NUMBER, TYPE_BOOL)]
+
+
+#%%
+def test_show_shared_type():
+    a = TVar('a')
+    t = a
+    for _ in range(40):
+        t = Tuple([t, t])
+    text = str(TArr(t, TYPE_NUMBER))
+    assert text.startswith('(#1, #1) -> Number where #1 = (#2, #2), #2 = (#3, #3)')
+    assert text.endswith(', #36 = ((((a, a), (a, a)), ((a, a), (a, a))), (((a, a), (a, a)), ((a, a), (a, a))))')
+    assert show_type(t, limit=20) == '(#1, #1) where #1 = ...'
+    assert str(Defined('List', [TArr(a, a)])) == 'List (a -> a)'
+
+    fresh = [TVar(0)]
+    copy = Schema(t, [a]).instantiate(fresh)
+    assert copy.types[0] is copy.types[1] and copy.size == t.size
+    assert copy.ftv() == {0}
+
+
+#%%
+def test_closed_cache():
+    step = '(lambda (x y) (if (< x y) (+ x 1) (- y 1)))'
+    expr, _ = parse_ir_expr(whole_program.parse('(list {} {})'.format(step, step))[0])
+    infer_sys = InferSys(memo_size=2)
+    t = infer_sys.infer_ir_expr(TypeEnv.default(), expr)
+    infer_sys.solve_equations()
+    assert str(infer_sys.solver.resolve(t)) == 'List (Number -> Number -> Number)'
+    cache = infer_sys.closed_cache
+    assert (cache.hits, cache.misses, len(cache.schemas)) == (1, 1, 1)
+
+    # z is bound outside the lambda, so its type depends on the context
+    open_step = '(lambda (z) (list (lambda (x y) (if (< x y) (+ x z) (- y z)))))'
+    expr, _ = parse_ir_expr(whole_program.parse(open_step)[0])
+    infer_sys.infer_ir_expr(TypeEnv.default(), expr)
+    assert len(cache.schemas) == 1
+
+    for n in range(2, 5):
+        other = '(list (lambda (x y) (if (< x y) (+ x {}) (- y 1))))'.format(n)
+        expr, _ = parse_ir_expr(whole_program.parse(other)[0])
+        infer_sys.infer_ir_expr(TypeEnv.default(), expr)
+    assert len(cache.schemas) == 2 and cache.hit_rate() == 0.2
+
+    # strings are keyed by their text, so two defines sharing a lambda hit
+    tag = '(list (lambda (x y) (if (< x y) (tuple "lt" x) (tuple "ge" y))))'
+    checker = TypeChecker(memo_size=2)
+    _, _, _, errors = checker.check_content(whole_program.parse(
+        '(define f {})\n(define g {})'.format(tag, tag)))
+    assert len(errors) == 0, errors
+    cache = checker.infer_sys.closed_cache
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # closed lambdas nested past the recursion limit, each a subterm
+    # tried once, and the second copy is a hit on the whole first one
+    depth = 5 * sys.getrecursionlimit()
+    nested = IRLambda([IRVar('x')], IRVar('x'))
+    for _ in range(depth):
+        nested = IRLambda([IRVar('x')], IRBegin([nested, IRVar('x')]))
+    infer_sys = InferSys(memo_size=depth)
+    t, msg = infer_sys.solve_ir_expr(TypeEnv.default(), IRTupleCtor([nested, nested]))
+    assert msg is None, msg
+    cache = infer_sys.closed_cache
+    assert str(t).count(' -> ') == 2 and (cache.hits, cache.misses) == (1, depth - 1)
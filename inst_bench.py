@@ -0,0 +1,44 @@
+from argparse import ArgumentParser
+from timeit import default_timer as timer
+from infer import *
+
+
+def apply_inst(schema: Schema, fresh: [Type]) -> Type:
+    """
+    the substitution based instantiation, kept for comparison
+    """
+    subst = {v.v: t for v, t in zip(schema.vars, fresh)}
+    return schema.type.apply(subst)
+
+
+def rate(inst, schemas, fresh, repeat: int) -> float:
+    start = timer()
+    for _ in range(repeat):
+        for schema in schemas:
+            inst(schema, fresh)
+    return repeat * len(schemas) / (timer() - start)
+
+
+def main():
+    parser = ArgumentParser(description='instantiation throughput of the prelude schemas')
+    parser.add_argument('--repeat', type=int, default=2000, help='rounds over the prelude')
+    ARGS = parser.parse_args()
+
+    env = TypeEnv.default()
+    schemas = [s for s in env.internal.values() if not s.is_dummy()]
+    names = sorted(k for k, s in env.internal.items() if not s.is_dummy())
+    fresh = InferSys().new_type_vars(max(len(s.vars) for s in schemas))
+
+    for schema in schemas:
+        assert schema.instantiate(fresh) is apply_inst(schema, fresh)
+
+    print('{} polymorphic schemas: {}'.format(len(schemas), ' '.join(names)))
+    old = rate(apply_inst, schemas, fresh, ARGS.repeat)
+    new = rate(Schema.instantiate, schemas, fresh, ARGS.repeat)
+    print('apply:    {:>12.0f} inst/s'.format(old))
+    print('template: {:>12.0f} inst/s'.format(new))
+    print('speedup:  {:>12.2f}'.format(new / old))
+
+
+if __name__ == '__main__':
+    main()
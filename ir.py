@@ -1,18 +1,60 @@
 from abc import ABCMeta, abstractmethod
+from types import GeneratorType
 
 from syntax import *
 from type_sys import *
 
 
+def run_rules(request, rule):
+    """
+    rule(request) is the result of a leaf, or a generator that yields a
+    request for each child and gets its result back. the generators wait
+    on an explicit stack, so nesting depth is bounded by memory
+    """
+    stack = []
+    while True:
+        result = rule(request)
+        if type(result) is GeneratorType:
+            stack.append(result)
+            result = None
+        elif not stack:
+            return result
+        while True:
+            try:
+                request = stack[-1].send(result)
+                break
+            except StopIteration as stop:
+                stack.pop()
+                if not stack:
+                    return stop.value
+                result = stop.value
+
+
 class IRTerm(object, metaclass=ABCMeta):
+    """
+    to_raw, to_racket and has_ref run the raw_rule, racket_rule and
+    ref_rule of each node with run_rules. a term with children gives the
+    rules, yielding its children, and a leaf may give the walks instead
+    """
 
-    @abstractmethod
     def to_raw(self) -> RExpr:
-        raise NotImplementedError()
+        return run_rules(self, lambda term: term.raw_rule())
+
+    def raw_rule(self) -> RExpr:
+        return self.to_raw()
 
     def to_racket(self, env=None) -> RExpr:
+        return run_rules((self, env), lambda request: request[0].racket_rule(request[1]))
+
+    def racket_rule(self, env) -> RExpr:
         return self.to_raw()
 
+    def has_ref(self, syms: Set[str]) -> Set[str]:
+        return run_rules(self, lambda term: term.ref_rule(syms))
+
+    def ref_rule(self, syms: Set[str]) -> Set[str]:
+        return self.has_ref(syms)
+
     @abstractmethod
     def print(self, indent=0) -> [str]:
         raise NotImplementedError()
@@ -25,9 +67,6 @@ class IRExpr(IRTerm, metaclass=ABCMeta):
     def __init__(self):
         super(IRExpr, self).__init__()
 
-    def has_ref(self, syms: Set[str]) -> Set[str]:
-        raise NotImplementedError()
-
 class IRVar(IRExpr):
 
     def __init__(self, v: str):
@@ -60,14 +99,16 @@ class IRApply(IRExpr):
         self.f = f
         self.args = args
 
-    def to_raw(self) -> RExpr:
-        head = [self.f.to_raw()]
-        head.extend(arg.to_raw() for arg in self.args)
+    def raw_rule(self) -> RExpr:
+        head = [(yield self.f)]
+        for arg in self.args:
+            head.append((yield arg))
         return RList(head)
 
-    def to_racket(self, env=None) -> RExpr:
-        head = [self.f.to_racket()]
-        head.extend(arg.to_racket(env=env) for arg in self.args)
+    def racket_rule(self, env) -> RExpr:
+        head = [(yield self.f, None)]
+        for arg in self.args:
+            head.append((yield arg, env))
         return RList(head)
 
     def print(self, indent=0) -> [str]:
@@ -79,10 +120,10 @@ class IRApply(IRExpr):
             ret.extend(arg.print(indent=indent + 2))
         return ret
 
-    def has_ref(self, syms: Set[str]) -> Set[str]:
-        ret = self.f.has_ref(syms)
+    def ref_rule(self, syms: Set[str]) -> Set[str]:
+        ret = (yield self.f)
         for arg in self.args:
-            ret = ret.union(arg.has_ref(syms))
+            ret = ret.union((yield arg))
         return ret
 
 
@@ -93,20 +134,24 @@ class IRLet(IRExpr):
         self.envs = envs
         self.body = body
 
-    def to_raw(self) -> RExpr:
-        envs = [RList([sym.to_raw(), d.to_raw()]) for sym, d in self.envs]
+    def raw_rule(self) -> RExpr:
+        envs = []
+        for sym, d in self.envs:
+            envs.append(RList([sym.to_raw(), (yield d)]))
         return RList([
             RSymbol("let"),
             RList(envs),
-            self.body.to_raw()
+            (yield self.body)
         ])
 
-    def to_racket(self, env=None) -> RExpr:
-        envs = [RList([sym.to_racket(env=env), d.to_racket(env=env)], sq=True) for sym, d in self.envs]
+    def racket_rule(self, env) -> RExpr:
+        envs = []
+        for sym, d in self.envs:
+            envs.append(RList([sym.to_racket(env=env), (yield d, env)], sq=True))
         return RList([
             RSymbol("let"),
             RList(envs),
-            self.body.to_racket()
+            (yield self.body, None)
         ])
 
     def print(self, indent=0) -> [str]:
@@ -119,13 +164,13 @@ class IRLet(IRExpr):
         ret.extend(self.body.print(indent + 2))
         return ret
 
-    def has_ref(self, syms: Set[str]) -> Set[str]:
-        ret = self.body.has_ref(syms)
+    def ref_rule(self, syms: Set[str]) -> Set[str]:
+        ret = (yield self.body)
         binds = [env[0].v for env in self.envs]
         ret = ret.difference(binds)
 
         for _, d in self.envs:
-            ret = ret.union(d.has_ref(syms))
+            ret = ret.union((yield d))
         return ret
 
 
@@ -137,11 +182,13 @@ class IRIf(IRExpr):
         self.then = then
         self.el = el
 
-    def to_raw(self) -> RExpr:
-        return RList([RSymbol('if'), self.then.to_raw(), self.el.to_raw()])
+    def raw_rule(self) -> RExpr:
+        then = yield self.then
+        return RList([RSymbol('if'), then, (yield self.el)])
 
-    def to_racket(self, env=None) -> RExpr:
-        return RList([RSymbol('if'), self.then.to_racket(env=env), self.el.to_racket(env=env)])
+    def racket_rule(self, env) -> RExpr:
+        then = yield self.then, env
+        return RList([RSymbol('if'), then, (yield self.el, env)])
 
     def print(self, indent=0) -> [str]:
         headline = indent * ' ' + 'if'
@@ -153,10 +200,10 @@ class IRIf(IRExpr):
         ret.extend(self.el.print(indent + 2))
         return ret
 
-    def has_ref(self, syms: Set[str]) -> Set[str]:
-        ret = self.cond.has_ref(syms)
-        ret = ret.union(self.then.has_ref(syms))
-        ret = ret.union(self.el.has_ref(syms))
+    def ref_rule(self, syms: Set[str]) -> Set[str]:
+        ret = (yield self.cond)
+        ret = ret.union((yield self.then))
+        ret = ret.union((yield self.el))
         return ret
 
 
@@ -166,16 +213,18 @@ class IRCond(IRExpr):
         super(IRCond, self).__init__()
         self.conds = conds
 
-    def to_raw(self) -> RExpr:
-        conds = [RList([cond.to_raw(), body.to_raw()], sq=True) for (cond, body) in self.conds]
+    def raw_rule(self) -> RExpr:
         ret = [RSymbol('cond')]
-        ret.extend(conds)
+        for (cond, body) in self.conds:
+            cond = yield cond
+            ret.append(RList([cond, (yield body)], sq=True))
         return RList(ret)
 
-    def to_racket(self, env=None) -> RExpr:
-        conds = [RList([cond.to_racket(env=env), body.to_racket(env=env)], sq=True) for (cond, body) in self.conds]
+    def racket_rule(self, env) -> RExpr:
         ret = [RSymbol('cond')]
-        ret.extend(conds)
+        for (cond, body) in self.conds:
+            cond = yield cond, env
+            ret.append(RList([cond, (yield body, env)], sq=True))
         return RList(ret)
 
     @staticmethod
@@ -193,11 +242,11 @@ class IRCond(IRExpr):
             ret.extend(self.print_arm(cond, arm, indent + 2))
         return ret
 
-    def has_ref(self, syms: Set[str]) -> Set[str]:
+    def ref_rule(self, syms: Set[str]) -> Set[str]:
         ret = set()
         for cond, arm in self.conds:
-            ret = ret.union(cond.has_ref(syms))
-            ret = ret.union(arm.has_ref(syms))
+            ret = ret.union((yield cond))
+            ret = ret.union((yield arm))
 
         return ret
 
@@ -209,13 +258,13 @@ class IRLambda(IRExpr):
         self.args = args
         self.body = body
 
-    def to_raw(self) -> RExpr:
+    def raw_rule(self) -> RExpr:
         args = RList(list(arg.to_raw() for arg in self.args))
-        return RList([RSymbol("lambda"), args, self.body.to_raw()])
+        return RList([RSymbol("lambda"), args, (yield self.body)])
 
-    def to_racket(self, env=None) -> RExpr:
+    def racket_rule(self, env) -> RExpr:
         args = RList(list(arg.to_racket(env=env) for arg in self.args))
-        return RList([RSymbol("lambda"), args, self.body.to_racket(env=env)])
+        return RList([RSymbol("lambda"), args, (yield self.body, env)])
 
     def print(self, indent=0) -> [str]:
         headline = indent * ' ' + 'lambda'
@@ -226,8 +275,8 @@ class IRLambda(IRExpr):
         ret.extend(self.body.print(indent + 2))
         return ret
 
-    def has_ref(self, syms: Set[str]) -> Set[str]:
-        ret = self.body.has_ref(syms)
+    def ref_rule(self, syms: Set[str]) -> Set[str]:
+        ret = (yield self.body)
         args = set([arg.v for arg in self.args])
         ret = ret.difference(args)
         return ret
@@ -239,14 +288,16 @@ class IRListCtor(IRExpr):
         super(IRListCtor, self).__init__()
         self.args = args
 
-    def to_raw(self) -> RExpr:
+    def raw_rule(self) -> RExpr:
         ret = [RSymbol("list")]
-        ret.extend((arg.to_raw() for arg in self.args))
+        for arg in self.args:
+            ret.append((yield arg))
         return RList(ret)
 
-    def to_racket(self, env=None) -> RExpr:
+    def racket_rule(self, env) -> RExpr:
         ret = [RSymbol("list")]
-        ret.extend((arg.to_racket(env=env) for arg in self.args))
+        for arg in self.args:
+            ret.append((yield arg, env))
         return RList(ret)
 
     def print(self, indent=0) -> [str]:
@@ -256,10 +307,10 @@ class IRListCtor(IRExpr):
             ret.extend(arg.print(indent=indent + 2))
         return ret
 
-    def has_ref(self, syms: Set[str]) -> Set[str]:
+    def ref_rule(self, syms: Set[str]) -> Set[str]:
         ret = set()
         for arg in self.args:
-            ret = ret.union(arg.has_ref(syms))
+            ret = ret.union((yield arg))
         return ret
 
 
@@ -269,14 +320,16 @@ class IRTupleCtor(IRExpr):
         super(IRTupleCtor, self).__init__()
         self.args = args
 
-    def to_raw(self) -> RExpr:
+    def raw_rule(self) -> RExpr:
         ret = [RSymbol("tuple")]
-        ret.extend((arg.to_raw() for arg in self.args))
+        for arg in self.args:
+            ret.append((yield arg))
         return RList(ret)
 
-    def to_racket(self, env=None) -> RExpr:
+    def racket_rule(self, env) -> RExpr:
         ret = [RSymbol("vector")]
-        ret.extend((arg.to_racket(env=env) for arg in self.args))
+        for arg in self.args:
+            ret.append((yield arg, env))
         return RList(ret)
 
     def print(self, indent=0) -> [str]:
@@ -286,10 +339,10 @@ class IRTupleCtor(IRExpr):
             ret.extend(arg.print(indent=indent + 2))
         return ret
 
-    def has_ref(self, syms: Set[str]) -> Set[str]:
+    def ref_rule(self, syms: Set[str]) -> Set[str]:
         ret = set()
         for arg in self.args:
-            ret = ret.union(arg.has_ref(syms))
+            ret = ret.union((yield arg))
         return ret
 
 
@@ -300,14 +353,14 @@ class IRSet(IRExpr):
         self.sym = sym
         self.var = var
 
-    def to_raw(self) -> RExpr:
-        ret = [RSymbol("set!"), self.sym.to_raw(), self.var.to_raw()]
+    def raw_rule(self) -> RExpr:
+        ret = [RSymbol("set!"), self.sym.to_raw(), (yield self.var)]
         return RList(ret)
 
-    def to_racket(self, env=None) -> RExpr:
+    def racket_rule(self, env) -> RExpr:
         ret = [RSymbol("set!"),
                self.sym.to_racket(env=env),
-               self.var.to_racket(env=env)]
+               (yield self.var, env)]
         return RList(ret)
 
     def print(self, indent=0) -> [str]:
@@ -316,8 +369,8 @@ class IRSet(IRExpr):
         ret.extend(self.var.print(indent=indent + 2))
         return ret
 
-    def has_ref(self, syms: Set[str]) -> Set[str]:
-        return self.var.has_ref(syms)
+    def ref_rule(self, syms: Set[str]) -> Set[str]:
+        return (yield self.var)
 
 
 class IRBegin(IRExpr):
@@ -326,14 +379,16 @@ class IRBegin(IRExpr):
         super(IRBegin, self).__init__()
         self.args = args
 
-    def to_raw(self) -> RExpr:
+    def raw_rule(self) -> RExpr:
         ret = [RSymbol("begin")]
-        ret.extend((arg.to_raw() for arg in self.args))
+        for arg in self.args:
+            ret.append((yield arg))
         return RList(ret)
 
-    def to_racket(self, env=None) -> RExpr:
+    def racket_rule(self, env) -> RExpr:
         ret = [RSymbol("begin")]
-        ret.extend((arg.to_racket(env=env) for arg in self.args))
+        for arg in self.args:
+            ret.append((yield arg, env))
         return RList(ret)
 
     def print(self, indent=0) -> [str]:
@@ -343,10 +398,10 @@ class IRBegin(IRExpr):
             ret.extend(arg.print(indent=indent + 2))
         return ret
 
-    def has_ref(self, syms: Set[str]) -> Set[str]:
+    def ref_rule(self, syms: Set[str]) -> Set[str]:
         ret = set()
         for arg in self.args:
-            ret = ret.union(arg.has_ref(syms))
+            ret = ret.union((yield arg))
         return ret
 
 
@@ -355,7 +410,7 @@ class IRDef(IRTerm):
     def print(self, indent=0) -> [str]:
         raise NotImplementedError()
 
-    def to_raw(self) -> RExpr:
+    def raw_rule(self) -> RExpr:
         raise NotImplementedError()
 
     def __init__(self, sym: IRVar, anno: Type):
@@ -366,7 +421,7 @@ class IRDef(IRTerm):
     def get_name(self):
         raise NotImplementedError()
 
-    def has_ref(self, syms: Set[str]) -> Set[str]:
+    def ref_rule(self, syms: Set[str]) -> Set[str]:
         raise NotImplementedError()
 
 
@@ -380,15 +435,15 @@ class IRDefine(IRDef):
     def get_name(self):
         return self.sym.v
 
-    def to_raw(self) -> RExpr:
+    def raw_rule(self) -> RExpr:
         head = [self.sym.to_raw()]
         head.extend(var.to_raw() for var in self.args)
-        return RList([RSymbol("define"), RList(head), self.body.to_raw()])
+        return RList([RSymbol("define"), RList(head), (yield self.body)])
 
-    def to_racket(self, env=None) -> RExpr:
+    def racket_rule(self, env) -> RExpr:
         head = [self.sym.to_racket(env=env)]
         head.extend(var.to_racket(env=env) for var in self.args)
-        return RList([RSymbol("define"), RList(head), self.body.to_racket(env=env)])
+        return RList([RSymbol("define"), RList(head), (yield self.body, env)])
 
     def print(self, indent=0) -> [str]:
         headline = indent * ' ' + 'define {}'.format(self.sym.v)
@@ -399,8 +454,8 @@ class IRDefine(IRDef):
         ret.extend(self.body.print(indent + 2))
         return ret
 
-    def has_ref(self, syms: Set[str]) -> Set[str]:
-        return self.body.has_ref(syms)
+    def ref_rule(self, syms: Set[str]) -> Set[str]:
+        return (yield self.body)
 
 
 class IRVarDefine(IRDef):
@@ -412,11 +467,11 @@ class IRVarDefine(IRDef):
     def get_name(self):
         return self.sym.v
 
-    def to_raw(self) -> RExpr:
+    def raw_rule(self) -> RExpr:
         ret = [RSymbol('define'), RSymbol(self.sym.v)]
         if self.anno is not None:
             ret.append(self.anno.to_raw())
-        ret.append(self.body.to_raw())
+        ret.append((yield self.body))
         return RList(ret)
 
     def print(self, indent=0) -> [str]:
@@ -424,9 +479,9 @@ class IRVarDefine(IRDef):
         ret.extend(self.body.print(indent + 2))
         return ret
 
-    def to_racket(self, env=None) -> RExpr:
-        ret = [RSymbol('define'), RSymbol(self.sym.v), self.body.to_racket(env=env)]
+    def racket_rule(self, env) -> RExpr:
+        ret = [RSymbol('define'), RSymbol(self.sym.v), (yield self.body, env)]
         return RList(ret)
 
-    def has_ref(self, sym: Set[str]) -> Set[str]:
-        return self.body.has_ref(sym)
+    def ref_rule(self, sym: Set[str]) -> Set[str]:
+        return (yield self.body)
@@ -1,3 +1,4 @@
+from array import array
 from ir import *
 
 
@@ -105,7 +106,22 @@ class IRList(IRLit):
         self.sq = sq
 
     def to_lit(self) -> RExpr:
-        return RList([lit.to_lit() for lit in self.v], sq=self.sq)
+        # nested lists are built after their items on an explicit stack
+        done = []
+        stack = [(self, False)]
+        while stack:
+            lit, ready = stack.pop()
+            if not isinstance(lit, IRList):
+                done.append(lit.to_lit())
+            elif ready:
+                start = len(done) - len(lit.v)
+                ret = RList(done[start:], sq=lit.sq)
+                del done[start:]
+                done.append(ret)
+            else:
+                stack.append((lit, True))
+                stack.extend((item, False) for item in reversed(lit.v))
+        return done[0]
 
     def to_raw(self) -> RExpr:
         return RList([RSymbol("quote"), self.to_lit()])
@@ -117,3 +133,84 @@ class IRList(IRLit):
             ret.extend(out)
         ret.append(' ' * indent + ']')
         return ret
+
+
+# quoted lists at least this long of one base literal kind are parsed
+# into an IRPackedList instead of one IRLit per element
+PACKED_LIST_MIN = 64
+
+# raw literal => its IRLit and the array typecode of its values. kinds
+# without one keep their text in a tuple of str, for strings that is
+# the text of the inner RString the reader wraps them in, which item
+# wraps again
+PACKED_KINDS = {
+    RInt: (IRInt, 'q'),
+    RFloat: (IRFloat, 'd'),
+    RBool: (IRBool, 'b'),
+    RString: (IRString, None),
+    RChar: (IRChar, None),
+    RSymbol: (IRSymbol, None),
+}
+
+
+class IRPackedList(IRLit):
+    """
+    quoted list of base literals of one kind, elem is their IRLit class
+    and v holds the bare values in an array
+    """
+
+    def __init__(self, elem: type, v):
+        super(IRPackedList, self).__init__()
+        self.elem = elem
+        self.v = v
+
+    def __len__(self):
+        return len(self.v)
+
+    def item(self, i: int) -> IRLit:
+        if self.elem is IRBool:
+            return IRBool(bool(self.v[i]))
+        if self.elem is IRString:
+            return IRString(RString(self.v[i]))
+        return self.elem(self.v[i])
+
+    def items(self) -> [IRLit]:
+        return [self.item(i) for i in range(len(self.v))]
+
+    def to_lit(self) -> RExpr:
+        return RList([lit.to_lit() for lit in self.items()])
+
+    def to_raw(self) -> RExpr:
+        return RList([RSymbol("quote"), self.to_lit()])
+
+    def print(self, indent=0) -> [str]:
+        ret = [' ' * indent + '[']
+        for lit in self.items():
+            ret.extend(lit.print(indent=indent + 2))
+        ret.append(' ' * indent + ']')
+        return ret
+
+
+def pack_list(r_exprs: [RExpr]):
+    """
+    the IRPackedList of r_exprs, or None when they are not all of one
+    base literal kind or do not fit its array
+    """
+    if len(r_exprs) < PACKED_LIST_MIN:
+        return None
+    kind = type(r_exprs[0])
+    # readers may give subclasses, such as symbols kept in a mapped file
+    base = next((k for k in kind.__mro__ if k in PACKED_KINDS), None)
+    if base is None or any(type(r) is not kind for r in r_exprs):
+        return None
+    elem, code = PACKED_KINDS[base]
+    if elem is IRString:
+        values = [r.v.v for r in r_exprs]
+    else:
+        values = [r.v for r in r_exprs]
+    if code is None:
+        return IRPackedList(elem, tuple(values))
+    try:
+        return IRPackedList(elem, array(code, values))
+    except OverflowError:
+        return None
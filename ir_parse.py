@@ -4,6 +4,7 @@ from ir_pat import *
 from type_sys import *
 from typing import Mapping, Optional
 from collections import OrderedDict
+from types import GeneratorType
 from code_gen import RecordCtor, RecordExtractor, SumCtor
 
 class ParseError(object):
@@ -20,7 +21,7 @@ class ParseError(object):
         return 'ParseError({}: {})'.format(self.span, self.msg)
 
 
-def parse_lit(expr: RExpr) -> IRLit:
+def parse_base_lit(expr: RExpr) -> IRLit:
     if isinstance(expr, RSymbol):
         return IRSymbol(expr.v)
     elif isinstance(expr, RFloat):
@@ -33,13 +34,36 @@ def parse_lit(expr: RExpr) -> IRLit:
         return IRString(expr.v)
     elif isinstance(expr, RChar):
         return IRChar(expr.v)
-    elif isinstance(expr, RList):
-        ret = [parse_lit(v) for v in expr.v]
-        return IRList(ret)
     else:
         raise ValueError('expr {} is not a literal'.format(expr))
 
 
+def parse_lit(expr: RExpr) -> IRLit:
+    """
+    lists are built after their items on an explicit stack, so the
+    nesting of a quoted literal is bounded by memory
+    """
+    done = []
+    stack = [(expr, False)]
+    while stack:
+        r_expr, ready = stack.pop()
+        if not isinstance(r_expr, RList):
+            done.append(parse_base_lit(r_expr))
+        elif ready:
+            start = len(done) - len(r_expr.v)
+            ret = IRList(done[start:])
+            del done[start:]
+            done.append(ret)
+        else:
+            packed = pack_list(r_expr.v)
+            if packed is not None:
+                done.append(packed)
+            else:
+                stack.append((r_expr, True))
+                stack.extend((v, False) for v in reversed(r_expr.v))
+    return done[0]
+
+
 def parse_lambda(r_expr: RList) -> (IRExpr, [ParseError]):
     errors = []
     lam = None
@@ -59,7 +83,7 @@ def parse_lambda(r_expr: RList) -> (IRExpr, [ParseError]):
                 vars.append(IRVar(arg.v))
             else:
                 errors.append(ParseError(arg.span, "error in lambda parameters, form is not a symbol"))
-        ret, ret_errors = parse_ir_expr(body)
+        ret, ret_errors = yield body
         errors.extend(ret_errors)
         lam = IRLambda(vars, ret)
 
@@ -94,10 +118,10 @@ def parse_let(r_expr: RList) -> (IRExpr, [ParseError]):
             else:
                 v = IRVar(r_v.v)
 
-            d, d_error = parse_ir_expr(r_d)
+            d, d_error = yield r_d
             errors.extend(d_error)
             envs.append((v, d))
-        body, body_errors = parse_ir_expr(r_body)
+        body, body_errors = yield r_body
         errors.extend(body_errors)
         let = IRLet(envs, body)
 
@@ -114,13 +138,13 @@ def parse_if(r_expr: RList) -> (IRExpr, [ParseError]):
     r_then = r_expr.v[2]
     r_else = r_expr.v[3]
 
-    cond, cond_errors = parse_ir_expr(r_cond)
+    cond, cond_errors = yield r_cond
     errors.extend(cond_errors)
 
-    then, then_errors = parse_ir_expr(r_then)
+    then, then_errors = yield r_then
     errors.extend(then_errors)
 
-    el, else_errors = parse_ir_expr(r_else)
+    el, else_errors = yield r_else
     errors.extend(else_errors)
 
     iff = IRIf(cond, then, el)
@@ -135,10 +159,10 @@ def parse_cond_arm(r_expr: RList) -> ((IRExpr, IRExpr), [ParseError]):
     if len(r_expr.v) != 2:
         errors.append(ParseError(r_expr.span, "wrong arity in cond arm"))
         return (cond, arm), errors
-    cond, cond_errors = parse_ir_expr(r_expr.v[0])
+    cond, cond_errors = yield r_expr.v[0]
     errors.extend(cond_errors)
 
-    arm, arm_errors = parse_ir_expr(r_expr.v[1])
+    arm, arm_errors = yield r_expr.v[1]
     errors.extend(arm_errors)
 
     return (cond, arm), errors
@@ -155,7 +179,7 @@ def parse_cond(r_expr: RList) -> (IRExpr, [ParseError]):
     conds = []
     for r_cond in r_conds:
         if isinstance(r_cond, RList):
-            (cond, arm), cond_errors = parse_cond_arm(r_cond)
+            (cond, arm), cond_errors = yield from parse_cond_arm(r_cond)
             errors.extend(cond_errors)
             conds.append((cond, arm))
         else:
@@ -174,13 +198,13 @@ def parse_apply(r_expr: RList) -> (IRExpr, [ParseError]):
         return None, errors
     r_head = r_expr.v[0]
 
-    expr_head, head_errors = parse_ir_expr(r_head)
+    expr_head, head_errors = yield r_head
     if isinstance(expr_head, IRSymbol):
         expr_head = IRVar(expr_head.v)
     errors.extend(head_errors)
     expr_args = []
     for arg in r_expr.v[1:]:
-        expr_arg, arg_errors = parse_ir_expr(arg)
+        expr_arg, arg_errors = yield arg
         expr_args.append(expr_arg)
         errors.extend(arg_errors)
     expr = IRApply(expr_head, expr_args)
@@ -258,7 +282,7 @@ def parse_match(r_expr: RList) -> (IRExpr, [ParseError]):
     if len(r_expr.v) < 3:
         errors.append(ParseError(r_expr.span, "match form must have matched expression and at least one match arm"))
         return match, errors
-    v, v_errors = parse_ir_expr(r_expr.v[1])
+    v, v_errors = yield r_expr.v[1]
     errors.extend(v_errors)
     arms = []
     for r_branch in r_expr.v[2:]:
@@ -269,7 +293,7 @@ def parse_match(r_expr: RList) -> (IRExpr, [ParseError]):
             r_pat = r_branch.v[0]
             r_arm = r_branch.v[1]
             pat, pat_errors = parse_pat(r_pat)
-            arm, atm_errors = parse_ir_expr(r_arm)
+            arm, atm_errors = yield r_arm
             arms.append((pat, arm))
         else:
             errors.append(ParseError(r_branch.span, "match arm must be a list"))
@@ -284,7 +308,7 @@ def parse_list_form(r_expr: RList) -> (IRExpr, [ParseError]):
     r_args = r_expr.v[1:]
     args = []
     for r_arg in r_args:
-        arg, arg_errors = parse_ir_expr(r_arg)
+        arg, arg_errors = yield r_arg
         args.append(arg)
         errors.extend(arg_errors)
 
@@ -297,7 +321,7 @@ def parse_tuple_form(r_expr: RList) -> (IRExpr, [ParseError]):
     r_args = r_expr.v[1:]
     args = []
     for r_arg in r_args:
-        arg, arg_errors = parse_ir_expr(r_arg)
+        arg, arg_errors = yield r_arg
         args.append(arg)
         errors.extend(arg_errors)
 
@@ -317,7 +341,7 @@ def parse_set(r_expr: RList) -> (IRExpr, [ParseError]):
         errors.append(ParseError(r_sym.span, "must set! on a symbol"))
         return form, errors
     sym = IRVar(r_sym.v)
-    v, v_errors = parse_ir_expr(r_v)
+    v, v_errors = yield r_v
     errors.extend(v_errors)
     form = IRSet(sym, v)
     return form, errors
@@ -333,14 +357,68 @@ def parse_begin(r_expr: RList) -> (IRExpr, [ParseError]):
     r_args = r_expr.v[1:]
     args = []
     for r_arg in r_args:
-        arg, arg_errors = parse_ir_expr(r_arg)
+        arg, arg_errors = yield r_arg
         args.append(arg)
         errors.extend(arg_errors)
 
     return IRBegin(args), errors
 
 
+# IRExpr => the RExpr it was parsed from, only kept by parse_with_source
+SOURCES = None
+
+
+def parse_with_source(parse, r_expr):
+    """
+    run parse on r_expr and also return the source form of every IRExpr
+    it builds, for error reports that point into the program
+    """
+    global SOURCES
+    SOURCES = dict()
+    try:
+        return parse(r_expr), SOURCES
+    finally:
+        SOURCES = None
+
+
 def parse_ir_expr(r_expr) -> (IRExpr, [ParseError]):
+    """
+    run the parse rules on an explicit stack, as infer_ir_expr runs the
+    inference rules, so nesting depth is bounded by memory. a rule returns
+    (expr, errors) of a leaf, or is a generator that yields each sub form
+    it needs and gets its (expr, errors) back
+    """
+    stack = []
+    forms = []
+    while True:
+        result = parse_ir_form(r_expr)
+        if type(result) is GeneratorType:
+            stack.append(result)
+            forms.append(r_expr)
+            result = None
+        else:
+            if SOURCES is not None and result[0] is not None:
+                SOURCES[result[0]] = r_expr
+            if not stack:
+                return result
+        while True:
+            try:
+                r_expr = stack[-1].send(result)
+                break
+            except StopIteration as stop:
+                stack.pop()
+                result = stop.value
+                form = forms.pop()
+                if SOURCES is not None and result[0] is not None:
+                    SOURCES[result[0]] = form
+                if not stack:
+                    return result
+
+
+def parse_ir_form(r_expr):
+    """
+    the parse rule of r_expr run on it, see parse_ir_expr
+    """
     errors = []
     expr = None
     if isinstance(r_expr, RList):
@@ -352,9 +430,7 @@ def parse_ir_expr(r_expr) -> (IRExpr, [ParseError]):
             sym = r_head.v
             if sym == 'lambda':
                 # parse a lambda
-                expr, lam_errors = parse_lambda(r_expr)
-                errors.extend(lam_errors)
-                return expr, errors
+                return parse_lambda(r_expr)
             if sym == 'quote':
                 # parse a quote
                 if len(r_expr.v) != 2:
@@ -365,53 +441,34 @@ def parse_ir_expr(r_expr) -> (IRExpr, [ParseError]):
                     # errors.extend(quote_errors)
                     return expr, errors
             if sym == 'let':
-                expr, let_errors = parse_let(r_expr)
-                errors.extend(let_errors)
-                return expr, errors
+                return parse_let(r_expr)
 
             if sym == 'if':
-                expr, if_errors = parse_if(r_expr)
-                errors.extend(if_errors)
-                return expr, errors
+                return parse_if(r_expr)
 
             if sym == 'cond':
-                expr, cond_errors = parse_cond(r_expr)
-                errors.extend(cond_errors)
-                return expr, errors
+                return parse_cond(r_expr)
 
             if sym == 'match':
-                expr, cond_errors = parse_match(r_expr)
-                errors.extend(cond_errors)
-                return expr, errors
+                return parse_match(r_expr)
 
             if sym == 'list':
-                expr, cond_errors = parse_list_form(r_expr)
-                errors.extend(cond_errors)
-                return expr, errors
+                return parse_list_form(r_expr)
 
             if sym == 'tuple':
-                expr, cond_errors = parse_tuple_form(r_expr)
-                errors.extend(cond_errors)
-                return expr, errors
+                return parse_tuple_form(r_expr)
 
             if sym == 'set!':
-                expr, set_errors = parse_set(r_expr)
-                errors.extend(set_errors)
-                return expr, errors
+                return parse_set(r_expr)
 
             if sym == 'begin':
-                expr, begin_errors = parse_begin(r_expr)
-                errors.extend(begin_errors)
-                return expr, errors
+                return parse_begin(r_expr)
 
             else:
                 # parse a apply
-                expr, apply_errors = parse_apply(r_expr)
-                errors.extend(apply_errors)
-                return expr, errors
+                return parse_apply(r_expr)
         else:
-            expr, apply_errors = parse_apply(r_expr)
-            errors.extend(apply_errors)
+            return parse_apply(r_expr)
     else:
         expr = parse_lit(r_expr)
         if isinstance(expr, IRSymbol):
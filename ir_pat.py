@@ -173,16 +173,16 @@ class IRMatch(IRExpr):
         self.v = v
         self.arms = arms
 
-    def to_raw(self) -> RExpr:
-        ret = [RSymbol("match"), self.v.to_raw()]
+    def raw_rule(self) -> RExpr:
+        ret = [RSymbol("match"), (yield self.v)]
         for pat, arm in self.arms:
-            ret.append(RList([pat.to_raw(), arm.to_raw()], sq=True))
+            ret.append(RList([pat.to_raw(), (yield arm)], sq=True))
         return RList(ret)
 
-    def to_racket(self, env=None) -> RExpr:
-        ret = [RSymbol("match"), self.v.to_racket(env=env)]
+    def racket_rule(self, env) -> RExpr:
+        ret = [RSymbol("match"), (yield self.v, env)]
         for pat, arm in self.arms:
-            ret.append(RList([pat.to_racket(env=env), arm.to_racket(env=env)], sq=True))
+            ret.append(RList([pat.to_racket(env=env), (yield arm, env)], sq=True))
         return RList(ret)
 
     def print(self, indent=0) -> [str]:
@@ -198,10 +198,10 @@ class IRMatch(IRExpr):
             ret.append(indent * ' ' + ']')
         return ret
 
-    def has_ref(self, syms: Set[str]) -> Set[str]:
-        ret = self.v.has_ref(syms)
+    def ref_rule(self, syms: Set[str]) -> Set[str]:
+        ret = (yield self.v)
         for (pat, body) in self.arms:
-            body_ref = body.has_ref(syms)
+            body_ref = (yield body)
             binds = pat.bind_set()
             ret = ret.union(body_ref.difference(binds))
         return ret
@@ -0,0 +1,52 @@
+from argparse import ArgumentParser
+from timeit import default_timer as timer
+from infer import *
+
+
+def let_chain(depth: int) -> IRExpr:
+    """
+    build (lambda (x0) (let ((x1 (+ x0 1))) (let ((x2 (+ x1 1))) ... xn)))
+    every tenth level binds a polymorphic identity first and applies it
+    """
+    body = IRVar('x{}'.format(depth))
+    for i in reversed(range(1, depth + 1)):
+        x = IRVar('x{}'.format(i))
+        prev = IRVar('x{}'.format(i - 1))
+        if i % 10 == 0:
+            f = IRVar('id{}'.format(i))
+            body = IRLet([(x, IRApply(f, [prev]))], body)
+            body = IRLet([(f, IRLambda([IRVar('y')], IRVar('y')))], body)
+        else:
+            body = IRLet([(x, IRApply(IRVar('+'), [prev, IRInt(1)]))], body)
+    return IRLambda([IRVar('x0')], body)
+
+
+def bench(depths):
+    print('{:>8} {:>10} {:>14}'.format('depth', 'time(s)', 'us per level'))
+    for depth in depths:
+        expr = let_chain(depth)
+        infer_sys = InferSys()
+        start = timer()
+        t, msg = infer_sys.solve_ir_expr(TypeEnv.default(), expr)
+        elapsed = timer() - start
+        assert msg is None, msg
+        assert str(t) == 'Number -> Number', t
+        print('{:>8} {:>10.4f} {:>14.1f}'.format(depth, elapsed, elapsed / depth * 1e6))
+
+
+def main():
+    parser = ArgumentParser(description='check time of nested let chains')
+    parser.add_argument('--max', type=int, default=10000, help='deepest let chain')
+    ARGS = parser.parse_args()
+
+    depths = []
+    depth = 10
+    while depth <= ARGS.max:
+        depths.append(depth)
+        depth *= 10
+
+    bench(depths)
+
+
+if __name__ == '__main__':
+    main()
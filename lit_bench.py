@@ -0,0 +1,50 @@
+import tracemalloc
+from argparse import ArgumentParser
+from timeit import default_timer as timer
+import ir_lit
+from parsing import whole_program
+from ir_parse import parse_ir_expr
+from infer import *
+
+
+def measure(r_expr) -> (float, float, int, float):
+    tracemalloc.start()
+    start = timer()
+    expr, errors = parse_ir_expr(r_expr)
+    parse_time = timer() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    assert len(errors) == 0, errors
+
+    infer_sys = InferSys()
+    start = timer()
+    t = infer_sys.infer_ir_expr(TypeEnv.default(), expr)
+    equations = len(infer_sys.equations)
+    infer_sys.solve_equations()
+    infer_time = timer() - start
+    assert str(infer_sys.solver.resolve(t)) == 'List Number'
+    return parse_time, size / 1024 / 1024, equations, infer_time
+
+
+def main():
+    parser = ArgumentParser(description='parse and infer a large quoted numeric table, packed and unpacked')
+    parser.add_argument('--elems', type=int, default=20000, help='elements of the literal list')
+    ARGS = parser.parse_args()
+
+    floats = "'({})".format(' '.join(str(i + 0.5) for i in range(ARGS.elems)))
+    ints = "'({})".format(' '.join(str(i) for i in range(ARGS.elems)))
+    print('{:<10} {:<9} {:>10} {:>10} {:>10} {:>10}'.format('elements', 'storage', 'IR', 'parse', 'equations', 'infer'))
+    for name, text in (('floats', floats), ('ints', ints)):
+        r_expr = whole_program.parse(text)[0]
+        for packed_min in (None, ir_lit.PACKED_LIST_MIN):
+            saved = ir_lit.PACKED_LIST_MIN
+            if packed_min is None:
+                ir_lit.PACKED_LIST_MIN = ARGS.elems + 1
+            parse_time, size, equations, infer_time = measure(r_expr)
+            ir_lit.PACKED_LIST_MIN = saved
+            print('{:<10} {:<9} {:>8.2f}MB {:>9.3f}s {:>10} {:>9.3f}s'.format(
+                name, 'objects' if packed_min is None else 'packed', size, parse_time, equations, infer_time))
+
+
+if __name__ == '__main__':
+    main()
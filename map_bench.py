@@ -0,0 +1,65 @@
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+from argparse import ArgumentParser, SUPPRESS
+from timeit import default_timer as timer
+from parsing import map_forms, read_forms, whole_program
+
+
+def generate(path: str, mb: float):
+    row = "'({})\n".format(' '.join(str(i * 7 % 1000) for i in range(200)))
+    with open(path, 'w') as f:
+        for _ in range(int(mb * 1024 * 1024 / len(row))):
+            f.write(row)
+
+
+def read(mode: str, path: str) -> int:
+    if mode == 'mmap':
+        return sum(1 for _ in map_forms(path))
+    with open(path, 'r') as f:
+        if mode == 'stream':
+            return sum(1 for _ in read_forms(f))
+        return len(whole_program.parse(f.read()))
+
+
+def main():
+    parser = ArgumentParser(description='peak memory and time to read a generated data literal file')
+    parser.add_argument('--mb', type=float, default=500, help='size of the generated file in MB')
+    parser.add_argument('--path', help='generated file, kept between runs, by default a temporary file removed afterwards')
+    parser.add_argument('--modes', default='stream,mmap', help='readers to run, comma separated, whole reads the file into memory')
+    parser.add_argument('--child', help=SUPPRESS)
+    ARGS = parser.parse_args()
+
+    if ARGS.child is not None:
+        start = timer()
+        forms = read(ARGS.child, ARGS.path)
+        elapsed = timer() - start
+        print(forms, elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+        return
+
+    path = ARGS.path
+    if path is None:
+        path = os.path.join(tempfile.gettempdir(), 'map_bench_{}.rkt'.format(os.getpid()))
+    try:
+        if not os.path.exists(path) or os.path.getsize(path) < ARGS.mb * 1024 * 1024 * 0.99:
+            generate(path, ARGS.mb)
+        size = os.path.getsize(path) / 1024 / 1024
+        print('{:.1f}MB file'.format(size))
+        for mode in ARGS.modes.split(','):
+            out = subprocess.run([sys.executable, __file__, '--child', mode, '--path', path],
+                                 capture_output=True, text=True).stdout.split()
+            if len(out) != 3:
+                print('{:<7} failed'.format(mode))
+                continue
+            forms, elapsed, rss = int(out[0]), float(out[1]), int(out[2])
+            print('{:<7} {} forms {:>9.1f}s {:>7.2f}MB/s peak {:>7.0f}MB'.format(
+                mode, forms, elapsed, size / elapsed, rss / 1024))
+    finally:
+        if ARGS.path is None and os.path.exists(path):
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
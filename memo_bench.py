@@ -0,0 +1,46 @@
+from argparse import ArgumentParser
+from timeit import default_timer as timer
+from parsing import whole_program
+from type_check import TypeChecker
+
+
+# every define repeats the same closed helpers, as generated code does
+DEFINE = '''
+(define (f{i} x)
+  (let ((step (lambda (a b) (if (> a b) (+ a 1) (* b (- a 2))))))
+  (let ((table (list (list 1 2 3) (list 4 5 6) (list 7 8 9) (list 10 11 12))))
+  (let ((pair (lambda (p q) (tuple (cons p null) (cons q (cons q null)) (tuple p q)))))
+    (pair (step x (car (car table))) (step 1 x))))))
+'''
+
+
+def run(r_exprs, memo_size: int) -> (float, TypeChecker):
+    checker = TypeChecker(memo_size=memo_size)
+    start = timer()
+    _, _, _, errors = checker.check_content(r_exprs)
+    elapsed = timer() - start
+    assert len(errors) == 0, errors
+    return elapsed, checker
+
+
+def main():
+    parser = ArgumentParser(description='check time with and without the closed subterm cache')
+    parser.add_argument('--defines', type=int, default=500, help='defines repeating the helpers')
+    parser.add_argument('--memo-size', type=int, default=4096, help='entries of the cache')
+    parser.add_argument('--repeat', type=int, default=5, help='runs, the best one is reported')
+    ARGS = parser.parse_args()
+
+    src = ''.join(DEFINE.format(i=i) for i in range(ARGS.defines))
+    r_exprs = whole_program.parse(src)
+    plain = min(run(r_exprs, 0)[0] for _ in range(ARGS.repeat))
+    runs = [run(r_exprs, ARGS.memo_size) for _ in range(ARGS.repeat)]
+    memo = min(elapsed for elapsed, _ in runs)
+    cache = runs[0][1].infer_sys.closed_cache
+    print('{} defines'.format(ARGS.defines))
+    print('no cache:     {:.3f}s'.format(plain))
+    print('closed cache: {:.3f}s ({:.2f}x), {} hits, {} misses, {:.1f}% hit rate, {} entries'.format(
+        memo, plain / memo, cache.hits, cache.misses, 100 * cache.hit_rate(), len(cache.schemas)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+import os
+import subprocess
+import sys
+import tempfile
+from argparse import ArgumentParser
+from timeit import default_timer as timer
+from parsing import whole_program
+from syntax import RList
+
+
+def cons_source(depth: int) -> str:
+    """
+    (cons 1 (cons 1 ... null))
+    """
+    return '(cons 1 ' * depth + 'null' + ')' * depth
+
+
+def list_source(depth: int) -> str:
+    """
+    [[[ ... x ... ]]]
+    """
+    return '[' * depth + 'x' + ']' * depth
+
+
+def quote_source(depth: int) -> str:
+    """
+    '(a '(a ... ()))
+    """
+    return "'(a " * depth + '()' + ')' * depth
+
+
+def nesting(atom) -> int:
+    depth = 0
+    while isinstance(atom, RList) and atom.v:
+        atom = atom.v[-1]
+        depth += 1
+    return depth
+
+
+SOURCES = [
+    ('cons', cons_source, 1),
+    ('list', list_source, 1),
+    ('quote', quote_source, 2),
+]
+
+
+def run_script(args: [str]) -> (float, str):
+    """
+    time of a script run as a child process and the first line it
+    reported, a crash of the script fails the bench
+    """
+    start = timer()
+    out = subprocess.run([sys.executable] + args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    elapsed = timer() - start
+    assert out.returncode == 0 and not out.stderr, out.stderr[-2000:]
+    lines = [line for line in out.stdout.splitlines() if not line.startswith('form:')]
+    return elapsed, lines[0].split('): ', 1)[-1][:40] if lines else 'ok'
+
+
+def main():
+    parser = ArgumentParser(description='reader, type_check and compiler time on deeply nested sources')
+    parser.add_argument('--depths', type=int, nargs='+', default=[10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6], help='nesting depths')
+    parser.add_argument('--check-depth', type=int, default=10 ** 5, help='deepest source also checked and compiled')
+    ARGS = parser.parse_args()
+
+    folder = tempfile.mkdtemp()
+    path = os.path.join(folder, 'nest_bench.rkt')
+    out_path = os.path.join(folder, 'nest_bench_out.rkt')
+    print('{:>8} {:>8} {:>10} {:>14} {:>10} {:>10}  {}'.format(
+        'source', 'depth', 'time(s)', 'us per level', 'check(s)', 'compile(s)', 'check result'))
+    try:
+        for name, build, lists in SOURCES:
+            for depth in ARGS.depths:
+                src = build(depth)
+                start = timer()
+                atoms = whole_program.parse(src)
+                elapsed = timer() - start
+                assert len(atoms) == 1 and nesting(atoms[0]) == depth * lists, name
+                del atoms
+                line = '{:>8} {:>8} {:>10.4f} {:>14.2f}'.format(name, depth, elapsed, elapsed / depth * 1e6)
+                if depth <= ARGS.check_depth:
+                    with open(path, 'w') as f:
+                        f.write(src)
+                    check, result = run_script(['type_check.py', '--silent', path])
+                    compile_time, _ = run_script(['compiler.py', '--silent', '--output', out_path, path])
+                    line += ' {:>10.4f} {:>10.4f}  {}'.format(check, compile_time, result)
+                print(line)
+    finally:
+        for leftover in (path, out_path):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+        os.rmdir(folder)
+
+
+if __name__ == '__main__':
+    main()
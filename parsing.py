@@ -1,6 +1,42 @@
+from bisect import bisect_right
+from typing import Iterator, Optional, TextIO
+import gc
+from sys import intern
+import mmap
+import os
 from syntax import *
-from parsy import regex, generate
 import parsy
+import re
+
+
+class LineIndex(object):
+    """
+    offsets where the lines of one source start, so the line and column
+    of an offset is a binary search instead of a count from the start.
+    a source that is a piece of a larger one gives the line and column
+    it starts at, its first line then starts before offset 0. nodes read
+    from the source keep it to build their spans
+    """
+    __slots__ = ('first', 'starts')
+    NEWLINE = re.compile('\n')
+
+    def __init__(self, src: str, line=0, col=0, start=0, end=None):
+        super(LineIndex, self).__init__()
+        self.first = line
+        self.starts = [start - col]
+        self.starts.extend(m.end() for m in self.NEWLINE.finditer(src, start, len(src) if end is None else end))
+
+    def line_info(self, index: int) -> (int, int):
+        ln = bisect_right(self.starts, index) - 1
+        return self.first + ln, index - self.starts[ln]
+
+    def span(self, start: int, end: int) -> Span:
+        starts = self.starts
+        first = self.first
+        start_ln = bisect_right(starts, start)
+        end_ln = bisect_right(starts, end, start_ln - 1)
+        return Span(Pos(first + start_ln, start - starts[start_ln - 1] + 1),
+                    Pos(first + end_ln, end - starts[end_ln - 1] + 1))
 
 
 def to_pos(pos: (int, int)):
@@ -25,87 +61,403 @@ def map_number(s):
         return RInt(sign * body)
     return RFloat(sign * body)
 
-@generate
-def number():
-    start_pos = yield parsy.line_info
-    ret = yield regex(r'[+-]?\d+(\.\d+)?').map(map_number)
-    end_pos = yield parsy.line_info
-    ran = to_range(start_pos, end_pos)
-    ret.range = ran
-    return ret
-
-# number = regex(r'[+-]?\d+(\.\d+)?').map(map_number)
-
-raw_symbol = regex(r"""[^()[\]{}",'`|\s]+""")
-
-
-@generate
-def slist():
-    start_pos = yield parsy.line_info
-    forward = yield parsy.regex(r'[([]')
-    atoms = yield atom.sep_by(parsy.whitespace)
-
-    if forward == '(':
-        yield regex(r'\s*') >> parsy.string(')')
-    else:
-        yield regex(r'\s*') >> parsy.string(']')
-    end_pos = yield parsy.line_info
-    return RList(atoms, sq=forward == '[', span=to_range(start_pos, end_pos))
-
-
-@generate
-def symbol():
-    """
-    parse a symbol or a bool
-    """
-    start_pos = yield parsy.line_info
-    raw = yield raw_symbol
-    end_pos = yield parsy.line_info
-
-    ran = to_range(start_pos, end_pos)
-    if raw == '#t':
-        return RBool(True, span=ran)
-    elif raw == '#f':
-        return RBool(False, span=ran)
-    elif raw.startswith('#\\'):
-        return RChar(raw)
-    else:
-        return RSymbol(raw, span=ran)
-
-
-@generate
-def string():
-    start_pos = yield parsy.line_info
-    ret = yield regex(r'''"[^"]*"''').map(lambda x: RString(x[1:-1]))
-    end_pos = yield parsy.line_info
-    return RString(ret, span=to_range(start_pos, end_pos))
-
-
-@generate
-def atom():
-    start_pos = yield parsy.line_info
-    quote = yield parsy.string("'").optional()
-    ret = yield raw_atom
-    end_pos = yield parsy.line_info
-
-    ran = to_range(start_pos, end_pos)
-    if quote is not None:
-        return RList([RSymbol('quote'), ret], span=ran)
-    else:
-        ret.range = ran
+CLOSE = {'(': ')', '[': ']', b'(': b')', b'[': b']'}
+
+
+class Reader(object):
+    """
+    reads the atoms of a source in one pass over its characters. a token
+    is tried as a number, then a symbol, a string and a list, atoms of a
+    list are separated by whitespace and top level atoms may touch. open
+    lists are kept on a stack, so nesting is not bounded by recursion.
+    with PAUSE_GC set, the garbage collector of the whole process is off
+    while a program is read, for scripts that own the process
+    """
+    TOKEN = re.compile(r'''(?P<number>[+-]?\d+(\.\d+)?)|(?P<symbol>[^()[\]{}",'`|\s]+)|(?P<string>"[^"]*")|(?P<list>[([])''')
+    WHITESPACE = re.compile(r'\s*')
+    QUOTE = "'"
+    PAUSE_GC = False
+
+    def __init__(self, src: str, lines=None):
+        super(Reader, self).__init__()
+        self.src = src
+        self.lines = LineIndex(src) if lines is None else lines
+
+    def fail(self, expected: str, index: int):
+        raise parsy.ParseError(frozenset([expected]), self.src, index)
+
+    def read_program(self, index=0, end=None) -> ([RExpr], int):
+        src = self.src
+        whitespace = self.WHITESPACE.match
+        end = len(src) if end is None else end
+        atoms = []
+        # the tree has no cycles, collecting while it grows only rescans it
+        collecting = self.PAUSE_GC and gc.isenabled()
+        if collecting:
+            gc.disable()
+        try:
+            index = whitespace(src, index, end).end()
+            while index < end:
+                ret, index = self.read_atom(index)
+                atoms.append(ret)
+                index = whitespace(src, index, end).end()
+        finally:
+            if collecting:
+                gc.enable()
+        return atoms, index
+
+    def read_atom(self, index: int, quotes=True) -> (RExpr, int):
+        src = self.src
+        whitespace = self.WHITESPACE.match
+        quote = self.QUOTE
+        # the lists opened and not yet closed, innermost last, each as
+        # (atoms, start, close bracket, start of its quote or -1)
+        stack = []
+        while True:
+            start = index
+            quoted = quotes and src[index:index + 1] == quote
+            quotes = True
+            if quoted:
+                index += 1
+            ret, end = self.read_token(index)
+            if ret is None:
+                stack.append(([], index, CLOSE[src[index:index + 1]], start if quoted else -1))
+                end = index + 1
+            else:
+                if quoted:
+                    ret = self.quote(ret, start, end)
+                if not stack:
+                    return ret, end
+                stack[-1][0].append(ret)
+            # close every list that ends here, then read the next atom
+            while True:
+                atoms, list_start, close, quote_start = stack[-1]
+                next_end = whitespace(src, end).end()
+                c = src[next_end:next_end + 1]
+                # the first atom follows the bracket, the others follow whitespace
+                if c and c != close and (next_end == end) != bool(atoms):
+                    index = next_end
+                    break
+                if c != close:
+                    self.fail(close, next_end)
+                stack.pop()
+                end = next_end + 1
+                ret = RList(atoms, sq=close == ']' or close == b']')
+                ret.lines = self.lines
+                ret.start = list_start
+                ret.length = end - list_start
+                if quote_start >= 0:
+                    ret = self.quote(ret, quote_start, end)
+                if not stack:
+                    return ret, end
+                stack[-1][0].append(ret)
+
+    def read_raw_atom(self, index: int) -> (RExpr, int):
+        return self.read_atom(index, quotes=False)
+
+    def quote(self, atom: RExpr, start: int, end: int) -> RList:
+        ret = RList([RSymbol('quote'), atom])
+        ret.lines = self.lines
+        ret.start = start
+        ret.length = end - start
         return ret
 
-raw_atom = number | symbol | string | slist
+    def read_token(self, index: int) -> (Optional[RExpr], int):
+        """
+        reads a number, symbol or string, or None at an opening bracket
+        """
+        m = self.TOKEN.match(self.src, index)
+        if m is None:
+            self.fail('an atom', index)
+        end = m.end()
+        kind = m.lastgroup
+        if kind == 'number':
+            ret = map_number(m.group())
+        elif kind == 'symbol':
+            raw = m.group()
+            if raw == '#t':
+                ret = RBool(True)
+            elif raw == '#f':
+                ret = RBool(False)
+            elif raw.startswith('#\\'):
+                ret = RChar(raw)
+            else:
+                ret = RSymbol(intern(raw))
+        elif kind == 'string':
+            ret = RString(RString(self.src[index + 1:end - 1]))
+        else:
+            return None, index
+        ret.lines = self.lines
+        ret.start = index
+        ret.length = end - index
+        return ret, end
+
+
+def reader_parser(read):
+    """
+    a parsy parser that runs a Reader method from the current index. each
+    parse indexes the lines of the whole stream, so a source is read with
+    one whole_program parse rather than one atom parse per form
+    """
+
+    def parse(stream, index):
+        try:
+            ret, index = read(Reader(stream), index)
+        except parsy.ParseError as e:
+            return parsy.Result(False, -1, None, e.index, e.expected)
+        return parsy.Result.success(index, ret)
+
+    return parsy.Parser(parse)
+
+
+atom = reader_parser(Reader.read_atom)
+raw_atom = reader_parser(Reader.read_raw_atom)
+whole_program = reader_parser(Reader.read_program)
+
+
+class MappedLineIndex(LineIndex):
+    """
+    LineIndex of a memory mapped source. offsets count bytes and columns
+    count characters, which differ only on lines holding non ascii bytes
+    """
+    __slots__ = ('src', 'start', 'wide')
+    NEWLINE = re.compile(b'\n')
+    WIDE = re.compile(b'[\x80-\xff]+')
+
+    def __init__(self, src: mmap.mmap, line=0, col=0, start=0, end=None):
+        super(MappedLineIndex, self).__init__(src, line, col, start, end)
+        self.src = src
+        self.start = start
+        end = len(src) if end is None else end
+        self.wide = {bisect_right(self.starts, m.start()) - 1 for m in self.WIDE.finditer(src, start, end)}
+
+    def line_info(self, index: int) -> (int, int):
+        ln = bisect_right(self.starts, index) - 1
+        if ln not in self.wide:
+            return self.first + ln, index - self.starts[ln]
+        line_start = max(self.starts[ln], self.start)
+        return self.first + ln, line_start - self.starts[ln] + len(str(self.src[line_start:index], 'utf-8', 'replace'))
+
+    def span(self, start: int, end: int) -> Span:
+        if not self.wide:
+            return super(MappedLineIndex, self).span(start, end)
+        return Span(to_pos(self.line_info(start)), to_pos(self.line_info(end)))
+
+
+class MappedSymbol(RSymbol):
+    """
+    RSymbol whose text stays in the mapped source until it is first read
+    """
+    __slots__ = ('src', 'text')
+
+    def __init__(self, src: mmap.mmap, start: int, end: int):
+        RExpr.__init__(self)
+        self.src = src
+        self.start = start
+        self.length = end - start
+        self.text = None
+
+    @property
+    def v(self) -> str:
+        if self.text is None:
+            self.text = str(self.src[self.start:self.start + self.length], 'utf-8')
+        return self.text
+
+
+class MappedString(RString):
+    """
+    RString whose text stays in the mapped source until it is first read
+    """
+    __slots__ = ('src', 'text')
+
+    def __init__(self, src: mmap.mmap, start: int, end: int):
+        RExpr.__init__(self)
+        self.src = src
+        self.start = start
+        self.length = end - start
+        self.text = None
+
+    @property
+    def v(self) -> str:
+        if self.text is None:
+            self.text = str(self.src[self.start:self.start + self.length], 'utf-8')
+        return self.text
+
+
+class MappedReader(Reader):
+    """
+    Reader over the bytes of a memory mapped source. symbols and strings
+    are kept as offsets into the mapping, whitespace and digits are the
+    ascii ones
+    """
+    TOKEN = re.compile(rb'''(?P<number>[+-]?\d+(\.\d+)?)|(?P<symbol>[^()[\]{}",'`|\s]+)|(?P<string>"[^"]*")|(?P<list>[([])''')
+    WHITESPACE = re.compile(rb'\s*')
+    QUOTE = b"'"
+
+    def fail(self, expected, index: int):
+        super(MappedReader, self).fail(expected.decode() if isinstance(expected, bytes) else expected, index)
+
+    def read_token(self, index: int) -> (Optional[RExpr], int):
+        m = self.TOKEN.match(self.src, index)
+        if m is None:
+            self.fail('an atom', index)
+        end = m.end()
+        kind = m.lastgroup
+        if kind == 'number':
+            ret = map_number(m.group().decode())
+        elif kind == 'symbol':
+            raw = m.group()
+            if raw == b'#t':
+                ret = RBool(True)
+            elif raw == b'#f':
+                ret = RBool(False)
+            elif raw.startswith(b'#\\'):
+                ret = RChar(raw.decode())
+            else:
+                ret = MappedSymbol(self.src, index, end)
+        elif kind == 'string':
+            ret = RString(MappedString(self.src, index + 1, end - 1))
+        else:
+            return None, index
+        ret.lines = self.lines
+        ret.start = index
+        ret.length = end - index
+        return ret, end
+
 
-@generate
-def whole_program():
+class ChunkError(parsy.ParseError):
     """
-    parse whole program
+    a ParseError of read_forms, at a line and column of the whole input
     """
-    yield regex(r'\s*')
-    atoms = yield atom.sep_by(regex(r'\s*'))
-    yield regex(r'\s*')
-    return atoms
 
+    def __init__(self, expected, index: int, pos: (int, int)):
+        super(ChunkError, self).__init__(expected, None, index)
+        self.pos = pos
 
+    def line_info(self):
+        return '{}:{}'.format(*self.pos)
 
+
+class Scanner(object):
+    """
+    follows brackets and strings through text read in pieces, to find
+    where it can be cut: after a bracket that closes a top level form or
+    at whitespace between top level atoms
+    """
+    STRUCTURE = re.compile(r'(?P<string>")|(?P<open>[([])|(?P<close>[)\]])')
+    LAST_SPACE = re.compile(r'\s\S*\Z')
+    DQUOTE = '"'
+
+    def __init__(self):
+        super(Scanner, self).__init__()
+        self.depth = 0
+        self.in_string = False
+
+    def cut(self, src, start: int, end: int) -> Optional[int]:
+        """
+        scan src[start:end], the last offset in it where the text read so
+        far can be cut, None if there is none
+        """
+        cut = None
+        index = start
+        while index < end:
+            if self.in_string:
+                index = src.find(self.DQUOTE, index, end)
+                if index < 0:
+                    break
+                self.in_string = False
+                index += 1
+                if self.depth == 0:
+                    cut = index
+                continue
+            m = self.STRUCTURE.search(src, index, end)
+            if m is None:
+                break
+            index = m.end()
+            kind = m.lastgroup
+            if kind == 'string':
+                self.in_string = True
+            elif kind == 'open':
+                self.depth += 1
+            else:
+                self.depth -= 1
+                if self.depth <= 0:
+                    self.depth = 0
+                    cut = index
+        if not self.in_string and self.depth == 0:
+            m = self.LAST_SPACE.search(src, start if cut is None else cut, end)
+            if m is not None:
+                cut = m.start()
+        return cut
+
+
+class MappedScanner(Scanner):
+    STRUCTURE = re.compile(rb'(?P<string>")|(?P<open>[([])|(?P<close>[)\]])')
+    LAST_SPACE = re.compile(rb'\s\S*\Z')
+    DQUOTE = b'"'
+
+
+def read_piece(reader: Reader, start: int, end: int, offset=0) -> [RExpr]:
+    try:
+        forms, _ = reader.read_program(start, end)
+    except parsy.ParseError as e:
+        raise ChunkError(e.expected, offset + e.index, reader.lines.line_info(e.index))
+    return forms
+
+
+def read_forms(f: TextIO, chunk_size=1 << 16) -> Iterator[RExpr]:
+    """
+    yield the top level forms of a file as soon as each is read. chunks
+    are scanned once and only the text after the last cut is kept
+    """
+    scanner = Scanner()
+    pending = []
+    offset = 0
+    line, col = 0, 0
+    while True:
+        chunk = f.read(chunk_size)
+        cut = scanner.cut(chunk, 0, len(chunk)) if chunk else 0
+        if cut is None:
+            pending.append(chunk)
+            continue
+        pending.append(chunk[:cut])
+        src = ''.join(pending)
+        pending = [chunk[cut:]]
+        lines = LineIndex(src, line, col)
+        yield from read_piece(Reader(src, lines), 0, len(src), offset)
+        offset += len(src)
+        line, col = lines.line_info(len(src))
+        if not chunk:
+            return
+
+
+def map_forms(path: str, window=1 << 16) -> Iterator[RExpr]:
+    """
+    read_forms of a memory mapped file. the mapping is read in place and
+    stays open while symbols or strings read from it are alive, pages
+    behind the last form read are handed back to the system, they are
+    read again from the file if a symbol there is decoded later
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        src = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    scanner = MappedScanner()
+    start = 0
+    released = 0
+    line, col = 0, 0
+    for index in range(0, len(src), window):
+        end = min(index + window, len(src))
+        cut = scanner.cut(src, index, end)
+        if end == len(src):
+            cut = end
+        if cut is None:
+            continue
+        lines = MappedLineIndex(src, line, col, start, cut)
+        yield from read_piece(MappedReader(src, lines), start, cut)
+        line, col = lines.line_info(cut)
+        start = cut
+        page_end = cut - cut % mmap.PAGESIZE
+        if hasattr(mmap, 'MADV_DONTNEED') and page_end > released:
+            src.madvise(mmap.MADV_DONTNEED, released, page_end - released)
+            released = page_end
@@ -0,0 +1,114 @@
+#%%
+import gc
+import io
+import parsy
+from ir_lit import IRPackedList
+from ir_parse import parse_ir_expr
+from parsing import LineIndex, MappedSymbol, Reader, map_forms, read_forms, whole_program
+from type_check import TypeChecker
+
+
+#%%
+def test_line_index():
+    src = "(define (f x)\n  (+ x 1))\n\n\n'(a\n b) \"two\nlines\""
+    index = LineIndex(src)
+    for offset in range(len(src) + 1):
+        assert index.line_info(offset) == parsy.line_info_at(src, offset)
+    string = whole_program.parse(src)[-1]
+    assert (string.span.start.ln, string.span.start.col) == (6, 5)
+    assert (string.span.end.ln, string.span.end.col) == (7, 7)
+
+
+#%%
+def test_reader():
+    atoms = whole_program.parse("1a '[b #t] \"s\"(c)")
+    assert [repr(atom) for atom in atoms] == [
+        'RFloat[1]', 'RSymbol[a]', 'RList[RSymbol[quote] RList[RSymbol[b] RBool[#t]]]', "RString[RString['s']]",
+        'RList[RSymbol[c]]']
+    assert atoms[2].span.start.col == 4 and atoms[2].span.end.col == 11 and atoms[2].v[1].sq
+    assert str(atoms[3].range) == str(atoms[3].span) and atoms[0].span is None and atoms[0].range.end.col == 2
+    for bad in ['( a)', '(a(b))', '(a]', "''a", '(a b', 'a)', '"ab']:
+        try:
+            whole_program.parse(bad)
+            assert False, bad
+        except parsy.ParseError:
+            pass
+
+    # the collector is paused only when asked, and left as it was found
+    class PausingReader(Reader):
+        PAUSE_GC = True
+
+    gc.disable()
+    try:
+        PausingReader('(a b)').read_program()
+        assert not gc.isenabled()
+    finally:
+        gc.enable()
+    PausingReader('(a b)').read_program()
+    assert gc.isenabled()
+
+
+#%%
+def test_read_deep_nesting():
+    depth = 50000
+    src = "'(cons 1 " * depth + 'null' + ')' * depth
+    [atom] = whole_program.parse(src)
+    assert atom.span.start.col == 1 and atom.span.end.col == len(src) + 1
+    for _ in range(depth):
+        assert repr(atom.v[0]) == 'RSymbol[quote]'
+        atom = atom.v[1].v[2]
+    assert repr(atom) == 'RSymbol[null]'
+    try:
+        whole_program.parse('[' * depth + 'x)')
+        assert False
+    except parsy.ParseError as e:
+        assert e.index == depth + 1 and e.expected == frozenset([']'])
+
+
+#%%
+def test_read_forms():
+    src = "(define (f x)\n  (+ x 1))\n'[a \"b c\"] 12 #t\n(f\n 2)"
+    whole = whole_program.parse(src)
+    for chunk_size in (1, 3, 8, 1 << 16):
+        forms = list(read_forms(io.StringIO(src), chunk_size))
+        assert [repr(form) for form in forms] == [repr(form) for form in whole]
+        assert [str(form.span) for form in forms] == [str(form.span) for form in whole]
+    try:
+        list(read_forms(io.StringIO("(a)\n(b\n (c"), 2))
+        assert False
+    except parsy.ParseError as e:
+        assert str(e).endswith('at 2:3')
+
+    src = "(define (g x) x)\n(g 1)\n(+ 1 #t)\n(g #t)"
+    _, _, ir_terms, errors = TypeChecker().check_content(whole_program.parse(src))
+    _, _, stream_terms, stream_errors = TypeChecker().check_stream(read_forms(io.StringIO(src), 4))
+    assert [str(term.to_raw()) for term in stream_terms] == [str(term.to_raw()) for term in ir_terms]
+    assert len(stream_errors) == len(errors) == 1 and str(stream_errors[0].span) == str(errors[0].span)
+
+    # released forms are not kept by the caller's list either
+    forms = whole_program.parse(src)
+    _, _, released_terms, released_errors = TypeChecker().check_content(forms, release=True)
+    assert forms == [] and len(released_errors) == 1
+    assert [str(term.to_raw()) for term in released_terms] == [str(term.to_raw()) for term in ir_terms]
+
+
+#%%
+def test_map_forms(tmp_path):
+    src = "(define (f x)\n  (+ x 1))\n'(λ \"é b\") 12 #\\a\n  (f é)\n'({})".format(' '.join(['sym'] * 70))
+    path = tmp_path / 'mapped.rkt'
+    path.write_text(src, encoding='utf-8')
+    whole = whole_program.parse(src)
+    forms = list(map_forms(str(path), 8))
+    assert [repr(form) for form in forms] == [repr(form) for form in whole]
+    assert [str(form.span) for form in forms] == [str(form.span) for form in whole]
+    assert str(forms[4].v[1].span) == str(whole[4].v[1].span) == '(ln:4 col:6 -> ln:4 col:7)'
+
+    symbol = list(map_forms(str(path)))[4].v[0]
+    assert isinstance(symbol, MappedSymbol) and symbol.text is None
+    assert symbol.v == 'f' and symbol.text == 'f'
+    expr, _ = parse_ir_expr(forms[-1])
+    assert isinstance(expr, IRPackedList) and expr.v == ('sym',) * 70
+
+    empty = tmp_path / 'empty.rkt'
+    empty.write_text('')
+    assert list(map_forms(str(empty))) == []
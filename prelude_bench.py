@@ -0,0 +1,68 @@
+import os
+import subprocess
+import sys
+import tempfile
+from argparse import ArgumentParser
+from timeit import default_timer as timer
+from infer import *
+
+
+COLD = '''
+from timeit import default_timer as timer
+start = timer()
+from infer import TypeEnv
+imported = timer()
+TypeEnv.default()
+print(imported - start, timer() - imported)
+'''
+
+
+def time_per_op(f, repeat: int) -> float:
+    start = timer()
+    for _ in range(repeat):
+        f()
+    return (timer() - start) / repeat * 1e6
+
+
+def cold_start(runs: int, path: str, saved: bool) -> (float, float):
+    """
+    import and prelude time of fresh processes saving the prelude at
+    path, in milliseconds
+    """
+    imports = []
+    preludes = []
+    env = dict(os.environ, TSCHEME_PRELUDE=path)
+    for _ in range(runs):
+        if not saved and os.path.exists(path):
+            os.remove(path)
+        out = subprocess.run([sys.executable, '-c', COLD], stdout=subprocess.PIPE, check=True, env=env)
+        imported, prelude = out.stdout.split()
+        imports.append(float(imported) * 1e3)
+        preludes.append(float(prelude) * 1e3)
+    return min(imports), min(preludes)
+
+
+def main():
+    parser = ArgumentParser(description='cost of building, loading and reusing the prelude environment')
+    parser.add_argument('--repeat', type=int, default=200, help='operations measured in process')
+    parser.add_argument('--runs', type=int, default=5, help='fresh processes per cold start measure')
+    ARGS = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'prelude.pickle')
+    build = time_per_op(TypeEnv.build_default, ARGS.repeat)
+    TypeEnv.build_default().dump(path)
+    load = time_per_op(lambda: TypeEnv.load(path), ARGS.repeat)
+    shared = time_per_op(TypeEnv.default, ARGS.repeat)
+    print('per check, build the prelude:  {:>10.2f} us'.format(build))
+    print('per check, load from disk:     {:>10.2f} us'.format(load))
+    print('per check, shared prelude:     {:>10.2f} us'.format(shared))
+
+    imported, built = cold_start(ARGS.runs, path, False)
+    _, saved = cold_start(ARGS.runs, path, True)
+    print('cold start, import:            {:>10.2f} ms'.format(imported))
+    print('cold start, build and save:    {:>10.2f} ms'.format(built))
+    print('cold start, load saved:        {:>10.2f} ms'.format(saved))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+import tracemalloc
+from argparse import ArgumentParser
+from pathlib import Path
+from timeit import default_timer as timer
+from parsing import Reader, whole_program
+from syntax import RList
+
+
+def count_nodes(atoms) -> int:
+    count = 0
+    stack = list(atoms)
+    while stack:
+        atom = stack.pop()
+        count += 1
+        if isinstance(atom, RList):
+            stack.extend(atom.v)
+    return count
+
+
+def main():
+    parser = ArgumentParser(description='reader throughput on a corpus of scripts repeated to a given size')
+    parser.add_argument('root', nargs='?', default='test_src', help='directory of scripts')
+    parser.add_argument('--mb', type=float, default=2.0, help='size of the scaled source in MB')
+    parser.add_argument('--repeat', type=int, default=3, help='runs, the fastest is reported')
+    parser.add_argument('--pause-gc', action='store_true', help='pause the garbage collector while reading, as the scripts do')
+    ARGS = parser.parse_args()
+    Reader.PAUSE_GC = ARGS.pause_gc
+
+    corpus = '\n'.join(path.read_text() for path in sorted(Path(ARGS.root).rglob('*.rkt')))
+    src = corpus * max(int(ARGS.mb * 1024 * 1024 / len(corpus)), 1)
+    size = len(src.encode()) / 1024 / 1024
+
+    best = None
+    for _ in range(ARGS.repeat):
+        start = timer()
+        atoms = whole_program.parse(src)
+        elapsed = timer() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print('{:.2f}MB, {} top level forms'.format(size, len(atoms)))
+    print('read in {:.3f}s, {:.2f}MB/s'.format(best, size / best))
+
+    del atoms
+    tracemalloc.start()
+    atoms = whole_program.parse(src)
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    nodes = count_nodes(atoms)
+    print('{} nodes, {:.1f} bytes per node'.format(nodes, used / nodes))
+
+
+if __name__ == '__main__':
+    main()
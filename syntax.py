@@ -1,3 +1,6 @@
+from typing import Optional
+
+
 class Formatter(object):
 
     def __init__(self, indent_width=2):
@@ -62,6 +65,7 @@ class Formatter(object):
 
 
 class Pos(object):
+    __slots__ = ('ln', 'col')
 
     def __init__(self, ln: int, col: int):
         self.ln = ln
@@ -75,12 +79,19 @@ class Pos(object):
 
 
 class Span(object):
+    __slots__ = ('start', 'end')
 
     def __init__(self, start: Pos, end: Pos):
         super(Span, self).__init__()
         self.start = start
         self.end = end
 
+    def span(self, start: int, end: int) -> 'Span':
+        """
+        a Span given to an RExpr stands for its own lines, see RExpr
+        """
+        return self
+
     def __repr__(self):
         return '[{} -> {}]'.format(repr(self.start), repr(self.end))
 
@@ -89,9 +100,32 @@ class Span(object):
 
 
 class RExpr(object):
-    def __init__(self, span: Span):
+    """
+    a node keeps the offset start and the length of the text it was read
+    from and the line index of its source in lines, its Span is only
+    built when asked for. lengths are mostly small ints, which are shared
+    """
+    __slots__ = ('lines', 'start', 'length')
+    # numbers and characters never carried a span, only a range
+    spanned = True
+
+    def __init__(self, span=None):
         super(RExpr, self).__init__()
-        self.span = span
+        self.lines = span
+        self.start = 0
+        self.length = 0
+
+    @property
+    def span(self) -> Optional[Span]:
+        if self.lines is None or not self.spanned:
+            return None
+        return self.lines.span(self.start, self.start + self.length)
+
+    @property
+    def range(self) -> Optional[Span]:
+        if self.lines is None:
+            return None
+        return self.lines.span(self.start, self.start + self.length)
 
     def to_stream(self, stream: Formatter):
         return stream.add_token(str(self))
@@ -103,6 +137,8 @@ class RExpr(object):
 
 
 class RSymbol(RExpr):
+    __slots__ = ('v',)
+
     def __init__(self, v: str, span=None):
         super(RSymbol, self).__init__(span=span)
         self.v = v
@@ -118,6 +154,7 @@ class RSymbol(RExpr):
 
 
 class RString(RExpr):
+    __slots__ = ('v',)
 
     def __init__(self, v: str, span=None):
         super(RString, self).__init__(span=span)
@@ -132,6 +169,8 @@ class RString(RExpr):
 
 
 class RChar(RExpr):
+    __slots__ = ('v',)
+    spanned = False
 
     def __init__(self, v: str, span=None):
         super(RChar, self).__init__(span=span)
@@ -145,6 +184,8 @@ class RChar(RExpr):
 
 
 class RFloat(RExpr):
+    __slots__ = ('v',)
+    spanned = False
 
     def __init__(self, v: float, span=None):
         super(RFloat, self).__init__(span=span)
@@ -158,6 +199,8 @@ class RFloat(RExpr):
 
 
 class RInt(RExpr):
+    __slots__ = ('v',)
+    spanned = False
 
     def __init__(self, v: int, span=None):
         super(RInt, self).__init__(span=span)
@@ -171,6 +214,7 @@ class RInt(RExpr):
 
 
 class RBool(RExpr):
+    __slots__ = ('v',)
 
     def __init__(self, v: bool, span=None):
         super(RBool, self).__init__(span=span)
@@ -187,37 +231,62 @@ class RBool(RExpr):
 
 
 class RList(RExpr):
+    __slots__ = ('v', 'sq')
 
     def __init__(self, v: [RExpr], sq=False, span=None):
         super(RList, self).__init__(span=span)
         self.v = v
         self.sq = sq
 
+    def tokens(self, show, brackets):
+        """
+        show of each atom and the brackets and spaces between them, the
+        lists are opened on an explicit stack so nesting is not bounded
+        by recursion. brackets gives the open and close of a list
+        """
+        stack = [self]
+        while stack:
+            item = stack.pop()
+            if type(item) is str:
+                yield item
+            elif isinstance(item, RList):
+                open_bracket, close_bracket = brackets(item)
+                yield open_bracket
+                stack.append(close_bracket)
+                for i in reversed(range(len(item.v))):
+                    stack.append(item.v[i])
+                    if i > 0:
+                        stack.append(' ')
+            else:
+                yield show(item)
+
     def __str__(self):
-        bulk = ' '.join([str(elem) for elem in self.v])
-        if self.sq:
-            return '[{}]'.format(bulk)
-        else:
-            return '({})'.format(bulk)
+        return ''.join(self.tokens(str, lambda item: ('[', ']') if item.sq else ('(', ')')))
 
     def __repr__(self):
-        bulk = ' '.join([repr(elem) for elem in self.v])
-        return "RList[{}]".format(bulk)
+        return ''.join(self.tokens(repr, lambda item: ('RList[', ']')))
 
     def to_stream(self, stream: Formatter):
-        if len(self.v) == 2 and isinstance(self.v[0], RSymbol):
-            if self.v[0].v == 'quote':
+        # None stands for the whitespace between the items of a list
+        stack = [self]
+        while stack:
+            item = stack.pop()
+            if item is None:
+                stream.add_whitespace()
+            elif type(item) is str:
+                stream.add_token(item)
+            elif not isinstance(item, RList):
+                item.to_stream(stream)
+            elif len(item.v) == 2 and isinstance(item.v[0], RSymbol) and item.v[0].v == 'quote':
                 stream.add_token("'")
-                self.v[1].to_stream(stream)
-                return
-
-        stream.add_token('[' if self.sq else '(')
-        if len(self.v) > 0:
-            self.v[0].to_stream(stream)
-        for v in self.v[1:]:
-            stream.add_whitespace()
-            v.to_stream(stream)
-        stream.add_token(']' if self.sq else ')')
+                stack.append(item.v[1])
+            else:
+                stream.add_token('[' if item.sq else '(')
+                stack.append(']' if item.sq else ')')
+                for i in reversed(range(len(item.v))):
+                    stack.append(item.v[i])
+                    if i > 0:
+                        stack.append(None)
         return
 
 
@@ -1,11 +1,13 @@
 #!/usr/bin/env python3
+import type_sys
 from infer import *
-from typing import Set
+from typing import Iterable, Set
 from ir_parse import ParseError
 from ir_parse import is_type_def, parse_define_type, parse_define_sum_ctors, parse_define_record_ctor
-from ir_parse import parse_define, parse_ir_expr, parse_lit
+from ir_parse import parse_define, parse_ir_expr, parse_lit, parse_with_source
 from collections import OrderedDict
-from parsing import whole_program
+from itertools import chain
+from parsing import Reader, map_forms, read_forms, whole_program
 from code_gen import CodeGen, SumCtor
 from networkx import DiGraph
 from networkx.algorithms.components import strongly_connected_components as scc
@@ -74,7 +76,7 @@ def extract_type(forms: [RExpr]) -> (
 
 class TypeChecker(object):
 
-    def __init__(self, type_env=None, verbose=False):
+    def __init__(self, type_env=None, verbose=False, limits=None, bidirectional=False, memo_size=0):
         super(TypeChecker, self).__init__()
         if type_env is None:
             self.type_env = TypeEnv.empty()
@@ -82,7 +84,7 @@ class TypeChecker(object):
             self.type_env = type_env
         self.defined_types = OrderedDict()
         self.ctors = OrderedDict()
-        self.infer_sys = InferSys()
+        self.infer_sys = InferSys(limits=limits, bidirectional=bidirectional, memo_size=memo_size)
         self.verbose = verbose
 
     def check_types(self, type_forms: [RList]) -> (Mapping[str, Type], Mapping[str, Type], [str]):
@@ -148,11 +150,57 @@ class TypeChecker(object):
                 print('define: {} :: {}'.format(define.sym.v, s))
         return s, errors
 
-    def check_content(self, r_exprs: [RExpr], verbose=False) -> \
+    def blame_defines(self, type_env: TypeEnv, forms: [RExpr], msg: str) -> str:
+        """
+        infer failed defines again in the slow mode that tells where the
+        conflicting constraints come from, only failures pay for it
+        """
+        blame_sys = None
+        defines = []
+        for form in forms:
+            (define, _), sources = parse_with_source(parse_define, form)
+            sources[define] = form
+            if blame_sys is None:
+                blame_sys = BlameInferSys(sources, form, self.infer_sys.limits)
+            else:
+                blame_sys.sources.update(sources)
+            defines.append(define)
+
+        if len(defines) > 1:
+            _, blame_msg = blame_sys.solve_ir_many_def(type_env, defines)
+        elif isinstance(defines[0], IRDefine):
+            _, blame_msg = blame_sys.solve_ir_define(type_env, defines[0])
+        else:
+            _, blame_msg = blame_sys.solve_var_define(type_env, defines[0])
+        return msg if blame_msg is None else blame_msg
+
+    def define_failure(self, type_env: TypeEnv, forms: [RExpr], msg: str) -> str:
+        """
+        error text of failed defines, a budget error is reported as it is,
+        since running the define again would only hit it again
+        """
+        if isinstance(self.infer_sys.error, BudgetException):
+            return msg
+        return 'type error, unification error: {}'.format(self.blame_defines(type_env, forms, msg))
+
+    def blame_expr(self, type_env: TypeEnv, form: RExpr, msg: str) -> str:
+        (ir_expr, _), sources = parse_with_source(parse_ir_expr, form)
+        _, blame_msg = BlameInferSys(sources, form, self.infer_sys.limits).solve_ir_expr(type_env, ir_expr)
+        return msg if blame_msg is None else blame_msg
+
+    def check_content(self, r_exprs: [RExpr], verbose=False, lowered=(), release=False) -> \
             ([CodeGen], Set[str], [IRTerm], [ParseError]):
+        """
+        lowered are expression forms already parsed to IR, checked before
+        the expression forms of r_exprs, see check_stream. with release,
+        r_exprs is emptied once split, so each define form is dropped as
+        soon as it is checked
+        """
         errors = []
         ir_terms = []
         (other_forms, record_names, types, funcs, code_gens), type_errors = extract_type(r_exprs)
+        if release:
+            r_exprs.clear()
         # types, ctors, type_errors = self.check_types(type_forms)
 
         if len(type_errors) > 0:
@@ -178,6 +226,7 @@ class TypeChecker(object):
 
         define_forms = [f for f in other_forms if TypeChecker.is_define_form(f)]
         expr_forms = [f for f in other_forms if not TypeChecker.is_define_form(f)]
+        del other_forms
 
         all_def = dict()
         all_def_form = dict()
@@ -189,6 +238,8 @@ class TypeChecker(object):
 
             all_def[define.get_name()] = define
             all_def_form[define.get_name()] = define_form
+        # the define forms are only held by all_def_form from here
+        del define_forms
 
         dep_graph = DiGraph()
 
@@ -223,8 +274,9 @@ class TypeChecker(object):
                 def_name = def_group.pop()
                 # print('processing def:', def_name)
                 define = all_def[def_name]
-                expr = all_def_form[def_name]
+                expr = all_def_form.pop(def_name)
 
+                infer_sys.open_scope()
                 if isinstance(define, IRDefine):
                     t, msg = infer_sys.solve_ir_define(type_env, define)
                 else:
@@ -232,72 +284,131 @@ class TypeChecker(object):
                 # print('t:', t)
                 if msg is not None:
                     # print('msg:', msg)
-                    errors.append(
-                        ParseError(
-                                expr.span,
-                                'type error, unification error: {}'.format(msg)
-                            )
-                        )
+                    infer_sys.close_scope()
+                    msg = self.define_failure(type_env, [expr], msg)
+                    errors.append(ParseError(expr.span, msg))
                     continue
 
                 s, match_errors = self.report_define_infer(t, define, expr)
+                infer_sys.close_scope()
                 errors.extend(match_errors)
                 type_env = type_env.add(define.sym, s)
             else:
                 def_names = list(def_group)
                 defs = [all_def[name] for name in def_names]
-                exprs = [all_def_form[name] for name in def_names]
+                exprs = [all_def_form.pop(name) for name in def_names]
+                infer_sys.open_scope()
                 types, msg = infer_sys.solve_ir_many_def(type_env, defs)
                 if msg is not None:
-                    errors.append(
-                        ParseError(
-                                exprs[0].span,
-                                'type error, unification error: {}'.format(msg)
-                            )
-                        )
+                    infer_sys.close_scope()
+                    msg = self.define_failure(type_env, exprs, msg)
+                    errors.append(ParseError(exprs[0].span, msg))
                     continue
                 for (t, _def, expr) in zip(types, defs, exprs):
                     s, match_errors = self.report_define_infer(t, _def, expr)
                     errors.extend(match_errors)
                     type_env = type_env.add(_def.sym, s)
+                infer_sys.close_scope()
 
         # finish at here
 
-        for expr_form in expr_forms:
-            ir_expr, errs = parse_ir_expr(expr_form)
+        exprs = chain(lowered, ((parse_ir_expr(form), form.span, form) for form in expr_forms))
+        for (ir_expr, errs), span, expr_form in exprs:
             ir_terms.append(ir_expr)
             errors.extend(errs)
             if len(errors) > 0:
                 continue
+            infer_sys.open_scope()
             t, msg = infer_sys.solve_ir_expr(type_env, ir_expr)
+            infer_sys.close_scope()
             if msg is not None:
-                msg = "type error, unification error {}".format(msg)
-                errors.append(ParseError(expr_form.span, msg))
+                if not isinstance(infer_sys.error, BudgetException):
+                    if expr_form is not None:
+                        msg = self.blame_expr(type_env, expr_form, msg)
+                    msg = "type error, unification error {}".format(msg)
+                errors.append(ParseError(span, msg))
                 continue
             if self.verbose:
                 print('expr: {} :: {}'.format(ir_expr.to_raw(), t))
 
         return code_gens, record_names, ir_terms, errors
 
+    def check_stream(self, forms: Iterable[RExpr], verbose=False) -> \
+            ([CodeGen], Set[str], [IRTerm], [ParseError]):
+        """
+        check_content of forms that are still being read. an expression
+        form is parsed to IR as soon as it arrives and only the IR and its
+        span are kept, so its unification errors come without blame. a
+        define form is kept until its group is checked, since the defines
+        it refers to may come later, and blame parses it again. the IR of
+        every form is still kept for the output, so peak memory scales
+        with the size of forms
+        """
+        kept = []
+        lowered = []
+        for form in forms:
+            if is_type_def(form) or TypeChecker.is_define_form(form):
+                kept.append(form)
+            else:
+                lowered.append((parse_ir_expr(form), form.span, None))
+        return self.check_content(kept, verbose, lowered, release=True)
+
+    def check_typed_content(self, r_exprs: [RExpr], verbose=False) -> \
+            ([CodeGen], Set[str], [IRTerm], TypeTable, [ParseError]):
+        """
+        check_content that also returns the solved type of every IR node
+        of ir_terms in a TypeTable
+        """
+        table = TypeTable()
+        self.infer_sys.type_table = table
+        try:
+            code_gens, record_names, ir_terms, errors = self.check_content(r_exprs, verbose)
+        finally:
+            self.infer_sys.type_table = None
+        return code_gens, record_names, ir_terms, table, errors
+
 def main():
     parser = ArgumentParser(description='script used to check typed-scheme type')
     parser.add_argument('script', help='path to script')
     parser.add_argument('--silent', action='store_true', help='slient success output')
+    parser.add_argument('--max-nodes', type=int, default=100000, help='largest inferred type, in nodes')
+    parser.add_argument('--max-depth', type=int, default=500, help='deepest inferred type')
+    parser.add_argument('--max-seconds', type=float, default=None, help='time budget per define')
+    parser.add_argument('--bidirectional', action='store_true', help='check define bodies against their annotation')
+    parser.add_argument('--max-type-chars', type=int, default=type_sys.STR_LIMIT, help='longest type printed before it is cut')
+    parser.add_argument('--memo-size', type=int, default=0, help='closed subterm schemas to cache, 0 turns the cache off')
+    parser.add_argument('--stream', action='store_true', help='read and lower the script form by form, dropping each form once it is checked; '
+                        'its IR is kept for the output, so peak memory still scales with the script size')
+    parser.add_argument('--mmap', action='store_true', help='like --stream, reading the script in place from a memory map')
+    parser.add_argument('--prelude', default=PRELUDE_PATH, help='trusted file to load the builtin environment from and save it to')
 
     ARGS = parser.parse_args()
     SCRIPT_PATH = ARGS.script
     SILENT = ARGS.silent
 
-    with open(SCRIPT_PATH, 'r') as f:
-        SRC = f.read()
-
-    r_exprs = whole_program.parse(SRC)
-
-    checker = TypeChecker(verbose=not SILENT)
-    _, _, _, errors = checker.check_content(r_exprs, verbose=not SILENT)
+    set_prelude_path(ARGS.prelude)
+    Reader.PAUSE_GC = True
+    type_sys.STR_LIMIT = ARGS.max_type_chars
+    limits = InferLimits(ARGS.max_nodes, ARGS.max_depth, ARGS.max_seconds)
+    checker = TypeChecker(verbose=not SILENT, limits=limits, bidirectional=ARGS.bidirectional,
+                          memo_size=ARGS.memo_size)
+
+    if ARGS.mmap:
+        _, _, _, errors = checker.check_stream(map_forms(SCRIPT_PATH), verbose=not SILENT)
+    else:
+        with open(SCRIPT_PATH, 'r') as f:
+            if ARGS.stream:
+                _, _, _, errors = checker.check_stream(read_forms(f), verbose=not SILENT)
+            else:
+                r_exprs = whole_program.parse(f.read())
+                _, _, _, errors = checker.check_content(r_exprs, verbose=not SILENT)
     if len(errors) > 0:
         for error in errors:
             print(error)
+    cache = checker.infer_sys.closed_cache
+    if cache is not None and not SILENT:
+        print('closed cache: {} hits, {} misses, {:.1f}% hit rate'.format(
+            cache.hits, cache.misses, 100 * cache.hit_rate()))
 
 
 if __name__ == '__main__':
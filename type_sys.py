@@ -1,18 +1,152 @@
-from typing import Set
+from typing import Set, FrozenSet, Union, Mapping, Optional
+from operator import itemgetter
+from weakref import ref
 from syntax import *
 
 
+# every type is built once per structure, equal types are the same object
+INTERNED = dict()
+
+
+class InternRef(ref):
+    """
+    weak reference from the intern table, forgets its key once the type dies
+    """
+    __slots__ = ('key',)
+
+
+def forget(t_ref: InternRef):
+    if INTERNED.get(t_ref.key) is t_ref:
+        del INTERNED[t_ref.key]
+
+
+def interned(key):
+    t_ref = INTERNED.get(key)
+    if t_ref is None:
+        return None
+    return t_ref()
+
+
+def intern(key, t):
+    t_ref = InternRef(t, forget)
+    t_ref.key = key
+    INTERNED[key] = t_ref
+    return t
+
+
+# ftv sets built, ftv calls answered from the cache,
+# and apply or occurs walks skipped because the type is ground
+FTV_STATS = {'computed': 0, 'cached': 0, 'ground': 0}
+
+NO_FTV = frozenset()
+
+
+def reset_ftv_stats():
+    for k in FTV_STATS:
+        FTV_STATS[k] = 0
+
+
+# a type variable is named by the user, or numbered when inference makes it
+VarId = Union[str, int]
+
+
+def var_name(v: VarId) -> str:
+    """
+    readable name of a type variable, numbered variables get theirs in
+    base 26 (a, b, ..., z, ba, bb, ...) only when they are shown
+    """
+    if isinstance(v, str):
+        return v
+    ret = [ord('a') + v % 26]
+    v //= 26
+    while v > 0:
+        ret.append(ord('a') + v % 26)
+        v //= 26
+    ret.reverse()
+    return ''.join(chr(c) for c in ret)
+
+
+def is_ground(t) -> bool:
+    # None is the hole of a partial annotation, it has no variable
+    return t is None or t.ground
+
+
+def size_of(t) -> int:
+    return 0 if t is None else t.size
+
+
+def depth_of(t) -> int:
+    return 0 if t is None else t.depth
+
+
+# types at most this deep are walked by plain recursion, the common small
+# ones go faster that way. deeper ones are walked on explicit stacks
+RECURSION_MAX_DEPTH = 64
+
+
 class Type(object):
+    """
+    immutable, hash-consed type. build types through the constructors only,
+    so equality and hashing are by identity and never walk the structure,
+    pickling goes through the constructors too.
+    the free variables are computed once per node and kept as a frozenset,
+    ground tells the type has none of them. size is the node count of the
+    type written out as a tree, shared subtrees counted every time.
+    walks over a deep type run on explicit stacks, so its depth is bounded
+    by memory and the limits of inference instead of the recursion limit
+    """
+    __slots__ = ('__weakref__', 'ground', 'ftv_cache', 'size', 'depth')
 
     def apply(self, subst):
         raise NotImplementedError()
 
-    def ftv(self) -> Set[str]:
+    def sub_types(self) -> tuple:
+        """
+        the types this one is built from, None for a hole
+        """
+        return ()
+
+    def rebuild(self, types: ['Type']) -> 'Type':
+        """
+        this type built from types in place of sub_types
+        """
+        return self
+
+    def ftv(self) -> FrozenSet[VarId]:
+        ret = self.ftv_cache
+        if ret is None and self.depth <= RECURSION_MAX_DEPTH:
+            for sub in self.sub_types():
+                if sub is not None and sub.ftv_cache is None:
+                    sub.ftv()
+            FTV_STATS['computed'] += 1
+            ret = self.ftv_cache = frozenset(self.collect_ftv())
+        elif ret is None:
+            # subterms missing their set get it first, children before parents
+            stack = [(self, False)]
+            while stack:
+                t, ready = stack.pop()
+                if t.ftv_cache is not None:
+                    continue
+                if ready:
+                    FTV_STATS['computed'] += 1
+                    t.ftv_cache = frozenset(t.collect_ftv())
+                else:
+                    stack.append((t, True))
+                    stack.extend((sub, False) for sub in t.sub_types() if sub is not None and sub.ftv_cache is None)
+            ret = self.ftv_cache
+        else:
+            FTV_STATS['cached'] += 1
+        return ret
+
+    def collect_ftv(self) -> Set[VarId]:
+        """
+        free variables of this node from the sets cached on its subterms
+        """
         raise NotImplementedError()
 
-    def gen(self, vars: Set[str]):
+    def gen(self, vars: Set[VarId]):
         vars = list(self.ftv().intersection(vars))
-        vars.sort()
+        vars.sort(key=var_name)
         return Schema(self, [TVar(v) for v in vars])
 
     def find_defined(self, name: str):
@@ -26,19 +160,29 @@ class Type(object):
 
 
 class TVar(Type):
-
-    def __init__(self, v: str):
-        super(TVar, self).__init__()
-        self.v = v
+    __slots__ = ('v',)
+
+    def __new__(cls, v: VarId):
+        key = ('var', v)
+        ret = interned(key)
+        if ret is None:
+            ret = object.__new__(cls)
+            ret.v = v
+            ret.ground = False
+            ret.ftv_cache = None
+            ret.size = 1
+            ret.depth = 1
+            intern(key, ret)
+        return ret
 
     def __str__(self):
-        return self.v
+        return var_name(self.v)
 
     def __repr__(self):
         return 'TVar({})'.format(self.v)
 
-    def __eq__(self, other):
-        return self.__dict__ == other.__dict__
+    def __reduce__(self):
+        return TVar, (self.v,)
 
     def apply(self, subst):
         if self.v in subst:
@@ -46,18 +190,28 @@ class TVar(Type):
         else:
             return self
 
-    def ftv(self):
+    def collect_ftv(self):
         return {self.v}
 
     def to_raw(self) -> RExpr:
-        return RSymbol(self.v)
+        return RSymbol(var_name(self.v))
 
 
 class TConst(Type):
-
-    def __init__(self, name: str):
-        super(TConst, self).__init__()
-        self.name = name
+    __slots__ = ('name',)
+
+    def __new__(cls, name: str):
+        key = ('const', name)
+        ret = interned(key)
+        if ret is None:
+            ret = object.__new__(cls)
+            ret.name = name
+            ret.ground = True
+            ret.ftv_cache = NO_FTV
+            ret.size = 1
+            ret.depth = 1
+            intern(key, ret)
+        return ret
 
     def __str__(self):
         return self.name
@@ -65,13 +219,13 @@ class TConst(Type):
     def __repr__(self):
         return 'TConst({})'.format(self.name)
 
-    def __eq__(self, other):
-        return self.__dict__ == other.__dict__
+    def __reduce__(self):
+        return TConst, (self.name,)
 
     def apply(self, subst):
         return self
 
-    def ftv(self):
+    def collect_ftv(self):
         return set()
 
     def to_raw(self) -> RExpr:
@@ -87,32 +241,30 @@ TYPE_UNIT = TConst("Unit")
 
 
 class TArr(Type):
-
-    def __init__(self, in_type: Type, out_type: Type):
-        super(TArr, self).__init__()
-        self.in_type = in_type
-        self.out_type = out_type
+    __slots__ = ('in_type', 'out_type')
+
+    def __new__(cls, in_type: Type, out_type: Type):
+        key = ('->', in_type, out_type)
+        ret = interned(key)
+        if ret is None:
+            ret = object.__new__(cls)
+            ret.in_type = in_type
+            ret.out_type = out_type
+            ret.ground = is_ground(in_type) and is_ground(out_type)
+            ret.ftv_cache = NO_FTV if ret.ground else None
+            ret.size = 1 + size_of(in_type) + size_of(out_type)
+            ret.depth = 1 + max(depth_of(in_type), depth_of(out_type))
+            intern(key, ret)
+        return ret
 
     def __str__(self):
-        def to_str(t):
-            if t is None:
-                return '_'
-            else:
-                return str(t)
-
-        in_type = to_str(self.in_type)
-        out_type = to_str(self.out_type)
-
-        if isinstance(self.in_type, TArr):
-            return '({}) -> {}'.format(in_type, out_type)
-        else:
-            return '{} -> {}'.format(in_type, out_type)
+        return show_type(self, limit=STR_LIMIT)
 
     def __repr__(self):
         return '({})'.format(str(self))
 
-    def __eq__(self, other):
-        return self.__dict__ == other.__dict__
+    def __reduce__(self):
+        return TArr, (self.in_type, self.out_type)
 
     def arity(self) -> int:
         ctor_type = self
@@ -124,26 +276,37 @@ class TArr(Type):
             ctor_type = ctor_type.out_type
         return ret
 
+    def sub_types(self) -> tuple:
+        return self.in_type, self.out_type
+
+    def rebuild(self, types: [Type]) -> Type:
+        return TArr(types[0], types[1])
+
     def apply(self, subst):
+        if self.ground:
+            FTV_STATS['ground'] += 1
+            return self
+        if self.depth > RECURSION_MAX_DEPTH:
+            return substitute(self, subst)
         new_in_type = self.in_type.apply(subst)
         new_out_type = self.out_type.apply(subst)
-        if new_in_type == self.in_type and new_out_type == self.out_type:
+        if new_in_type is self.in_type and new_out_type is self.out_type:
             return self
         else:
             return TArr(new_in_type, new_out_type)
 
-    def ftv(self) -> Set[str]:
+    def collect_ftv(self) -> Set[VarId]:
 
         if self.out_type is None and self.in_type is None:
             return set()
 
         if self.out_type is None:
-            return self.in_type.ftv()
+            return self.in_type.ftv_cache
 
         if self.in_type is None:
-            return self.out_type.ftv()
+            return self.out_type.ftv_cache
 
-        return self.in_type.ftv().union(self.out_type.ftv())
+        return self.in_type.ftv_cache.union(self.out_type.ftv_cache)
 
     def flatten(self) -> [Type]:
         ret = [self.in_type]
@@ -174,40 +337,62 @@ class TArr(Type):
 
 
 class Tuple(Type):
-
-    def __init__(self, types: [Type]):
-        super(Tuple, self).__init__()
-        self.types = types
+    __slots__ = ('types',)
+
+    def __new__(cls, types: [Type]):
+        types = tuple(types)
+        key = ('tuple',) + types
+        ret = interned(key)
+        if ret is None:
+            ret = object.__new__(cls)
+            ret.types = types
+            ret.ground = all(t.ground for t in types)
+            ret.ftv_cache = NO_FTV if ret.ground else None
+            ret.size = 1 + sum(t.size for t in types)
+            ret.depth = 1 + max((t.depth for t in types), default=0)
+            intern(key, ret)
+        return ret
 
     def __str__(self):
-        return '({})'.format(', '.join(str(t) for t in self.types))
+        return show_type(self, limit=STR_LIMIT)
 
     def __repr__(self):
         return 'Tuple({})'.format(', '.join(str(t) for t in self.types))
 
-    def __eq__(self, other):
-        return self.__dict__ == other.__dict__
+    def __reduce__(self):
+        return Tuple, (self.types,)
 
     def arity(self) -> int:
         return len(self.types)
 
+    def sub_types(self) -> tuple:
+        return self.types
+
+    def rebuild(self, types: [Type]) -> Type:
+        return Tuple(types)
+
     def apply(self, subst):
+        if self.ground:
+            FTV_STATS['ground'] += 1
+            return self
+        if self.depth > RECURSION_MAX_DEPTH:
+            return substitute(self, subst)
         ok = True
         new_types = []
         for t in self.types:
             new_t = t.apply(subst)
             new_types.append(new_t)
-            if new_t != t:
+            if new_t is not t:
                 ok = False
         if ok:
             return self
         else:
-            return Tuple(new_types)
+            return self.rebuild(new_types)
 
-    def ftv(self) -> Set[str]:
+    def collect_ftv(self) -> Set[VarId]:
         ret = set()
         for t in self.types:
-            ret = ret.union(t.ftv())
+            ret.update(t.ftv_cache)
         return ret
 
     def to_raw(self) -> RExpr:
@@ -218,52 +403,63 @@ class Tuple(Type):
 
 
 class Defined(Type):
-
-    def __init__(self, name: str, types: [Type]):
-        super(Defined, self).__init__()
-        self.name = name
-        self.types = types
+    __slots__ = ('name', 'types')
+
+    def __new__(cls, name: str, types: [Type]):
+        types = tuple(types)
+        key = ('defined', name) + types
+        ret = interned(key)
+        if ret is None:
+            ret = object.__new__(cls)
+            ret.name = name
+            ret.types = types
+            ret.ground = all(t.ground for t in types)
+            ret.ftv_cache = NO_FTV if ret.ground else None
+            ret.size = 1 + sum(t.size for t in types)
+            ret.depth = 1 + max((t.depth for t in types), default=0)
+            intern(key, ret)
+        return ret
 
     def __str__(self):
-        ps = []
-        for t in self.types:
-            bulk = str(t)
-            if isinstance(t, TArr):
-                bulk = '({})'.format(bulk)
-            if isinstance(t, Defined) and len(t.types) > 0:
-                bulk = '({})'.format(bulk)
-            ps.append(bulk)
-        if ps:
-            return "{} {}".format(self.name, ' '.join(ps))
-        else:
-            return self.name
+        return show_type(self, limit=STR_LIMIT)
 
     def __repr__(self):
         return 'Defined[{}]({})'.format(self.name, ', '.join(repr(t) for t in self.types))
 
-    def __eq__(self, other):
-        return self.__dict__ == other.__dict__
+    def __reduce__(self):
+        return Defined, (self.name, self.types)
 
     def arity(self) -> int:
         return len(self.types)
 
+    def sub_types(self) -> tuple:
+        return self.types
+
+    def rebuild(self, types: [Type]) -> Type:
+        return Defined(self.name, types)
+
     def apply(self, subst):
+        if self.ground:
+            FTV_STATS['ground'] += 1
+            return self
+        if self.depth > RECURSION_MAX_DEPTH:
+            return substitute(self, subst)
         ok = True
         new_types = []
         for t in self.types:
             new_t = t.apply(subst)
             new_types.append(new_t)
-            if new_t != t:
+            if new_t is not t:
                 ok = False
         if ok:
             return self
         else:
-            return Defined(self.name, new_types)
+            return self.rebuild(new_types)
 
-    def ftv(self) -> Set[str]:
+    def collect_ftv(self) -> Set[VarId]:
         ret = set()
         for t in self.types:
-            ret = ret.union(t.ftv())
+            ret.update(t.ftv_cache)
         return ret
 
     def find_defined(self, name: str):
@@ -286,25 +482,264 @@ class Defined(Type):
             return RSymbol(self.name)
 
 
+def substitute(t: Type, subst) -> Type:
+    """
+    t with the variables in subst replaced, children before parents.
+    a subterm is rebuilt once however often it is shared, and only when
+    one of its children changed
+    """
+    done = dict()
+    stack = [(t, False)]
+    while stack:
+        node, ready = stack.pop()
+        key = id(node)
+        if key in done:
+            continue
+        if node is None or node.ground:
+            done[key] = node
+        elif isinstance(node, TVar):
+            done[key] = subst[node.v] if node.v in subst else node
+        elif not ready:
+            stack.append((node, True))
+            stack.extend((sub, False) for sub in node.sub_types())
+        else:
+            subs = node.sub_types()
+            new_subs = [done[id(sub)] for sub in subs]
+            if all(new is sub for new, sub in zip(new_subs, subs)):
+                done[key] = node
+            else:
+                done[key] = node.rebuild(new_subs)
+    return done[id(t)]
+
+
+# a subterm of at least this many nodes met more than once is printed
+# once, in the where clause of the type, and referred to as #1, #2, ...
+SHARE_MIN_SIZE = 16
+# longest text a type is printed as before it is cut, None prints it all
+STR_LIMIT = 10000
+
+
+class TypeCut(Exception):
+    """
+    the text of a type being printed reached its limit
+    """
+    pass
+
+
+def show_type(t: Type, prefix: str = '', limit: Optional[int] = None) -> str:
+    """
+    print t after prefix in time and space linear in its distinct nodes:
+    large shared subterms are written out once under a label, and the
+    text is cut with ... after limit chars
+    """
+    refs = dict()
+    stack = [t]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, (TArr, Tuple, Defined)):
+            key = id(node)
+            refs[key] = refs.get(key, 0) + 1
+            if refs[key] == 1:
+                if isinstance(node, TArr):
+                    stack.append(node.in_type)
+                    stack.append(node.out_type)
+                else:
+                    stack.extend(node.types)
+
+    def shared(node) -> bool:
+        return refs.get(id(node), 0) > 1 and node.size >= SHARE_MIN_SIZE
+
+    labels = dict()
+    pending = []
+    out = [prefix]
+    length = len(prefix)
+
+    def emit(text: str):
+        nonlocal length
+        out.append(text)
+        length += len(text)
+        if limit is not None and length > limit:
+            raise TypeCut()
+
+    def nested(node) -> bool:
+        # an argument of a type constructor needing parentheses
+        return not shared(node) and (isinstance(node, TArr) or
+                                     isinstance(node, Defined) and len(node.types) > 0)
+
+    def write(node, top=False):
+        # text and (type, top) pairs left to print, the next one last
+        todo = [(node, top)]
+        while todo:
+            item = todo.pop()
+            if isinstance(item, str):
+                emit(item)
+                continue
+            node, top = item
+            if node is None:
+                emit('_')
+            elif isinstance(node, TVar):
+                emit(var_name(node.v))
+            elif isinstance(node, TConst):
+                emit(node.name)
+            elif not top and shared(node):
+                label = labels.get(id(node))
+                if label is None:
+                    label = labels[id(node)] = '#{}'.format(len(labels) + 1)
+                    pending.append(node)
+                emit(label)
+            else:
+                parts = []
+                if isinstance(node, TArr):
+                    if isinstance(node.in_type, TArr) and not shared(node.in_type):
+                        parts.extend(('(', (node.in_type, False), ')'))
+                    else:
+                        parts.append((node.in_type, False))
+                    parts.extend((' -> ', (node.out_type, False)))
+                elif isinstance(node, Tuple):
+                    parts.append('(')
+                    for i, sub in enumerate(node.types):
+                        if i > 0:
+                            parts.append(', ')
+                        parts.append((sub, False))
+                    parts.append(')')
+                else:
+                    parts.append(node.name)
+                    for sub in node.types:
+                        parts.append(' ')
+                        if nested(sub):
+                            parts.extend(('(', (sub, False), ')'))
+                        else:
+                            parts.append((sub, False))
+                todo.extend(reversed(parts))
+
+    try:
+        write(t, top=True)
+        for i, node in enumerate(pending):
+            emit(' where ' if i == 0 else ', ')
+            emit('{} = '.format(labels[id(node)]))
+            write(node, top=True)
+    except TypeCut:
+        return ''.join(out)[:limit] + '...'
+    return ''.join(out)
+
+
+def compile_template(t: Type, index: Mapping[VarId, int]):
+    """
+    build a function copying the skeleton of t, where the variable at
+    index[v] is taken from its argument. subtrees free of those
+    variables are shared as they are, subtrees met more than once are
+    copied once per call. the closures call each other once per level,
+    so deeper types are substituted on a stack instead
+    """
+    if t is not None and t.depth > RECURSION_MAX_DEPTH:
+        return lambda fresh: substitute(t, {v: fresh[i] for v, i in index.items()})
+    refs = dict()
+    stack = [t]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, (TArr, Tuple, Defined)):
+            key = id(node)
+            refs[key] = refs.get(key, 0) + 1
+            if refs[key] == 1:
+                if isinstance(node, TArr):
+                    stack.append(node.in_type)
+                    stack.append(node.out_type)
+                else:
+                    stack.extend(node.types)
+    memo = dict()
+
+    def build(t: Type):
+        if t is None or index.keys().isdisjoint(t.ftv()):
+            return lambda fresh: t
+        if isinstance(t, TVar):
+            return itemgetter(index[t.v])
+        ret = memo.get(id(t))
+        if ret is not None:
+            return ret
+        if isinstance(t, TArr):
+            in_type = build(t.in_type)
+            out_type = build(t.out_type)
+            ret = lambda fresh: TArr(in_type(fresh), out_type(fresh))
+        elif isinstance(t, Tuple):
+            subs = [build(sub) for sub in t.types]
+            ret = lambda fresh: Tuple([sub(fresh) for sub in subs])
+        elif isinstance(t, Defined):
+            name = t.name
+            subs = [build(sub) for sub in t.types]
+            ret = lambda fresh: Defined(name, [sub(fresh) for sub in subs])
+        else:
+            raise ValueError("unknown type {}".format(t))
+        if refs[id(t)] > 1:
+            ret = copy_once(ret)
+        memo[id(t)] = ret
+        return ret
+
+    return build(t)
+
+
+def copy_once(template):
+    """
+    template of a shared subtree, remembering its copy for the last
+    argument so every other occurrence in that call reuses it
+    """
+    last = [None, None]
+
+    def run(fresh):
+        if last[0] is not fresh:
+            last[0] = fresh
+            last[1] = template(fresh)
+        return last[1]
+    return run
+
+
 class Schema(object):
+    __slots__ = ('vars', 'type', 'ftv_cache', 'template')
 
     def __init__(self, type: Type, vars: [TVar]):
         super(Schema, self).__init__()
         self.vars = vars
         self.type = type
+        self.ftv_cache = None
+        self.template = None
 
     def __str__(self):
         vars_str = '.'.join(str(v) for v in self.vars)
-        return 'forall {} => {}'.format(vars_str, str(self.type))
+        return show_type(self.type, 'forall {} => '.format(vars_str), limit=STR_LIMIT)
+
+    def __reduce__(self):
+        return Schema, (self.type, self.vars)
 
     def is_dummy(self) -> bool:
         return len(self.vars) == 0
 
-    def ftv(self):
-        return self.type.ftv().difference(set(v.v for v in self.vars))
+    def instantiate(self, fresh: [Type]) -> Type:
+        """
+        the type with the i-th quantified variable replaced by fresh[i],
+        through a template compiled on first use
+        """
+        template = self.template
+        if template is None:
+            index = {v.v: i for i, v in enumerate(self.vars)}
+            template = self.template = compile_template(self.type, index)
+        return template(fresh)
+
+    def ftv(self) -> FrozenSet[VarId]:
+        ret = self.ftv_cache
+        if ret is None:
+            FTV_STATS['computed'] += 1
+            if self.vars:
+                ret = self.type.ftv().difference(v.v for v in self.vars)
+            else:
+                ret = self.type.ftv()
+            self.ftv_cache = ret
+        else:
+            FTV_STATS['cached'] += 1
+        return ret
 
     def apply(self, subst):
         ftv = self.ftv()
+        if not ftv:
+            return self
         ok_subst = {k: v for k, v in subst.items() if k in ftv}
         if len(ok_subst) > 0:
             return Schema(self.type.apply(ok_subst), self.vars)
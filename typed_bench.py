@@ -0,0 +1,45 @@
+from argparse import ArgumentParser
+from pathlib import Path
+from timeit import default_timer as timer
+from parsing import whole_program
+from type_check import TypeChecker
+
+
+def check_all(programs, typed: bool) -> (float, int):
+    nodes = 0
+    start = timer()
+    for program in programs:
+        checker = TypeChecker()
+        if typed:
+            _, _, _, table, _ = checker.check_typed_content(program)
+            nodes += len(table)
+        else:
+            checker.check_content(program)
+    return timer() - start, nodes
+
+
+def main():
+    parser = ArgumentParser(description='time checking a corpus with and without the typed-IR side table')
+    parser.add_argument('root', nargs='?', default='test_src', help='directory of scripts')
+    parser.add_argument('--repeat', type=int, default=10, help='rounds of each mode, the best one counts')
+    ARGS = parser.parse_args()
+
+    programs = []
+    for path in sorted(Path(ARGS.root).rglob('*.rkt')):
+        with open(path, 'r') as f:
+            programs.append(whole_program.parse(f.read()))
+
+    # alternate the modes so drifting machine load hits both alike
+    plain, typed, nodes = [], [], 0
+    for _ in range(ARGS.repeat):
+        plain.append(check_all(programs, False)[0])
+        elapsed, nodes = check_all(programs, True)
+        typed.append(elapsed)
+    plain, typed = min(plain), min(typed)
+    print('{} scripts, {} typed nodes'.format(len(programs), nodes))
+    print('check_content:        {:.3f}s'.format(plain))
+    print('check_typed_content:  {:.3f}s ({:+.1f}%)'.format(typed, 100 * (typed - plain) / plain))
+
+
+if __name__ == '__main__':
+    main()
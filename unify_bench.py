@@ -0,0 +1,112 @@
+import tracemalloc
+from argparse import ArgumentParser
+from timeit import default_timer as timer
+from infer import *
+
+
+def chain_equations(n: int) -> [(Type, Type)]:
+    """
+    equations shaped like the output of constraint generation, every group
+    binds a function variable to a shallow arrow and links its result
+    variable to the next group
+    """
+    groups = n // 3
+    pairs = []
+    for k in range(groups):
+        f, x, y = TVar('f{}'.format(k)), TVar('x{}'.format(k)), TVar('y{}'.format(k))
+        pairs.append((f, TArr(x, y)))
+        pairs.append((x, Defined("List", [y])))
+        pairs.append((y, TVar('y{}'.format(k + 1))))
+    pairs.append((TVar('y{}'.format(groups)), TYPE_NUMBER))
+    return pairs
+
+
+def run_solver(solve, pairs) -> (float, Subst):
+    start = timer()
+    subst = solve(pairs)
+    return timer() - start, subst
+
+
+def balanced_type(depth: int, leaf: Type) -> Type:
+    """
+    a function type whose tree size doubles with every level
+    """
+    t = leaf
+    for i in range(depth):
+        t = TArr(Defined("List", [t]), Tuple([t, TYPE_NUMBER]))
+    return t
+
+
+def bench_solvers(max_eqs: int):
+    print('{:>8} {:>12} {:>12} {:>8}'.format('eqs', 'unifies(s)', 'union-find(s)', 'speedup'))
+    n = 100
+    while n <= max_eqs:
+        pairs = chain_equations(n)
+        old_time, old_subst = run_solver(unifies, pairs)
+        new_time, new_subst = run_solver(lambda ps: UnionFindSolver().solve(ps), pairs)
+
+        for k, v in old_subst.items():
+            assert str(new_subst[k]) == str(v), 'solver disagree on {}'.format(k)
+
+        print('{:>8} {:>12.4f} {:>12.4f} {:>8.1f}'.format(n, old_time, new_time, old_time / new_time))
+        n *= 2
+
+
+def bench_types(count: int, depth: int):
+    # memory of many types built from a small set of shapes
+    tracemalloc.start()
+    kept = []
+    for i in range(count):
+        elem = TVar('a{}'.format(i % 100))
+        kept.append(TArr(Defined("List", [elem]), TArr(elem, TYPE_NUMBER)))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print('{} function types over 100 shapes: {:.1f} KiB peak, {:.1f} bytes per type'.format(
+        count, peak / 1024, peak / count))
+    del kept
+
+    # memory of types that are all different
+    tracemalloc.start()
+    kept = [TArr(Defined("List", [TVar('b{}'.format(i))]), TYPE_NUMBER) for i in range(count)]
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print('{} distinct function types: {:.1f} KiB peak, {:.1f} bytes per type'.format(
+        count, peak / 1024, peak / count))
+    del kept
+
+    # unify of structurally equal types built separately
+    t1 = balanced_type(depth, TVar('x'))
+    t2 = balanced_type(depth, TVar('x'))
+    repeat = 100
+    start = timer()
+    for _ in range(repeat):
+        UnionFindSolver().unify(t1, t2)
+    elapsed = timer() - start
+    print('unify of equal types (depth {}): {:.1f} unify/s'.format(depth, repeat / elapsed))
+
+    # substitution that only touches one leaf of a large type
+    t3 = TArr(balanced_type(depth, TYPE_BOOL), TVar('y'))
+    subst = {'y': TYPE_NUMBER}
+    start = timer()
+    for _ in range(repeat):
+        t3.apply(subst)
+    elapsed = timer() - start
+    print('apply on a mostly ground type (depth {}): {:.1f} apply/s'.format(depth, repeat / elapsed))
+
+
+def main():
+    parser = ArgumentParser(description='benchmark unification and type representation')
+    parser.add_argument('--max', type=int, default=1600, help='largest equation count')
+    parser.add_argument('--types', action='store_true', help='measure type memory and unify throughput')
+    parser.add_argument('--count', type=int, default=100000, help='types built for the memory measure')
+    parser.add_argument('--depth', type=int, default=10, help='depth of the large types')
+    ARGS = parser.parse_args()
+
+    if ARGS.types:
+        bench_types(ARGS.count, ARGS.depth)
+    else:
+        bench_solvers(ARGS.max)
+
+
+if __name__ == '__main__':
+    main()